@@ -1,14 +1,244 @@
-from django.contrib import admin
-from .models import Aluno, Mensalidade
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.db import transaction
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from .busca import termos
+from .models import Aluno, FrequenciaMensal, Mensalidade, Pagamento, Presenca, Tarefa, UserProfile
+from .paginacao import PaginadorEstimado
+from . import cache_academia, frequencia, lote, pagamentos, receitas
+
+class TabelaGrandeAdmin(admin.ModelAdmin):
+    """Listas do admin para tabelas de centenas de milhares de linhas.
+
+    O total vem da estimativa do Postgres (ver paginacao.PaginadorEstimado), filtrar não
+    conta a tabela inteira de novo, e a busca usa `Aluno.busca` (índice de trigramas no
+    Postgres) pelo caminho `campo_busca`, em vez de icontains em colunas sem índice.
+    Quem exibe chaves estrangeiras na lista declara `list_select_related`.
+    """
+    paginator = PaginadorEstimado
+    show_full_result_count = False
+    campo_busca = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # `campo_busca` é sempre o `busca` de um aluno (o próprio ou o da mensalidade, presença...)
+        if self.campo_busca is not None and self.search_help_text is None:
+            self.search_help_text = 'Nome, telefone ou email do aluno (acentos e máscara são ignorados).'
+
+    def get_search_results(self, request, queryset, search_term):
+        if self.campo_busca is None:
+            return super().get_search_results(request, queryset, search_term)
+        for palavra in termos(search_term):
+            queryset = queryset.filter(**{f'{self.campo_busca}__contains': palavra})
+        return queryset, False
+
+class PagamentosEmCascataMixin:
+    """O livro de pagamentos é só leitura no admin, mas os pagamentos saem junto com a
+    mensalidade ou o aluno excluído (os hooks de exclusão acertam saldo e receita)."""
+
+    def get_deleted_objects(self, objs, request):
+        excluidos, contagem, sem_permissao, protegidos = super().get_deleted_objects(objs, request)
+        sem_permissao.discard(Pagamento._meta.verbose_name)
+        return excluidos, contagem, sem_permissao, protegidos
 
 @admin.register(Aluno)
-class AlunoAdmin(admin.ModelAdmin):
-    list_display = ('nome', 'faixa', 'telefone', 'ativo', 'bolsista')
+class AlunoAdmin(PagamentosEmCascataMixin, TabelaGrandeAdmin):
+    list_display = ('nome', 'faixa', 'telefone', 'owner', 'ativo', 'bolsista', 'saldo_devedor')
     list_filter = ('faixa', 'ativo', 'bolsista')
-    search_fields = ('nome', 'telefone', 'email')
+    list_select_related = ('owner',)
+    search_fields = ('busca',)
+    campo_busca = 'busca'
+    autocomplete_fields = ('owner',)
+
+    # Trocar o dono ou excluir o aluno move/remove as mensalidades pagas da receita diária
+    # (e a frequência mensal, que guarda o dono para o ranking) e os pagamentos dos relatórios
+    # gravados; o cache dos dois donos é descartado
+    def save_model(self, request, obj, form, change):
+        if change and 'owner' in form.changed_data:
+            with transaction.atomic():
+                receitas.registrar_remocao(Mensalidade.objects.filter(aluno=obj))
+                pagamentos.descartar_relatorios(Mensalidade.objects.filter(aluno=obj))
+                super().save_model(request, obj, form, change)
+                receitas.registrar_inclusao(Mensalidade.objects.filter(aluno=obj))
+                pagamentos.descartar_relatorios(Mensalidade.objects.filter(aluno=obj))
+                FrequenciaMensal.objects.filter(aluno=obj).update(owner=obj.owner)
+                cache_academia.invalidar(form.initial.get('owner'), obj.owner_id)
+        else:
+            super().save_model(request, obj, form, change)
+            cache_academia.invalidar(obj.owner_id)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            receitas.registrar_remocao(Mensalidade.objects.filter(aluno=obj))
+            pagamentos.descartar_relatorios(Mensalidade.objects.filter(aluno=obj))
+            super().delete_model(request, obj)
+            cache_academia.invalidar(obj.owner_id)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            donos = set(queryset.values_list('owner', flat=True))
+            receitas.registrar_remocao(Mensalidade.objects.filter(aluno__in=queryset))
+            pagamentos.descartar_relatorios(Mensalidade.objects.filter(aluno__in=queryset))
+            super().delete_queryset(request, queryset)
+            cache_academia.invalidar(*donos)
+
+class MensalidadeActionForm(ActionForm):
+    # Parâmetros das ações em lote, exibidos ao lado do seletor de ações
+    dias = forms.IntegerField(required=False, min_value=-365, max_value=365, label='Dias (adiar)')
+    metodo_pagamento = forms.ChoiceField(
+        choices=Pagamento.METODO_CHOICES, initial='NAO_INFORMADO', required=False, label='Forma de pagamento',
+    )
 
 @admin.register(Mensalidade)
-class MensalidadeAdmin(admin.ModelAdmin):
-    list_display = ('aluno', 'data_vencimento', 'valor', 'status', 'data_pagamento')
+class MensalidadeAdmin(PagamentosEmCascataMixin, TabelaGrandeAdmin):
+    list_display = ('aluno', 'data_vencimento', 'valor', 'valor_pago', 'status', 'data_pagamento')
     list_filter = ('status', 'data_vencimento')
-    search_fields = ('aluno__nome',)
+    # A coluna "aluno" e o __str__ leem o aluno: vem no mesmo SELECT
+    list_select_related = ('aluno',)
+    date_hierarchy = 'data_vencimento'
+    search_fields = ('aluno__busca',)
+    campo_busca = 'aluno__busca'
+    autocomplete_fields = ('aluno',)
+    action_form = MensalidadeActionForm
+    actions = ['quitar', 'adiar']
+
+    def parametro(self, request, nome):
+        # O seletor de ações é validado pelo admin; aqui só o campo que a ação usa
+        try:
+            return self.action_form.base_fields[nome].clean(request.POST.get(nome))
+        except forms.ValidationError:
+            return None
+
+    @admin.action(description='Marcar como pagas (quita o saldo hoje)')
+    def quitar(self, request, queryset):
+        metodo = self.parametro(request, 'metodo_pagamento') or 'NAO_INFORMADO'
+        self.message_user(request, f'{lote.quitar(queryset, metodo=metodo)} mensalidade(s) marcada(s) como paga(s).')
+
+    @admin.action(description='Adiar o vencimento (informe os dias)')
+    def adiar(self, request, queryset):
+        dias = self.parametro(request, 'dias')
+        if not dias:
+            self.message_user(request, 'Informe quantos dias adiar (entre -365 e 365).', messages.ERROR)
+            return
+        self.message_user(request, f'Vencimento de {lote.adiar(queryset, dias)} mensalidade(s) movido em {dias} dia(s).')
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            antes, pendencia, donos = None, None, {obj.aluno.owner_id}
+            if change:
+                anterior = Mensalidade.objects.select_related('aluno').get(pk=obj.pk)
+                antes = receitas.contribuicao(anterior)
+                pendencia = pagamentos.pendencia(anterior)
+                donos.add(anterior.aluno.owner_id)
+            super().save_model(request, obj, form, change)
+            receitas.registrar_alteracao(antes, receitas.contribuicao(obj))
+            pagamentos.registrar_alteracao(pendencia, pagamentos.pendencia(obj))
+            cache_academia.invalidar(*donos)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            receitas.registrar_remocao(Mensalidade.objects.filter(pk=obj.pk))
+            pagamentos.registrar_remocao(Mensalidade.objects.filter(pk=obj.pk))
+            super().delete_model(request, obj)
+            cache_academia.invalidar(obj.aluno.owner_id)
+
+    def delete_queryset(self, request, queryset):
+        # Ação "Excluir selecionados": o mesmo caminho da exclusão em lote da lista
+        lote.excluir(queryset)
+
+@admin.register(Pagamento)
+class PagamentoAdmin(TabelaGrandeAdmin):
+    """Livro de pagamentos, só leitura: o saldo e a receita derivam dele, e as correções
+    passam pela mensalidade (ver alunos/pagamentos.py)."""
+    list_display = ('mensalidade', 'data_pagamento', 'valor_pago', 'metodo_pagamento', 'data_registro')
+    list_filter = ('metodo_pagamento',)
+    list_select_related = ('mensalidade__aluno',)
+    date_hierarchy = 'data_pagamento'
+    search_fields = ('mensalidade__aluno__busca',)
+    campo_busca = 'mensalidade__aluno__busca'
+    raw_id_fields = ('mensalidade',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(Presenca)
+class PresencaAdmin(TabelaGrandeAdmin):
+    list_display = ('aluno', 'data', 'presente')
+    list_filter = ('presente',)
+    list_select_related = ('aluno',)
+    date_hierarchy = 'data'
+    # Pelo índice (data, aluno), sem o JOIN da ordenação padrão do modelo por aluno__nome
+    ordering = ('-data',)
+    search_fields = ('aluno__busca',)
+    campo_busca = 'aluno__busca'
+    autocomplete_fields = ('aluno',)
+
+    # Presença alterada ou excluída: a frequência mensal do aluno é recontada no mês antigo
+    # e no novo (ver alunos/frequencia.py)
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            afetados = {(obj.aluno_id, obj.data)}
+            if change:
+                anterior = Presenca.objects.values_list('aluno', 'data').get(pk=obj.pk)
+                afetados.add(anterior)
+            super().save_model(request, obj, form, change)
+            self.recontar(afetados)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            self.recontar({(obj.aluno_id, obj.data)})
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            afetados = set(queryset.order_by().annotate(mes=TruncMonth('data')).values_list('aluno', 'mes').distinct())
+            super().delete_queryset(request, queryset)
+            self.recontar(afetados)
+
+    def recontar(self, afetados):
+        por_mes = {}
+        for aluno_id, data in afetados:
+            por_mes.setdefault(frequencia.mes_de(data), set()).add(aluno_id)
+        for mes, aluno_ids in por_mes.items():
+            frequencia.atualizar_frequencias(aluno_ids, mes)
+        donos = Aluno.objects.filter(pk__in={aluno_id for aluno_id, _ in afetados}).values_list('owner', flat=True)
+        cache_academia.invalidar(*set(donos))
+
+@admin.register(UserProfile)
+class UserProfileAdmin(TabelaGrandeAdmin):
+    list_display = ('user', 'nome_completo', 'telefone', 'dark_mode', 'accepted_terms_at')
+    list_filter = ('dark_mode',)
+    list_select_related = ('user',)
+    search_fields = ('user__username',)
+    search_help_text = 'Nome de usuário exato.'
+    raw_id_fields = ('user',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Igualdade pela restrição única de username, em vez de icontains sem índice
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(user__username=search_term.strip()), False
+
+@admin.register(Tarefa)
+class TarefaAdmin(TabelaGrandeAdmin):
+    list_display = ('pk', 'tipo', 'owner', 'status', 'tentativas', 'executar_em', 'progresso_atual', 'progresso_total', 'concluida_em')
+    list_filter = ('status', 'tipo')
+    list_select_related = ('owner',)
+    exclude = ('anexo',)
+    readonly_fields = ('chave', 'trabalhador', 'reservada_ate', 'resultado', 'erro', 'criada_em', 'concluida_em')
+    actions = ['reenfileirar']
+
+    @admin.action(description='Executar de novo (zera as tentativas)')
+    def reenfileirar(self, request, queryset):
+        atualizadas = queryset.exclude(status='EXECUTANDO').update(
+            status='PENDENTE', tentativas=0, executar_em=timezone.now(), reservada_ate=None, concluida_em=None,
+        )
+        self.message_user(request, f'{atualizadas} tarefa(s) de volta à fila.')
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class AlunosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'alunos'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from .busca import reparar_indice_fts
+
+        post_migrate.connect(reparar_indice_fts, sender=self)
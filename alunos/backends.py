@@ -0,0 +1,21 @@
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+
+from .models import UserProfile
+
+
+class PerfilBackend(ModelBackend):
+    """ModelBackend que carrega o perfil no mesmo SELECT do usuário da sessão.
+
+    O base.html lê `user.profile` em toda página; sem o JOIN seria uma consulta a mais por requisição.
+    """
+
+    def get_user(self, user_id):
+        try:
+            user = User._default_manager.select_related('profile').get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        if not hasattr(user, 'profile'):
+            # Usuário criado sem passar pelo sinal (ex.: loaddata); o JOIN já mostrou que falta
+            user.profile = UserProfile.objects.create(user=user)
+        return user if self.user_can_authenticate(user) else None
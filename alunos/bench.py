@@ -0,0 +1,141 @@
+"""Benchmark em processo das rotas de `alunos`, pelo cliente de testes do Django.
+
+Cada requisição roda numa transação desfeita no fim, para que todas as repetições
+(inclusive as de POST) vejam os mesmos dados.
+"""
+import json
+import math
+import re
+import statistics
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import NoReverseMatch, reverse
+from django.utils import timezone
+
+from .models import Aluno, Mensalidade, Tarefa
+
+SAVEPOINT = re.compile(r'(RELEASE |ROLLBACK TO )?SAVEPOINT ')
+
+# Rotas que não são (só) GET
+METODOS = {
+    'registrar-pagamento': ['get', 'post'],
+    'mensalidades-em-lote': ['post'],
+    'gerar-mensalidades': ['get', 'post'],
+    'excluir-mensalidade': ['post'],
+    'editar-mensalidade': ['get', 'post'],
+    'update-theme': ['post'],
+    'chamada': ['get', 'post'],
+}
+
+
+def pedidos(owner):
+    """{rota: (args da URL, dados do POST)} para as rotas que precisam de objetos do `owner`."""
+    mensalidades = Mensalidade.objects.filter(aluno__owner=owner, aluno__ativo=True).order_by('pk')
+    paga = mensalidades.filter(status='PAGO').first()
+    pendente = mensalidades.filter(status__in=Mensalidade.EM_ABERTO).first()
+    ativos = list(Aluno.objects.filter(owner=owner, ativo=True).order_by('nome', 'pk').values_list('pk', flat=True)[:40])
+    tarefa = Tarefa.objects.filter(owner=owner).order_by('-pk').first()
+    pedidos = {
+        'update-theme': ([], json.dumps({'dark_mode': False})),
+        'chamada': ([], {'data': timezone.localdate().isoformat(), 'alunos': ativos, 'presentes': ativos[::2]}),
+        'exportar': (['mensalidades'], {}),
+    }
+    if paga is not None:
+        pedidos['aluno-update'] = ([paga.aluno_id], {})
+        pedidos['excluir-mensalidade'] = ([paga.pk], {})
+        pedidos['editar-mensalidade'] = ([paga.pk], {
+            'aluno': paga.aluno_id, 'valor': str(paga.valor), 'data_vencimento': paga.data_vencimento.isoformat(),
+        })
+    if pendente is not None:
+        pedidos['registrar-pagamento'] = ([pendente.pk], {})
+        em_aberto = mensalidades.filter(status__in=Mensalidade.EM_ABERTO).values_list('pk', flat=True)
+        pedidos['mensalidades-em-lote'] = ([], {'acao': 'quitar', 'mensalidades': list(em_aberto[:30])})
+    if tarefa is not None:
+        pedidos['tarefa'] = ([tarefa.pk], {})
+        pedidos['tarefa-progresso'] = ([tarefa.pk], {})
+    return pedidos
+
+
+def rotas():
+    from .urls import urlpatterns
+    return [(padrao.name, metodo) for padrao in urlpatterns for metodo in METODOS.get(padrao.name, ['get'])]
+
+
+class Cronometro:
+    """`execute_wrapper` que conta as consultas e soma o tempo gasto no banco."""
+
+    def __init__(self):
+        self.consultas = 0
+        self.segundos = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if not SAVEPOINT.match(sql):
+                self.consultas += 1
+                self.segundos += time.perf_counter() - inicio
+
+
+def percentil(valores, p):
+    """Percentil por posição mais próxima (p entre 0 e 100)."""
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def medir(client, rota, metodo, args, dados, repeticoes, aquecimento):
+    url = reverse(rota, args=args)
+    extra = {'content_type': 'application/json'} if isinstance(dados, str) else {}
+    tempos, consultas, sql = [], [], []
+    status = None
+    for i in range(aquecimento + repeticoes):
+        cronometro = Cronometro()
+        with transaction.atomic(), connection.execute_wrapper(cronometro):
+            inicio = time.perf_counter()
+            resposta = getattr(client, metodo)(url, data=dados if metodo == 'post' else {}, **extra)
+            if resposta.streaming:
+                for _ in resposta.streaming_content:
+                    pass
+            decorrido = time.perf_counter() - inicio
+            transaction.set_rollback(True)
+        status = resposta.status_code
+        if i >= aquecimento:
+            tempos.append(decorrido * 1000)
+            consultas.append(cronometro.consultas)
+            sql.append(cronometro.segundos * 1000)
+    return {
+        'rota': rota,
+        'metodo': metodo.upper(),
+        'status': status,
+        'p50_ms': round(percentil(tempos, 50), 2),
+        'p95_ms': round(percentil(tempos, 95), 2),
+        'p99_ms': round(percentil(tempos, 99), 2),
+        'media_ms': round(statistics.fmean(tempos), 2),
+        'consultas': max(consultas),
+        'sql_ms': round(statistics.median(sql), 2),
+    }
+
+
+def executar(owner, repeticoes=20, aquecimento=2, apenas=None):
+    """Mede todas as rotas de `alunos` (ou só as de `apenas`) logado como `owner`."""
+    client = Client()
+    client.force_login(owner)
+    por_rota = pedidos(owner)
+    resultados = []
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        for rota, metodo in rotas():
+            if apenas and rota not in apenas:
+                continue
+            args, dados = por_rota.get(rota, ([], {}))
+            try:
+                reverse(rota, args=args)
+            except NoReverseMatch:
+                resultados.append({'rota': rota, 'metodo': metodo.upper(), 'ignorada': 'sem dados do owner para montar a URL'})
+                continue
+            resultados.append(medir(client, rota, metodo, args, dados, repeticoes, aquecimento))
+    return resultados
@@ -0,0 +1,186 @@
+"""Busca indexada de alunos por nome, telefone e email.
+
+O campo `Aluno.busca` guarda o texto normalizado (minúsculo, sem acentos, telefone só
+com dígitos). No Postgres ele tem um índice GIN de trigramas (pg_trgm); no SQLite é
+espelhado na tabela FTS5 `alunos_aluno_fts`, mantida por triggers.
+"""
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import F, Q
+
+from .models import Aluno
+
+TABELA_FTS = 'alunos_aluno_fts'
+# Trigramas não indexam termos menores que 3 caracteres
+TAMANHO_MINIMO_INDEXADO = 3
+# Caracteres inseridos pela máscara do jquery.mask: "(00) 0 0000-0000"
+TELEFONE = re.compile(r'[\d\s().+\-/]+')
+
+_extensao_trigram = {}
+_tabela_fts = {}
+
+
+def normalizar(texto):
+    """Minúsculas, sem acentos e com espaços simples: 'João  Conceição' -> 'joao conceicao'."""
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return ' '.join(sem_acentos.lower().split())
+
+
+def so_digitos(texto):
+    return re.sub(r'\D', '', texto or '')
+
+
+def formatar_telefone(texto):
+    """Telefone no formato da máscara do formulário, "(00) 0 0000-0000" ou "(00) 0000-0000",
+    venha como vier (com ou sem DDI 55); None se não tiver 10 ou 11 dígitos com DDD."""
+    digitos = so_digitos(texto)
+    if len(digitos) in (12, 13) and digitos.startswith('55'):
+        digitos = digitos[2:]
+    if len(digitos) == 11:
+        return f'({digitos[:2]}) {digitos[2]} {digitos[3:7]}-{digitos[7:]}'
+    if len(digitos) == 10:
+        return f'({digitos[:2]}) {digitos[2:6]}-{digitos[6:]}'
+    return None
+
+
+def texto_de_busca(nome, telefone, email):
+    return ' '.join(filter(None, [normalizar(nome), normalizar(email), so_digitos(telefone)]))
+
+
+def termos(consulta):
+    """Termos normalizados da consulta; um telefone (com ou sem máscara) vira um só termo de dígitos."""
+    consulta = (consulta or '').strip()
+    if TELEFONE.fullmatch(consulta) and so_digitos(consulta):
+        return [so_digitos(consulta)]
+    return normalizar(consulta).split()
+
+
+def buscar_alunos(owner, consulta):
+    """Alunos do `owner` que casam com `consulta`, do mais ao menos relevante."""
+    palavras = termos(consulta)
+    queryset = Aluno.objects.filter(owner=owner)
+    if not palavras:
+        return queryset.order_by('nome', 'pk')
+    if connection.vendor == 'postgresql':
+        return _buscar_postgres(queryset, palavras)
+    indexados = [p for p in palavras if len(p) >= TAMANHO_MINIMO_INDEXADO]
+    if connection.vendor == 'sqlite' and indexados and fts_disponivel():
+        queryset = _buscar_fts(queryset, indexados)
+        palavras = [p for p in palavras if p not in indexados]
+    else:
+        queryset = queryset.order_by('nome', 'pk')
+    for palavra in palavras:
+        queryset = queryset.filter(busca__contains=palavra)
+    return queryset
+
+
+def _buscar_fts(queryset, palavras):
+    # Junção com a tabela FTS (sem limite de resultados, como no Postgres); o rank do
+    # FTS5 é menor para os mais relevantes
+    expressao = ' AND '.join('"%s"' % p.replace('"', '""') for p in palavras)
+    tabela = Aluno._meta.db_table
+    return queryset.extra(
+        tables=[TABELA_FTS],
+        where=[f'{TABELA_FTS}.rowid = {tabela}.id', f'{TABELA_FTS} MATCH %s'],
+        params=[expressao],
+        select={'relevancia': f'{TABELA_FTS}.rank'},
+        order_by=['relevancia', 'nome', 'id'],
+    )
+
+
+def _buscar_postgres(queryset, palavras):
+    filtro = Q()
+    for palavra in palavras:
+        filtro &= Q(busca__contains=palavra)
+    if not trigram_disponivel():
+        return queryset.filter(filtro).order_by('nome', 'pk')
+
+    from django.contrib.postgres.lookups import TrigramWordSimilar
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    consulta = ' '.join(palavras)
+    # Substring exata ou parecida (erros de digitação), ambas atendidas pelo índice GIN
+    return (
+        queryset
+        .filter(filtro | TrigramWordSimilar(F('busca'), consulta))
+        .annotate(relevancia=TrigramWordSimilarity(consulta, 'busca'))
+        .order_by('-relevancia', 'nome', 'pk')
+    )
+
+
+def fts_disponivel():
+    if connection.alias not in _tabela_fts:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [TABELA_FTS])
+            _tabela_fts[connection.alias] = cursor.fetchone() is not None
+    return _tabela_fts[connection.alias]
+
+
+def trigram_disponivel():
+    if connection.alias not in _extensao_trigram:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _extensao_trigram[connection.alias] = cursor.fetchone() is not None
+    return _extensao_trigram[connection.alias]
+
+
+def garantir_indice_busca(conexao):
+    """Cria o índice de busca do banco em uso (trigramas no Postgres, FTS5 no SQLite). Idempotente."""
+    with conexao.cursor() as cursor:
+        if conexao.vendor == 'postgresql':
+            cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+            if cursor.fetchone() is None:
+                return
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            _extensao_trigram.pop(conexao.alias, None)
+            cursor.execute(
+                'CREATE INDEX CONCURRENTLY IF NOT EXISTS aluno_busca_trgm_idx '
+                'ON alunos_aluno USING gin (busca gin_trgm_ops)'
+            )
+            return
+        if conexao.vendor != 'sqlite':
+            return
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'alunos_aluno'")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            [f'{TABELA_FTS}_%'],
+        )
+        if cursor.fetchone()[0] == 3:
+            return
+        _tabela_fts.pop(conexao.alias, None)
+        try:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA_FTS} USING fts5("
+                f"busca, content='alunos_aluno', content_rowid='id', tokenize='trigram')"
+            )
+        except Exception:
+            # SQLite sem FTS5 ou sem o tokenizer trigram (< 3.34): fica a busca sem índice
+            return
+        cursor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {TABELA_FTS}_ai AFTER INSERT ON alunos_aluno BEGIN '
+            f'INSERT INTO {TABELA_FTS}(rowid, busca) VALUES (new.id, new.busca); END'
+        )
+        cursor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {TABELA_FTS}_ad AFTER DELETE ON alunos_aluno BEGIN '
+            f"INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, busca) VALUES ('delete', old.id, old.busca); END"
+        )
+        cursor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {TABELA_FTS}_au AFTER UPDATE OF busca ON alunos_aluno BEGIN '
+            f"INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, busca) VALUES ('delete', old.id, old.busca); "
+            f'INSERT INTO {TABELA_FTS}(rowid, busca) VALUES (new.id, new.busca); END'
+        )
+        cursor.execute(f"INSERT INTO {TABELA_FTS}({TABELA_FTS}) VALUES ('rebuild')")
+
+
+def reparar_indice_fts(using, **kwargs):
+    """Receptor de `post_migrate`: no SQLite, recriar `alunos_aluno` numa migração (AddField,
+    AlterField...) descarta os triggers do FTS; aqui eles são recriados e o índice reconstruído."""
+    from django.db import connections
+
+    if connections[using].vendor == 'sqlite':
+        garantir_indice_busca(connections[using])
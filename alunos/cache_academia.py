@@ -0,0 +1,101 @@
+"""Cache por academia (owner) com número de versão.
+
+Cada entrada é gravada sob a versão atual do owner; qualquer escrita nos dados dele
+incrementa a versão (`invalidar`) e as entradas antigas simplesmente deixam de ser lidas
+e expiram sozinhas, sem varrer chaves. Funciona com os backends de memória local, arquivo
+ou Redis configurados em CACHES; com `settings.CACHE_ACADEMIA` desligado (cache que o
+worker da fila não enxerga) tudo vai direto ao banco.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from ct_gouveia import metricas
+
+TEMPO_PADRAO = 60 * 60
+TEMPO_TRAVA = 30
+ESPERA_MAXIMA = 2.0
+INTERVALO_ESPERA = 0.05
+
+_AUSENTE = object()
+
+
+def ativo():
+    return getattr(settings, 'CACHE_ACADEMIA', True)
+
+
+def _cache():
+    return caches['default']
+
+
+def _chave_versao(owner_id):
+    return f'bel:versao:{owner_id}'
+
+
+def versao(owner_id):
+    cache = _cache()
+    atual = cache.get(_chave_versao(owner_id))
+    if atual is None:
+        # Versão inicial única: se a chave for descartada pelo backend, as entradas
+        # gravadas sob a versão perdida nunca voltam a ser lidas
+        cache.add(_chave_versao(owner_id), time.time_ns(), None)
+        atual = cache.get(_chave_versao(owner_id))
+    return atual
+
+
+def _incrementar(owner_id):
+    cache = _cache()
+    try:
+        cache.incr(_chave_versao(owner_id))
+    except ValueError:
+        cache.add(_chave_versao(owner_id), time.time_ns(), None)
+
+
+def invalidar(*owner_ids):
+    """Descarta o cache das academias de `owner_ids`.
+
+    Incrementa já (para quem ler dentro da mesma transação) e de novo depois do commit,
+    para descartar o que outro processo tenha guardado lendo os dados antigos nesse meio tempo.
+    """
+    if not ativo():
+        return
+    for owner_id in owner_ids:
+        _incrementar(owner_id)
+    transaction.on_commit(lambda: [_incrementar(owner_id) for owner_id in owner_ids])
+
+
+def obter(owner_id, nome, construir, tempo=TEMPO_PADRAO):
+    """Valor de `nome` no cache do owner, ou `construir()` gravado nele.
+
+    Só um processo reconstrói cada entrada por vez (trava com cache.add); os demais esperam
+    até ESPERA_MAXIMA pelo resultado antes de desistir e construir por conta própria.
+    `nome` pode ter partes separadas por ':'; a primeira identifica a estatística de acertos.
+    """
+    if not ativo():
+        return construir()
+    cache = _cache()
+    chave = f'bel:{owner_id}:{versao(owner_id)}:{nome}'
+    estatistica = nome.split(':', 1)[0]
+    valor = cache.get(chave, _AUSENTE)
+    if valor is not _AUSENTE:
+        metricas.registrar_cache(estatistica, acerto=True)
+        return valor
+    metricas.registrar_cache(estatistica, acerto=False)
+
+    trava = f'{chave}:trava'
+    if not cache.add(trava, 1, TEMPO_TRAVA):
+        limite = time.monotonic() + ESPERA_MAXIMA
+        while time.monotonic() < limite:
+            time.sleep(INTERVALO_ESPERA)
+            valor = cache.get(chave, _AUSENTE)
+            if valor is not _AUSENTE:
+                return valor
+        return construir()
+    try:
+        valor = construir()
+        cache.set(chave, valor, tempo)
+        return valor
+    finally:
+        cache.delete(trava)
@@ -0,0 +1,45 @@
+"""Chamada da turma: todas as presenças de um dia gravadas num único INSERT ... ON CONFLICT."""
+from django.db.models import OuterRef, Subquery
+
+from .frequencia import atualizar_frequencias, mes_de
+from .models import Aluno, FrequenciaMensal, Presenca
+
+TAMANHO_LOTE = 500
+
+
+def alunos_da_chamada(owner, data):
+    """Alunos ativos do `owner`, em ordem de nome, anotados com a presença já marcada em `data`
+    (ou None) e com as presenças do mês (`frequencia_mes`)."""
+    marcada = Presenca.objects.filter(aluno=OuterRef('pk'), data=data).values('presente')[:1]
+    no_mes = FrequenciaMensal.objects.filter(aluno=OuterRef('pk'), mes=mes_de(data)).values('total')[:1]
+    return (
+        Aluno.objects
+        .filter(owner=owner, ativo=True)
+        .annotate(presente=Subquery(marcada), frequencia_mes=Subquery(no_mes))
+        .order_by('nome', 'pk')
+    )
+
+
+def registrar_chamada(owner, data, marcacoes):
+    """Grava `marcacoes` ({aluno_id: presente}) em `data`, inserindo ou atualizando cada (aluno, data).
+
+    Ids que não são alunos do `owner` são ignorados e devolvidos. Retorna (gravadas, ignorados).
+    """
+    validos = set(
+        Aluno.objects.filter(owner=owner, pk__in=list(marcacoes)).values_list('pk', flat=True)
+    )
+    presencas = [
+        Presenca(aluno_id=aluno_id, data=data, presente=bool(presente))
+        for aluno_id, presente in marcacoes.items()
+        if aluno_id in validos
+    ]
+    Presenca.objects.bulk_create(
+        presencas,
+        batch_size=TAMANHO_LOTE,
+        update_conflicts=True,
+        unique_fields=['aluno', 'data'],
+        update_fields=['presente'],
+    )
+    atualizar_frequencias([p.aluno_id for p in presencas], data)
+    ignorados = sorted(aluno_id for aluno_id in marcacoes if aluno_id not in validos)
+    return len(presencas), ignorados
@@ -0,0 +1,111 @@
+"""Academias sintéticas em escala configurável, para benchmarks e testes de carga locais."""
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from . import frequencia, pagamentos, receitas
+from .models import Aluno, Mensalidade, Pagamento, Presenca
+
+TAMANHO_LOTE = 2000
+FAIXAS = [codigo for _, grupo in Aluno._meta.get_field('faixa').choices for codigo, _ in grupo]
+NOMES = ['Ana', 'Bruno', 'Carla', 'Diego', 'Eduarda', 'Felipe', 'Gabriela', 'Henrique', 'Isabela', 'João',
+         'Júlia', 'Lucas', 'Mariana', 'Nicolas', 'Otávio', 'Paula', 'Rafael', 'Sofia', 'Thiago', 'Vitória']
+SOBRENOMES = ['Silva', 'Santos', 'Oliveira', 'Souza', 'Conceição', 'Lima', 'Gonçalves', 'Araújo', 'Ribeiro',
+              'Gouveia', 'Fernandes', 'Almeida', 'Pereira', 'Carvalho', 'Gomes', 'Martins']
+METODOS = [codigo for codigo, _ in Pagamento.METODO_CHOICES if codigo != 'NAO_INFORMADO']
+
+
+def atualizar_estatisticas(*modelos):
+    """ANALYZE nas tabelas de `modelos`: depois de uma carga em massa, sem estatísticas novas o
+    planejador trata as tabelas como vazias e escolhe junções ruins para as reconstruções."""
+    with connection.cursor() as cursor:
+        for modelo in modelos:
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(modelo._meta.db_table)}')
+
+
+def criar_professor(username, senha):
+    professor, _ = User.objects.get_or_create(username=username, defaults={'is_staff': True})
+    professor.is_staff = True
+    professor.set_password(senha)
+    professor.save()
+    return professor
+
+
+def gerar_academia(owner, alunos, meses, presencas, hoje, rng=None):
+    """Cria `alunos` alunos do `owner` com `meses` mensalidades (e pagamentos) e `presencas` presenças cada.
+
+    Tudo em bulk_create; no fim a receita diária, os saldos devedores e a frequência mensal do
+    owner são reconstruídos.
+    Devolve um dict com o número de linhas criadas por tabela.
+    """
+    rng = rng or random.Random()
+    with transaction.atomic():
+        novos = []
+        for i in range(alunos):
+            aluno = Aluno(
+                nome=f'{rng.choice(NOMES)} {rng.choice(SOBRENOMES)} {rng.choice(SOBRENOMES)}',
+                data_nascimento=date(rng.randint(1970, 2018), rng.randint(1, 12), rng.randint(1, 28)),
+                telefone=f'({rng.randint(11, 99)}) 9 {rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}',
+                email=f'aluno{owner.pk}.{i}@exemplo.com.br' if rng.random() < 0.8 else None,
+                endereco=f'Rua {rng.choice(SOBRENOMES)}, {rng.randint(1, 2000)}',
+                faixa=FAIXAS[i % len(FAIXAS)],
+                bolsista=rng.random() < 0.15,
+                ativo=rng.random() < 0.9,
+                owner=owner,
+            )
+            aluno.preencher_busca()
+            novos.append(aluno)
+        novos = Aluno.objects.bulk_create(novos, batch_size=TAMANHO_LOTE)
+
+        inicio = hoje.replace(day=1)
+        mensalidades = []
+        for aluno in novos:
+            competencia = inicio
+            for m in range(meses):
+                vencimento = competencia.replace(day=10)
+                # O mês corrente fica em aberto para parte dos alunos; os anteriores quase todos pagos
+                pago = rng.random() < (0.6 if m == 0 else 0.97)
+                valor = 100 if aluno.bolsista else 150
+                mensalidades.append(Mensalidade(
+                    aluno=aluno,
+                    competencia=competencia,
+                    data_vencimento=vencimento,
+                    valor=valor,
+                    valor_pago=valor if pago else 0,
+                    status='PAGO' if pago else ('ATRASADO' if vencimento < hoje else 'PENDENTE'),
+                    data_pagamento=min(vencimento + timedelta(days=rng.randint(-5, 10)), hoje) if pago else None,
+                ))
+                competencia = (competencia - timedelta(days=1)).replace(day=1)
+        mensalidades = Mensalidade.objects.bulk_create(mensalidades, batch_size=TAMANHO_LOTE)
+
+        lancamentos = Pagamento.objects.bulk_create([
+            Pagamento(
+                mensalidade=m,
+                data_pagamento=m.data_pagamento,
+                valor_pago=m.valor,
+                metodo_pagamento=rng.choice(METODOS),
+            )
+            for m in mensalidades
+            if m.status == 'PAGO'
+        ], batch_size=TAMANHO_LOTE)
+
+        dias = max(meses * 30, 1)
+        registros = []
+        for aluno in novos:
+            for d in sorted(rng.sample(range(dias), min(presencas, dias))):
+                registros.append(Presenca(aluno=aluno, data=hoje - timedelta(days=d), presente=rng.random() < 0.9))
+        Presenca.objects.bulk_create(registros, batch_size=TAMANHO_LOTE)
+
+        atualizar_estatisticas(Aluno, Mensalidade, Presenca)
+        receitas.reconstruir(owner)
+        pagamentos.reconstruir(owner)
+        frequencia.reconstruir(owner)
+
+    return {
+        'alunos': len(novos),
+        'mensalidades': len(mensalidades),
+        'pagamentos': len(lancamentos),
+        'presencas': len(registros),
+    }
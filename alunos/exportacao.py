@@ -0,0 +1,208 @@
+"""Exportação em CSV e XLSX dos dados de um owner, em streaming.
+
+As linhas vêm do banco com `values_list(...).iterator(chunk_size=...)` e saem em lotes,
+então a memória usada é a mesma para cem ou um milhão de linhas. O XLSX é montado
+à mão (zip + XML da planilha) para também poder ser escrito aos pedaços.
+"""
+import csv
+import io
+import re
+import zipfile
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import islice
+from xml.sax.saxutils import escape
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Aluno, Mensalidade, Pagamento, Presenca
+
+TAMANHO_LOTE = 2000
+LINHAS_POR_PEDACO = 500
+
+
+@dataclass(frozen=True)
+class Exportacao:
+    modelo: type
+    dono: str  # caminho até o owner, ex.: 'aluno__owner'
+    campo_data: str  # usado pelos filtros de período e na ordenação
+    colunas: tuple  # ((cabeçalho, campo), ...)
+    status: dict  # valor de ?status= -> filtro
+
+    @property
+    def cabecalho(self):
+        return [titulo for titulo, _ in self.colunas]
+
+
+EXPORTACOES = {
+    'alunos': Exportacao(
+        Aluno, 'owner', 'data_cadastro',
+        (('Nome', 'nome'), ('Nascimento', 'data_nascimento'), ('Telefone', 'telefone'), ('E-mail', 'email'),
+         ('Endereço', 'endereco'), ('Faixa', 'faixa'), ('Bolsista', 'bolsista'), ('Ativo', 'ativo'),
+         ('Cadastro', 'data_cadastro'), ('Saldo em aberto', 'saldo_devedor')),
+        {'ativos': Q(ativo=True), 'inativos': Q(ativo=False), 'devedores': Q(saldo_devedor__gt=0)},
+    ),
+    'mensalidades': Exportacao(
+        Mensalidade, 'aluno__owner', 'data_vencimento',
+        (('Aluno', 'aluno__nome'), ('Competência', 'competencia'), ('Vencimento', 'data_vencimento'),
+         ('Valor', 'valor'), ('Status', 'status'), ('Pagamento', 'data_pagamento')),
+        {'em_aberto': Q(status__in=Mensalidade.EM_ABERTO),
+         **{codigo.lower(): Q(status=codigo) for codigo, _ in Mensalidade.STATUS_CHOICES}},
+    ),
+    'pagamentos': Exportacao(
+        Pagamento, 'mensalidade__aluno__owner', 'data_pagamento',
+        (('Aluno', 'mensalidade__aluno__nome'), ('Vencimento', 'mensalidade__data_vencimento'),
+         ('Data do pagamento', 'data_pagamento'), ('Valor pago', 'valor_pago'), ('Método', 'metodo_pagamento'),
+         ('Registrado em', 'data_registro')),
+        {codigo.lower(): Q(metodo_pagamento=codigo) for codigo, _ in Pagamento.METODO_CHOICES},
+    ),
+    'presencas': Exportacao(
+        Presenca, 'aluno__owner', 'data',
+        (('Data', 'data'), ('Aluno', 'aluno__nome'), ('Presente', 'presente')),
+        {'presentes': Q(presente=True), 'ausentes': Q(presente=False)},
+    ),
+}
+
+
+def linhas(exportacao, owner, inicio=None, fim=None, status=None):
+    """Tuplas com os valores das colunas, em ordem de data, lidas do banco em lotes."""
+    queryset = exportacao.modelo.objects.filter(**{exportacao.dono: owner})
+    if inicio is not None:
+        queryset = queryset.filter(**{f'{exportacao.campo_data}__gte': inicio})
+    if fim is not None:
+        queryset = queryset.filter(**{f'{exportacao.campo_data}__lte': fim})
+    if status:
+        queryset = queryset.filter(exportacao.status[status])
+    return (
+        queryset
+        .order_by(exportacao.campo_data, 'pk')
+        .values_list(*[campo for _, campo in exportacao.colunas])
+        .iterator(chunk_size=TAMANHO_LOTE)
+    )
+
+
+def _texto(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, bool):
+        return 'Sim' if valor else 'Não'
+    if isinstance(valor, datetime):
+        return timezone.localtime(valor).strftime('%Y-%m-%d %H:%M')
+    if isinstance(valor, date):
+        return valor.isoformat()
+    return str(valor)
+
+
+def _texto_csv(valor):
+    # Textos começando com = + - @ viram fórmulas no Excel; o apóstrofo os mantém como texto
+    if isinstance(valor, str) and valor[:1] in ('=', '+', '-', '@'):
+        return "'" + valor
+    return _texto(valor)
+
+
+def _em_pedacos(iteravel, tamanho=LINHAS_POR_PEDACO):
+    iterador = iter(iteravel)
+    while pedaco := list(islice(iterador, tamanho)):
+        yield pedaco
+
+
+def csv_em_streaming(cabecalho, linhas):
+    """Pedaços de texto do CSV (com BOM, para o Excel reconhecer o UTF-8)."""
+    saida = io.StringIO()
+    escritor = csv.writer(saida)
+    saida.write('\ufeff')
+    escritor.writerow(cabecalho)
+    for pedaco in _em_pedacos(linhas):
+        escritor.writerows([_texto_csv(valor) for valor in linha] for linha in pedaco)
+        yield saida.getvalue()
+        saida.seek(0)
+        saida.truncate()
+    yield saida.getvalue()
+
+
+class _Saida(io.RawIOBase):
+    """Destino sem seek para o ZipFile: acumula os bytes até serem entregues à resposta."""
+
+    def __init__(self):
+        super().__init__()
+        self.partes = []
+        self.posicao = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        self.posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self.posicao
+
+    def esvaziar(self):
+        dados = b''.join(self.partes)
+        self.partes = []
+        return dados
+
+
+_XML = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_ESTRUTURA_XLSX = {
+    '[Content_Types].xml': _XML + (
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': _XML + (
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': _XML + (
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Dados" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': _XML + (
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+_INVALIDOS_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _celula(valor):
+    if isinstance(valor, (int, float, Decimal)) and not isinstance(valor, bool):
+        return f'<c><v>{valor}</v></c>'
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(_INVALIDOS_XML.sub("", _texto(valor)))}</t></is></c>'
+
+
+def _linha_xml(valores):
+    return '<row>' + ''.join(_celula(valor) for valor in valores) + '</row>'
+
+
+def xlsx_em_streaming(cabecalho, linhas):
+    """Pedaços de bytes de um XLSX com uma planilha (textos inline, números como números)."""
+    saida = _Saida()
+    with zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as pacote:
+        for nome, conteudo in _ESTRUTURA_XLSX.items():
+            pacote.writestr(nome, conteudo)
+        with pacote.open('xl/worksheets/sheet1.xml', 'w') as planilha:
+            planilha.write((
+                _XML + '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                + _linha_xml(cabecalho)
+            ).encode())
+            for pedaco in _em_pedacos(linhas):
+                planilha.write(''.join(_linha_xml(linha) for linha in pedaco).encode())
+                yield saida.esvaziar()
+            planilha.write(b'</sheetData></worksheet>')
+    yield saida.esvaziar()
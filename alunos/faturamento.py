@@ -0,0 +1,179 @@
+"""Geração de mensalidades em massa e envelhecimento das vencidas, feitos por conjunto
+(sem um SELECT/INSERT/UPDATE por aluno)."""
+import logging
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, CharField, Exists, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from . import cache_academia, pagamentos
+from .models import Aluno, Mensalidade
+
+logger = logging.getLogger(__name__)
+
+VALOR_REGULAR = Decimal('150.00')
+VALOR_BOLSISTA = Decimal('100.00')
+TAMANHO_LOTE = 500
+# Até aqui a geração em massa roda na própria requisição; acima, vai para a fila de tarefas
+LIMITE_NA_REQUISICAO = 5_000
+
+
+@dataclass(frozen=True)
+class ResultadoFaturamento:
+    competencia: date
+    criadas: int
+    duracao_ms: float
+
+
+def proxima_competencia(hoje):
+    """Primeiro dia do mês seguinte a `hoje` (também usado como vencimento)."""
+    return (hoje.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def alunos_a_faturar(owner, competencia):
+    """Alunos ativos sem mensalidade em aberto e ainda sem cobrança na competência (anti-join único)."""
+    pendentes = Mensalidade.objects.filter(aluno=OuterRef('pk'), status__in=Mensalidade.EM_ABERTO)
+    da_competencia = Mensalidade.objects.filter(aluno=OuterRef('pk'), competencia=competencia)
+    return (
+        Aluno.objects
+        .filter(owner=owner, ativo=True)
+        .filter(~Exists(pendentes), ~Exists(da_competencia))
+    )
+
+
+def faturar_na_fila(owner, hoje):
+    """Se a geração de `hoje` passa de LIMITE_NA_REQUISICAO alunos (a contagem para no limite)."""
+    a_faturar = alunos_a_faturar(owner, proxima_competencia(hoje))[:LIMITE_NA_REQUISICAO + 1]
+    return a_faturar.count() > LIMITE_NA_REQUISICAO
+
+
+def _nova(aluno_id, bolsista, competencia):
+    return Mensalidade(
+        aluno_id=aluno_id,
+        competencia=competencia,
+        data_vencimento=competencia,
+        valor=VALOR_BOLSISTA if bolsista else VALOR_REGULAR,
+        status='PENDENTE',
+    )
+
+
+def _inserir_lote(lote, competencia):
+    """Insere as mensalidades de `lote` [(aluno_id, bolsista)] e devolve os ids dos alunos faturados.
+
+    Se um faturamento concorrente já gravou alguma delas, a restrição única desfaz o lote
+    inteiro (savepoint); os alunos já faturados na competência saem e o resto é inserido de
+    novo. Assim só conta como criada a mensalidade gravada por esta execução.
+    """
+    while lote:
+        try:
+            with transaction.atomic():
+                Mensalidade.objects.bulk_create([_nova(aluno_id, bolsista, competencia) for aluno_id, bolsista in lote])
+        except IntegrityError:
+            faturados = set(
+                Mensalidade.objects
+                .filter(competencia=competencia, aluno_id__in=[aluno_id for aluno_id, _ in lote])
+                .values_list('aluno_id', flat=True)
+            )
+            if not faturados:
+                raise
+            lote = [(aluno_id, bolsista) for aluno_id, bolsista in lote if aluno_id not in faturados]
+        else:
+            return [aluno_id for aluno_id, _ in lote]
+    return []
+
+
+def gerar_mensalidades_em_massa(owner, hoje, tamanho_lote=TAMANHO_LOTE):
+    """Cria a mensalidade da próxima competência para os alunos ativos do `owner`.
+
+    Idempotente: o anti-join evita inserir duplicatas, e a restrição única (aluno,
+    competencia) barra as que um reenvio ou clique duplo concorrente gravou nesse meio tempo.
+    """
+    inicio = time.perf_counter()
+    competencia = proxima_competencia(hoje)
+
+    with transaction.atomic():
+        candidatos = list(alunos_a_faturar(owner, competencia).values_list('pk', 'bolsista'))
+        faturados = []
+        for posicao in range(0, len(candidatos), tamanho_lote):
+            faturados += _inserir_lote(candidatos[posicao:posicao + tamanho_lote], competencia)
+        criadas = len(faturados)
+        if faturados:
+            # As novas entram no saldo devedor dos alunos faturados (um UPDATE para todos)
+            pagamentos.recalcular_saldos(Aluno.objects.filter(pk__in=faturados))
+
+    duracao_ms = (time.perf_counter() - inicio) * 1000
+    logger.info(
+        'Faturamento %s do owner %s: %d mensalidade(s) criada(s) em %.1f ms',
+        competencia, owner.pk, criadas, duracao_ms,
+    )
+    return ResultadoFaturamento(competencia=competencia, criadas=criadas, duracao_ms=duracao_ms)
+
+
+def atualizar_atrasadas(hoje):
+    """Passa a ATRASADO as mensalidades PENDENTE vencidas antes de `hoje`, num único UPDATE.
+
+    Idempotente: as já atrasadas saem do filtro, então rodar de hora em hora não custa
+    nada além de uma leitura do índice parcial das pendentes por vencimento. Devolve quantas
+    mensalidades mudaram.
+    """
+    vencidas = Mensalidade.objects.filter(status='PENDENTE', data_vencimento__lt=hoje)
+    with transaction.atomic():
+        donos = set(vencidas.values_list('aluno__owner', flat=True).distinct())
+        if not donos:
+            return 0
+        atualizadas = vencidas.update(status='ATRASADO')
+        cache_academia.invalidar(*donos)
+    logger.info('%d mensalidade(s) passaram a ATRASADO (%d owner(s))', atualizadas, len(donos))
+    return atualizadas
+
+
+def mensalidades_atuais(owner, hoje):
+    """Alunos do `owner` anotados com o id da sua mensalidade atual, em ordem de nome.
+
+    A mensalidade "atual" é a vencida mais recente (vencimento <= hoje); sem nenhuma
+    vencida, vale a próxima a vencer. O custo cresce com o número de alunos, não com
+    o histórico: cada subconsulta lê uma linha do índice (aluno, data_vencimento).
+    As mensalidades de uma página vêm de `carregar_mensalidades`.
+    """
+    do_aluno = Mensalidade.objects.filter(aluno=OuterRef('pk'))
+    ultima_vencida = do_aluno.filter(data_vencimento__lte=hoje).order_by('-data_vencimento', '-pk')
+    proxima = do_aluno.filter(data_vencimento__gt=hoje).order_by('data_vencimento', 'pk')
+    return (
+        Aluno.objects
+        .filter(owner=owner)
+        .annotate(mensalidade_atual=Coalesce(
+            Subquery(ultima_vencida.values('pk')[:1]),
+            Subquery(proxima.values('pk')[:1]),
+        ))
+        .filter(mensalidade_atual__isnull=False)
+        .order_by('nome', 'pk')
+    )
+
+
+def carregar_mensalidades(alunos, hoje):
+    """Mensalidade atual de cada aluno de `alunos` (na mesma ordem), com o status de exibição.
+
+    Uma consulta por chave primária; o aluno já carregado é reaproveitado em `m.aluno`.
+    O status gravado já vem envelhecido por `atualizar_atrasadas`; o Case só cobre as que
+    venceram desde a última passada.
+    """
+    por_id = (
+        Mensalidade.objects
+        .annotate(status_exibicao=Case(
+            When(status='PENDENTE', data_vencimento__lt=hoje, then=Value('ATRASADO')),
+            default=F('status'),
+            output_field=CharField(),
+        ))
+        .in_bulk([aluno.mensalidade_atual for aluno in alunos])
+    )
+    mensalidades = []
+    for aluno in alunos:
+        mensalidade = por_id.get(aluno.mensalidade_atual)
+        if mensalidade is not None:
+            mensalidade.aluno = aluno
+            mensalidades.append(mensalidade)
+    return mensalidades
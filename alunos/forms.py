@@ -1,6 +1,9 @@
+from decimal import Decimal
+
 from django import forms
-from .models import Aluno, Mensalidade, UserProfile
+from .models import Aluno, Mensalidade, Pagamento, UserProfile
 from .models import Presenca
+from .busca import formatar_telefone
 from django.contrib.auth.forms import UserCreationForm
 
 class GerarMensalidadeForm(forms.ModelForm):
@@ -32,6 +35,13 @@ class GerarMensalidadeForm(forms.ModelForm):
         else:
             self.fields['aluno'].queryset = Aluno.objects.filter(ativo=True)
 
+    def clean_valor(self):
+        valor = self.cleaned_data['valor']
+        # Numa mensalidade em aberto, os pagamentos parciais já lançados não podem passar do novo valor
+        if valor is not None and self.instance.status in Mensalidade.EM_ABERTO and valor < self.instance.valor_pago:
+            raise forms.ValidationError(f"Já foram pagos R$ {self.instance.valor_pago}; o valor não pode ser menor.")
+        return valor
+
 class AlunoForm(forms.ModelForm):
     class Meta:
         model = Aluno
@@ -44,6 +54,84 @@ class AlunoForm(forms.ModelForm):
             }
         }
 
+    def clean_telefone(self):
+        # Só normaliza: cadastros antigos (ex.: "3333-4444", sem DDD) continuam editáveis.
+        # A importação é que exige o DDD (ver importacao._Validador)
+        telefone = self.cleaned_data['telefone']
+        return formatar_telefone(telefone) or telefone
+
+class ImportacaoAlunosForm(forms.Form):
+    arquivo = forms.FileField(
+        label="Planilha (CSV)",
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,text/csv'})
+    )
+    simular = forms.BooleanField(
+        label="Só validar, sem gravar",
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+
+class PagamentoForm(forms.Form):
+    valor = forms.DecimalField(
+        max_digits=6,
+        decimal_places=2,
+        min_value=Decimal('0.01'),
+        required=False,
+        label="Valor pago",
+        help_text="Menor que o saldo para um pagamento parcial; em branco, quita o saldo.",
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'})
+    )
+    metodo_pagamento = forms.ChoiceField(
+        choices=[('', 'Não informado')] + [c for c in Pagamento.METODO_CHOICES if c[0] != 'NAO_INFORMADO'],
+        required=False,
+        label="Forma de pagamento",
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    data_pagamento = forms.DateField(
+        required=False,
+        label="Data do pagamento",
+        input_formats=["%Y-%m-%d", "%d/%m/%Y"],
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}, format="%Y-%m-%d")
+    )
+
+    # Gerada ao exibir o formulário; um reenvio traz a mesma e não lança o pagamento de novo
+    chave = forms.CharField(required=False, max_length=64, widget=forms.HiddenInput)
+
+    def clean_metodo_pagamento(self):
+        return self.cleaned_data['metodo_pagamento'] or 'NAO_INFORMADO'
+
+class MensalidadesEmLoteForm(forms.Form):
+    ACOES = [
+        ('quitar', 'Marcar como pagas'),
+        ('adiar', 'Adiar vencimento'),
+        ('excluir', 'Excluir'),
+    ]
+
+    acao = forms.ChoiceField(
+        choices=ACOES,
+        label="Ação",
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    dias = forms.IntegerField(
+        min_value=-365,
+        max_value=365,
+        required=False,
+        label="Dias",
+        help_text="Para adiar; negativo antecipa.",
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Dias'})
+    )
+    metodo_pagamento = PagamentoForm.base_fields['metodo_pagamento']
+    data_pagamento = PagamentoForm.base_fields['data_pagamento']
+
+    def clean_metodo_pagamento(self):
+        return self.cleaned_data['metodo_pagamento'] or 'NAO_INFORMADO'
+
+    def clean(self):
+        dados = super().clean()
+        if dados.get('acao') == 'adiar' and not dados.get('dias'):
+            self.add_error('dias', "Informe quantos dias adiar o vencimento.")
+        return dados
+
 class SignUpForm(UserCreationForm):
     class Meta(UserCreationForm.Meta):
         fields = UserCreationForm.Meta.fields + ("email",)
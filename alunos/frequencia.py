@@ -0,0 +1,124 @@
+"""Frequência mensal (FrequenciaMensal): presenças de cada aluno por mês, pré-contadas.
+
+Quem grava presenças chama `atualizar_frequencias` com os alunos e o mês afetados; a
+contagem desses pares é refeita a partir das presenças (idempotente, sem deltas) e
+gravada com um único upsert. Ranking e tendência leem só os contadores.
+"""
+import calendar
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncMonth
+
+from . import cache_academia
+from .models import Aluno, FrequenciaMensal, Presenca
+
+TAMANHO_LOTE = 1000
+
+
+def mes_de(data):
+    return data.replace(day=1)
+
+
+def fim_do_mes(mes):
+    return mes.replace(day=calendar.monthrange(mes.year, mes.month)[1])
+
+
+def meses_anteriores(mes, quantidade):
+    """Os `quantidade` meses terminando em `mes`, do mais antigo ao mais recente."""
+    meses = [mes]
+    while len(meses) < quantidade:
+        meses.insert(0, mes_de(meses[0] - timedelta(days=1)))
+    return meses
+
+
+def atualizar_frequencias(aluno_ids, mes):
+    """Recontagem das presenças de `aluno_ids` em `mes` (qualquer data do mês serve).
+
+    Alunos sem professor (owner nulo, anteriores à 0004) não têm contador.
+    """
+    mes = mes_de(mes)
+    no_mes = Q(presenca__presente=True, presenca__data__gte=mes, presenca__data__lte=fim_do_mes(mes))
+    contagens = (
+        Aluno.objects
+        .filter(pk__in=list(aluno_ids), owner__isnull=False)
+        .annotate(total=Count('presenca', filter=no_mes))
+        .values_list('pk', 'owner_id', 'total')
+    )
+    FrequenciaMensal.objects.bulk_create(
+        [FrequenciaMensal(aluno_id=pk, owner_id=owner_id, mes=mes, total=total) for pk, owner_id, total in contagens],
+        batch_size=TAMANHO_LOTE,
+        update_conflicts=True,
+        unique_fields=['aluno', 'mes'],
+        update_fields=['owner', 'total'],
+    )
+
+
+def ranking(owner, mes, limite=10):
+    """[(nome, total)] dos alunos mais frequentes do `owner` em `mes`."""
+    return list(
+        FrequenciaMensal.objects
+        .filter(owner=owner, mes=mes_de(mes), total__gt=0)
+        .order_by('-total', 'aluno__nome')
+        .values_list('aluno__nome', 'total')[:limite]
+    )
+
+
+def tendencia(owner, mes, meses=6):
+    """[(mês, total de presenças)] dos últimos `meses` meses até `mes`, com zero nos meses vazios."""
+    periodo = meses_anteriores(mes_de(mes), meses)
+    totais = dict(
+        FrequenciaMensal.objects
+        .filter(owner=owner, mes__gte=periodo[0], mes__lte=periodo[-1])
+        .values('mes')
+        .annotate(soma=Sum('total'))
+        .values_list('mes', 'soma')
+    )
+    return [(m, totais.get(m, 0)) for m in periodo]
+
+
+def frequencia_esperada(owner=None):
+    """{(aluno_id, mês): (owner_id, total)} contado direto das presenças."""
+    presencas = Presenca.objects.filter(presente=True, aluno__owner__isnull=False)
+    if owner is not None:
+        presencas = presencas.filter(aluno__owner=owner)
+    por_mes = (
+        presencas
+        .order_by()
+        .annotate(mes=TruncMonth('data'))
+        .values_list('aluno', 'mes', 'aluno__owner')
+        .annotate(total=Count('id'))
+    )
+    return {(aluno_id, mes): (owner_id, total) for aluno_id, mes, owner_id, total in por_mes}
+
+
+def reconstruir(owner=None):
+    """Recalcula todos os contadores a partir das presenças. Devolve o número de linhas gravadas."""
+    with transaction.atomic():
+        existentes = FrequenciaMensal.objects.all()
+        if owner is not None:
+            existentes = existentes.filter(owner=owner)
+        afetados = set(existentes.values_list('owner', flat=True).distinct())
+        existentes.delete()
+        linhas = [
+            FrequenciaMensal(aluno_id=aluno_id, owner_id=owner_id, mes=mes, total=total)
+            for (aluno_id, mes), (owner_id, total) in frequencia_esperada(owner).items()
+        ]
+        FrequenciaMensal.objects.bulk_create(linhas, batch_size=TAMANHO_LOTE)
+        cache_academia.invalidar(*afetados, *{linha.owner_id for linha in linhas})
+    return len(linhas)
+
+
+def verificar(owner=None):
+    """Divergências entre contadores e presenças: [(aluno_id, mês, esperado, gravado)]."""
+    esperada = {chave: total for chave, (_, total) in frequencia_esperada(owner).items()}
+    gravadas = FrequenciaMensal.objects.exclude(total=0)
+    if owner is not None:
+        gravadas = gravadas.filter(owner=owner)
+    gravada = {(a, m): t for a, m, t in gravadas.values_list('aluno', 'mes', 'total')}
+    return [
+        (*chave, esperada.get(chave), gravada.get(chave))
+        for chave in sorted(esperada.keys() | gravada.keys())
+        if esperada.get(chave) != gravada.get(chave)
+    ]
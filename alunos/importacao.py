@@ -0,0 +1,250 @@
+"""Importação de alunos a partir de uma planilha CSV.
+
+O arquivo é lido linha a linha, sem ir inteiro para a memória. Cada linha passa pela
+mesma validação do `AlunoForm` (datas, faixas adulto e infantil, regras do modelo), com o
+telefone exigido com DDD, e as válidas são gravadas com `bulk_create` em lotes. Uma linha com erro não interrompe a
+importação: entra no relatório com o número da linha na planilha. Planilhas com mais de
+LIMITE_LINHAS linhas são importadas pela fila de tarefas (ver tarefas.py). Os cabeçalhos
+aceitos incluem os da exportação (ver exportacao.py), então uma planilha exportada volta
+como veio.
+"""
+import codecs
+import csv
+import re
+from dataclasses import dataclass, field
+from itertools import chain
+
+from django.core.exceptions import ValidationError
+from django.utils.text import capfirst
+
+from . import cache_academia
+from .busca import formatar_telefone, normalizar
+from .forms import AlunoForm
+from .models import Aluno
+
+# Até aqui a importação roda na própria requisição (~1 s); acima, vai para a fila de tarefas
+LIMITE_LINHAS = 5_000
+TAMANHO_LOTE = 1000
+LIMITE_ERROS = 500
+
+VERDADEIRO = {'sim', 's', 'x', 'true', 'verdadeiro', '1', 'yes'}
+FALSO = {'nao', 'n', 'false', 'falso', '0', 'no'}
+
+
+class ErroDeImportacao(Exception):
+    """Problema no arquivo como um todo (ex.: cabeçalho); nada é gravado."""
+
+
+def _chave(texto):
+    """'Data de Nascimento' -> 'data de nascimento'; 'BRANCA_KIDS' -> 'branca kids'."""
+    return ' '.join(re.sub(r'[\W_]+', ' ', normalizar(texto)).split())
+
+
+COLUNAS = {
+    _chave(cabecalho): campo
+    for campo, cabecalhos in {
+        'nome': ('nome', 'nome completo', 'aluno'),
+        'data_nascimento': ('data_nascimento', 'nascimento', 'data de nascimento'),
+        'telefone': ('telefone', 'celular', 'whatsapp'),
+        'email': ('email', 'e-mail'),
+        'endereco': ('endereco', 'endereço'),
+        'faixa': ('faixa',),
+        'bolsista': ('bolsista',),
+        'ativo': ('ativo',),
+    }.items()
+    for cabecalho in cabecalhos
+}
+
+
+def _faixas():
+    # Código ou rótulo; "Branca" sozinha é a adulta, a infantil vem como "Branca (Infantil)" ou BRANCA_KIDS
+    mapa = {}
+    for grupo, opcoes in Aluno._meta.get_field('faixa').choices:
+        for codigo, rotulo in opcoes:
+            for texto in (codigo, rotulo, f'{rotulo} {grupo}'):
+                mapa.setdefault(_chave(texto), codigo)
+    return mapa
+
+
+FAIXAS = _faixas()
+
+
+@dataclass
+class Resultado:
+    simulacao: bool = False
+    linhas: int = 0
+    importados: int = 0
+    total_erros: int = 0
+    erros: list = field(default_factory=list)  # (linha na planilha, mensagem), até LIMITE_ERROS
+
+    def erro(self, linha, mensagem):
+        self.total_erros += 1
+        if len(self.erros) < LIMITE_ERROS:
+            self.erros.append((linha, mensagem))
+
+
+class _Validador:
+    """Um único AlunoForm para todas as linhas, sem montar um formulário por linha (cerca de
+    3 vezes mais rápido em planilhas grandes), mas com as mesmas etapas do `is_valid()`: os
+    campos e os `clean_<campo>`, o `clean()` do formulário e a validação do modelo
+    (`full_clean`, como no `_post_clean` do ModelForm). Só o telefone é mais estrito."""
+
+    def __init__(self):
+        self.form = AlunoForm()
+        self.campos = [
+            (nome, campo, getattr(self, f'clean_{nome}', None) or getattr(self.form, f'clean_{nome}', None))
+            for nome, campo in self.form.fields.items()
+        ]
+        # Como no ModelForm: o que não está no formulário não é validado no modelo
+        self.fora_do_form = [campo.name for campo in Aluno._meta.fields if campo.name not in self.form.fields]
+
+    def clean_telefone(self):
+        # Mais estrito que o formulário, que aceita os telefones antigos sem DDD
+        telefone = formatar_telefone(self.form.cleaned_data['telefone'])
+        if telefone is None:
+            raise ValidationError("Informe o telefone com DDD, por exemplo (11) 9 1234-5678.")
+        return telefone
+
+    def _mensagens(self, erro):
+        for nome, mensagens in erro.message_dict.items():
+            campo = self.form.fields.get(nome)
+            yield f'{capfirst(campo.label)}: {" ".join(mensagens)}' if campo else ' '.join(mensagens)
+
+    def validar(self, dados):
+        """(Aluno sem owner, [mensagens de erro]) para os `dados` de uma linha."""
+        self.form.cleaned_data = limpos = {}
+        erros = []
+        for nome, campo, extra in self.campos:
+            try:
+                limpos[nome] = campo.clean(dados.get(nome, ''))
+                if extra is not None:
+                    limpos[nome] = extra()
+            except ValidationError as erro:
+                erros.append(f'{capfirst(campo.label)}: {" ".join(erro.messages)}')
+        if erros:
+            return None, erros
+        try:
+            limpos = self.form.clean()
+            aluno = Aluno(**limpos)
+            aluno.full_clean(exclude=self.fora_do_form)
+        except ValidationError as erro:
+            return None, list(self._mensagens(erro))
+        return aluno, []
+
+
+def _codificacao(arquivo):
+    decodificador = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for pedaco in iter(lambda: arquivo.read(64 * 1024), b''):
+            decodificador.decode(pedaco)
+        decodificador.decode(b'', final=True)
+        codificacao = 'utf-8-sig'
+    except UnicodeDecodeError:
+        # "CSV" salvo pelo Excel em português
+        codificacao = 'cp1252'
+    arquivo.seek(0)
+    return codificacao
+
+
+def _leitor(arquivo):
+    linhas = codecs.iterdecode(arquivo, _codificacao(arquivo))
+    primeira = next(linhas, '')
+    # O Excel em português separa com ';'
+    delimitador = ';' if primeira.count(';') > primeira.count(',') else ','
+    return csv.reader(chain([primeira], linhas), delimiter=delimitador)
+
+
+def _colunas(cabecalho):
+    colunas = {}
+    for posicao, texto in enumerate(cabecalho):
+        campo = COLUNAS.get(_chave(texto))
+        if campo is not None:
+            colunas.setdefault(campo, posicao)
+    obrigatorios = [nome for nome, campo in AlunoForm.base_fields.items() if campo.required]
+    faltando = [nome for nome in obrigatorios if nome not in colunas]
+    if faltando:
+        raise ErroDeImportacao('Colunas obrigatórias ausentes: %s.' % ', '.join(faltando))
+    return colunas
+
+
+def _dados(linha, colunas):
+    dados = {campo: linha[posicao].strip() for campo, posicao in colunas.items() if posicao < len(linha)}
+    if dados.get('faixa'):
+        dados['faixa'] = FAIXAS.get(_chave(dados['faixa']), dados['faixa'])
+    return dados
+
+
+def _booleano(dados, campo, padrao, erros):
+    texto = _chave(dados.get(campo, ''))
+    if not texto:
+        dados[campo] = padrao
+    elif texto in VERDADEIRO or texto in FALSO:
+        dados[campo] = texto in VERDADEIRO
+    else:
+        dados[campo] = padrao
+        erros.append(f'{capfirst(campo)}: use Sim ou Não.')
+
+
+def contar_linhas(arquivo):
+    """Linhas de dados do CSV `arquivo`, já conferindo o cabeçalho (ErroDeImportacao)."""
+    leitor = _leitor(arquivo)
+    _colunas(next(leitor, []))
+    total = sum(1 for linha in leitor if any(celula.strip() for celula in linha))
+    arquivo.seek(0)
+    return total
+
+
+def importar_alunos(owner, arquivo, simular=False, progresso=None):
+    """Importa os alunos do CSV `arquivo` (binário) para `owner` e devolve o Resultado.
+
+    Com `simular`, só valida. Alunos já cadastrados (mesmo nome e data de nascimento) ou
+    repetidos na planilha são apontados como erro, então reenviar a planilha, inteira ou
+    depois de uma importação interrompida, não duplica ninguém. Cada lote é gravado por
+    conta própria e, depois dele, `progresso(resultado)` é chamado. Levanta
+    ErroDeImportacao, sem gravar nada, se faltar coluna obrigatória.
+    """
+    leitor = _leitor(arquivo)
+    colunas = _colunas(next(leitor, []))
+    validador = _Validador()
+    cadastrados = {
+        (normalizar(nome), nascimento)
+        for nome, nascimento in Aluno.objects.filter(owner=owner).values_list('nome', 'data_nascimento')
+    }
+    resultado = Resultado(simulacao=simular)
+    lote = []
+
+    def gravar():
+        if lote and not simular:
+            Aluno.objects.bulk_create(lote)
+            cache_academia.invalidar(owner.pk)
+        lote.clear()
+        if progresso is not None:
+            progresso(resultado)
+
+    for linha in leitor:
+        if not any(celula.strip() for celula in linha):
+            continue
+        resultado.linhas += 1
+        dados = _dados(linha, colunas)
+        erros = []
+        _booleano(dados, 'bolsista', False, erros)
+        _booleano(dados, 'ativo', True, erros)
+        aluno, erros_do_form = validador.validar(dados)
+        erros += erros_do_form
+        if not erros:
+            chave = (normalizar(aluno.nome), aluno.data_nascimento)
+            if chave in cadastrados:
+                erros.append('Aluno já cadastrado (mesmo nome e data de nascimento).')
+            cadastrados.add(chave)
+        if erros:
+            resultado.erro(leitor.line_num, ' '.join(erros))
+            continue
+
+        aluno.owner = owner
+        aluno.preencher_busca()  # bulk_create não passa pelo save()
+        lote.append(aluno)
+        resultado.importados += 1
+        if len(lote) >= TAMANHO_LOTE:
+            gravar()
+    gravar()
+    return resultado
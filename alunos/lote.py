@@ -0,0 +1,89 @@
+"""Ações em lote sobre mensalidades (marcar como pagas, excluir, adiar o vencimento).
+
+Usadas pela lista de mensalidades e pelo admin. Cada ação recebe um queryset já
+restrito ao que pode ser alterado (ver `do_owner`), aplica a mudança por conjunto, num
+único UPDATE/DELETE para todas as linhas, e devolve quantas mensalidades mudaram. A
+receita diária, o livro de pagamentos e o saldo devedor acompanham na mesma transação.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, DateField, F, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from . import cache_academia, pagamentos, receitas
+from .models import Aluno, Mensalidade, Pagamento
+
+
+def do_owner(owner, ids):
+    """Mensalidades de `ids` que são do `owner` (o dono entra como subconsulta, sem junção)."""
+    return Mensalidade.objects.filter(pk__in=ids, aluno__in=Aluno.objects.filter(owner=owner))
+
+
+def quitar(mensalidades, data=None, metodo='NAO_INFORMADO'):
+    """Quita o saldo das mensalidades em aberto de `mensalidades` na `data` (padrão: hoje).
+
+    O saldo de cada uma vira um lançamento no livro; as linhas são travadas na leitura
+    dos saldos para que um pagamento concorrente não seja somado duas vezes.
+    """
+    data = data or timezone.localdate()
+    with transaction.atomic():
+        abertas = list(
+            mensalidades.exclude(status='PAGO')
+            .select_for_update(of=('self',))
+            .values_list('pk', 'aluno_id', 'aluno__owner', 'valor', 'valor_pago')
+        )
+        if not abertas:
+            return 0
+        ids = [pk for pk, *_ in abertas]
+        quitadas = Mensalidade.objects.filter(pk__in=ids).update(
+            status='PAGO', valor_pago=F('valor'), data_pagamento=data,
+        )
+        Pagamento.objects.bulk_create([
+            Pagamento(mensalidade_id=pk, data_pagamento=data, valor_pago=valor - valor_pago, metodo_pagamento=metodo)
+            for pk, _, _, valor, valor_pago in abertas
+        ])
+        pagamentos.recalcular_saldos(Aluno.objects.filter(pk__in={aluno_id for _, aluno_id, *_ in abertas}))
+        receitas.registrar_inclusao(Mensalidade.objects.filter(pk__in=ids))
+        cache_academia.invalidar(*{owner_id for _, _, owner_id, *_ in abertas})
+    return quitadas
+
+
+def excluir(mensalidades):
+    """Exclui `mensalidades` (e os pagamentos delas), tirando-as da receita e do saldo devedor."""
+    with transaction.atomic():
+        donos = set(mensalidades.values_list('aluno__owner', flat=True).distinct())
+        if not donos:
+            return 0
+        receitas.registrar_remocao(mensalidades)
+        pagamentos.registrar_remocao(mensalidades)
+        _, por_modelo = mensalidades.delete()
+        cache_academia.invalidar(*donos)
+    return por_modelo.get(Mensalidade._meta.label, 0)
+
+
+def adiar(mensalidades, dias, hoje=None):
+    """Move o vencimento de `mensalidades` em `dias` (negativo antecipa).
+
+    Nas em aberto, o status segue o novo vencimento no mesmo UPDATE, como em
+    `Mensalidade.save`: atrasada adiada para depois de hoje volta a PENDENTE.
+    """
+    hoje = hoje or timezone.localdate()
+    deslocamento = timedelta(days=dias)
+    # No SET, data_vencimento ainda é o vencimento antigo: compara com hoje - deslocamento
+    vence_antes_de_hoje = {'data_vencimento__lt': hoje - deslocamento}
+    with transaction.atomic():
+        donos = set(mensalidades.values_list('aluno__owner', flat=True).distinct())
+        if not donos:
+            return 0
+        adiadas = mensalidades.update(
+            data_vencimento=Cast(F('data_vencimento') + deslocamento, DateField()),
+            status=Case(
+                When(status__in=Mensalidade.EM_ABERTO, **vence_antes_de_hoje, then=Value('ATRASADO')),
+                When(status__in=Mensalidade.EM_ABERTO, then=Value('PENDENTE')),
+                default=F('status'),
+            ),
+        )
+        cache_academia.invalidar(*donos)
+    return adiadas
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from alunos.faturamento import atualizar_atrasadas
+
+
+class Command(BaseCommand):
+    help = 'Passa a ATRASADO as mensalidades pendentes já vencidas (o executar_tarefas faz isso de hora em hora).'
+
+    def handle(self, *args, **options):
+        atualizadas = atualizar_atrasadas(timezone.localdate())
+        self.stdout.write(self.style.SUCCESS(f'{atualizadas} mensalidade(s) passaram a ATRASADO.'))
@@ -0,0 +1,65 @@
+import json
+import subprocess
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+from alunos import bench
+
+
+class Command(BaseCommand):
+    help = 'Mede latência (p50/p95/p99), consultas e tempo de SQL de cada rota de alunos e grava o resultado em JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', help='Professor usado nas requisições; por padrão, o que tem mais alunos.')
+        parser.add_argument('--repeticoes', type=int, default=20)
+        parser.add_argument('--aquecimento', type=int, default=2, help='Requisições descartadas antes de medir.')
+        parser.add_argument('--rotas', help='Nomes de rota separados por vírgula; por padrão, todas.')
+        parser.add_argument('--saida', default='bench.json', help='Arquivo JSON com os resultados.')
+
+    def handle(self, *args, usuario, repeticoes, aquecimento, rotas, saida, **options):
+        if usuario:
+            owner = User.objects.filter(username=usuario).first()
+        else:
+            owner = (
+                User.objects.filter(is_staff=True)
+                .annotate(n=Count('alunos')).order_by('-n').first()
+            )
+        if owner is None:
+            raise CommandError('Nenhum professor encontrado (rode gerar_dados_sinteticos antes).')
+
+        apenas = set(rotas.split(',')) if rotas else None
+        resultados = bench.executar(owner, repeticoes, aquecimento, apenas)
+
+        self.stdout.write(f'{"rota":<28} {"método":<6} {"p50":>8} {"p95":>8} {"p99":>8} {"consultas":>9} {"sql":>8}')
+        for r in resultados:
+            if 'ignorada' in r:
+                self.stdout.write(f'{r["rota"]:<28} {r["metodo"]:<6} ignorada: {r["ignorada"]}')
+                continue
+            self.stdout.write(
+                f'{r["rota"]:<28} {r["metodo"]:<6} {r["p50_ms"]:>8.1f} {r["p95_ms"]:>8.1f} '
+                f'{r["p99_ms"]:>8.1f} {r["consultas"]:>9} {r["sql_ms"]:>8.1f}'
+            )
+
+        with open(saida, 'w', encoding='utf-8') as arquivo:
+            json.dump({
+                'gerado_em': timezone.now().isoformat(),
+                'commit': self.commit_atual(),
+                'banco': connection.vendor,
+                'usuario': owner.username,
+                'alunos': owner.alunos.count(),
+                'repeticoes': repeticoes,
+                'resultados': resultados,
+            }, arquivo, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Resultados gravados em {saida}'))
+
+    def commit_atual(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
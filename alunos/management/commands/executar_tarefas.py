@@ -0,0 +1,35 @@
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from alunos import tarefas
+
+
+class Command(BaseCommand):
+    help = 'Executa as tarefas da fila (importações grandes, faturamento e relatórios agendados).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uma-vez', action='store_true', help='Sai quando a fila ficar vazia.')
+        parser.add_argument('--intervalo', type=float, default=tarefas.INTERVALO,
+                            help='Segundos entre consultas à fila vazia (padrão: %(default)s).')
+        parser.add_argument('--cache-local', action='store_true',
+                            help='Roda mesmo com um cache que o site não enxerga (memória ou arquivos).')
+
+    def handle(self, *args, uma_vez=False, intervalo=tarefas.INTERVALO, cache_local=False, **options):
+        # As tarefas invalidam o cache das academias; num cache só deste processo o site
+        # continuaria mostrando listas antigas por até cache_academia.TEMPO_PADRAO
+        backend = tarefas.cache_local()
+        if backend and not cache_local:
+            raise CommandError(
+                f'O cache ({backend}) não é compartilhado com o site. Configure REDIS_URL, desligue '
+                'CACHE_ACADEMIA ou use --cache-local para rodar assim mesmo.'
+            )
+        parar = []
+        # No deploy o Render manda SIGTERM: termina a tarefa em andamento e sai
+        anteriores = {sinal: signal.signal(sinal, lambda *_: parar.append(True)) for sinal in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            executadas = tarefas.trabalhar(parar=lambda: bool(parar), uma_vez=uma_vez, intervalo=intervalo)
+        finally:
+            for sinal, tratador in anteriores.items():
+                signal.signal(sinal, tratador)
+        self.stdout.write(self.style.SUCCESS(f'{executadas} tarefa(s) executada(s).'))
@@ -0,0 +1,35 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from alunos.dados_sinteticos import criar_professor, gerar_academia
+from alunos.models import Aluno
+
+
+class Command(BaseCommand):
+    help = 'Gera academias sintéticas (professores, alunos, mensalidades, pagamentos e presenças) para benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owners', type=int, default=3, help='Número de professores (academias).')
+        parser.add_argument('--alunos', type=int, default=500, help='Alunos por professor.')
+        parser.add_argument('--meses', type=int, default=24, help='Meses de mensalidades por aluno.')
+        parser.add_argument('--presencas', type=int, default=60, help='Presenças por aluno.')
+        parser.add_argument('--prefixo', default='sintetico', help='Prefixo do username dos professores.')
+        parser.add_argument('--senha', default='sintetico123', help='Senha dos professores criados.')
+        parser.add_argument('--seed', type=int, default=None, help='Semente para gerar sempre os mesmos dados.')
+        parser.add_argument('--limpar', action='store_true', help='Apaga antes os alunos dos professores gerados.')
+
+    def handle(self, *args, owners, alunos, meses, presencas, prefixo, senha, seed, limpar, **options):
+        rng = random.Random(seed)
+        hoje = timezone.localdate()
+        for n in range(1, owners + 1):
+            professor = criar_professor(f'{prefixo}{n}', senha)
+            if limpar:
+                Aluno.objects.filter(owner=professor).delete()
+            inicio = time.perf_counter()
+            criados = gerar_academia(professor, alunos, meses, presencas, hoje, rng)
+            resumo = ', '.join(f'{quantidade} {tabela}' for tabela, quantidade in criados.items())
+            self.stdout.write(f'{professor.username}: {resumo} em {time.perf_counter() - inicio:.1f} s')
+        self.stdout.write(self.style.SUCCESS(f'{owners} academia(s) gerada(s). Senha dos professores: {senha}'))
@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from alunos import importacao
+
+
+class Command(BaseCommand):
+    help = 'Importa alunos de uma planilha CSV na hora, sem passar pela fila de tarefas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Caminho do CSV.')
+        parser.add_argument('--owner', required=True, help='Username do professor que recebe os alunos.')
+        parser.add_argument('--simular', action='store_true', help='Só valida, sem gravar.')
+
+    def handle(self, *args, arquivo, owner, simular=False, **options):
+        professor = User.objects.filter(username=owner).first()
+        if professor is None:
+            raise CommandError(f'Usuário "{owner}" não encontrado.')
+        try:
+            with open(arquivo, 'rb') as planilha:
+                resultado = importacao.importar_alunos(professor, planilha, simular=simular)
+        except OSError as erro:
+            raise CommandError(f'Não foi possível ler {arquivo}: {erro}')
+        except importacao.ErroDeImportacao as erro:
+            raise CommandError(str(erro))
+
+        for linha, mensagem in resultado.erros:
+            self.stdout.write(f'Linha {linha}: {mensagem}')
+        if resultado.total_erros > len(resultado.erros):
+            self.stdout.write(f'... e mais {resultado.total_erros - len(resultado.erros)} erro(s).')
+        verbo = 'seriam importadas' if simular else 'importadas'
+        self.stdout.write(self.style.SUCCESS(f'{resultado.importados} de {resultado.linhas} linha(s) {verbo}.'))
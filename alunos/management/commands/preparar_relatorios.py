@@ -0,0 +1,26 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from alunos import receitas
+
+
+class Command(BaseCommand):
+    help = 'Grava os relatórios mensais dos meses encerrados, para que abram sem recálculo.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', help='Username do professor; por padrão, todos.')
+        parser.add_argument('--anos', type=int, default=5, help='Quantos anos para trás (padrão: os do seletor do relatório).')
+
+    def handle(self, *args, owner=None, anos=5, **options):
+        professores = User.objects.filter(is_staff=True)
+        if owner is not None:
+            professores = professores.filter(username=owner)
+            if not professores.exists():
+                raise CommandError(f'Usuário "{owner}" não encontrado.')
+
+        total = 0
+        for professor in professores.order_by('username'):
+            criados = receitas.preparar_relatorios(professor, anos)
+            total += criados
+            self.stdout.write(f'{professor.username}: {criados} relatório(s) gravado(s)')
+        self.stdout.write(self.style.SUCCESS(f'{total} relatório(s) gravado(s).'))
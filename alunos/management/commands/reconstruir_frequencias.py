@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from alunos import frequencia
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói os contadores de frequência mensal (FrequenciaMensal) a partir das presenças, ou só os confere.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verificar', action='store_true', help='Apenas compara com as presenças, sem gravar.')
+        parser.add_argument('--owner', help='Username do professor; por padrão, todos.')
+
+    def handle(self, *args, verificar=False, owner=None, **options):
+        if owner is not None:
+            try:
+                owner = User.objects.get(username=owner)
+            except User.DoesNotExist:
+                raise CommandError(f'Usuário "{owner}" não encontrado.')
+
+        if not verificar:
+            linhas = frequencia.reconstruir(owner)
+            self.stdout.write(self.style.SUCCESS(f'Frequência mensal reconstruída: {linhas} linha(s).'))
+
+        divergencias = frequencia.verificar(owner)
+        for aluno_id, mes, esperado, gravado in divergencias:
+            self.stderr.write(f'aluno {aluno_id} em {mes:%m/%Y}: esperado {esperado}, gravado {gravado}')
+        if divergencias:
+            raise CommandError(f'{len(divergencias)} divergência(s) na frequência mensal.')
+        self.stdout.write(self.style.SUCCESS('Frequência mensal confere com as presenças.'))
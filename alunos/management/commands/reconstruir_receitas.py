@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from alunos import receitas
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói a receita diária (ReceitaDiaria) a partir das mensalidades pagas, ou só a confere.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verificar', action='store_true', help='Apenas compara com as mensalidades, sem gravar.')
+        parser.add_argument('--owner', help='Username do professor; por padrão, todos.')
+
+    def handle(self, *args, verificar=False, owner=None, **options):
+        if owner is not None:
+            try:
+                owner = User.objects.get(username=owner)
+            except User.DoesNotExist:
+                raise CommandError(f'Usuário "{owner}" não encontrado.')
+
+        if not verificar:
+            linhas = receitas.reconstruir(owner)
+            self.stdout.write(self.style.SUCCESS(f'Receita diária reconstruída: {linhas} linha(s).'))
+
+        divergencias = receitas.verificar(owner)
+        for owner_id, data, esperado, gravado in divergencias:
+            self.stderr.write(f'owner {owner_id} em {data}: esperado {esperado}, gravado {gravado}')
+        if divergencias:
+            raise CommandError(f'{len(divergencias)} divergência(s) na receita diária.')
+        self.stdout.write(self.style.SUCCESS('Receita diária confere com as mensalidades.'))
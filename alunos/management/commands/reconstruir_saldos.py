@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from alunos import pagamentos
+
+
+class Command(BaseCommand):
+    help = 'Recalcula o saldo devedor dos alunos a partir das mensalidades em aberto, ou só o confere.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verificar', action='store_true', help='Apenas compara com as mensalidades, sem gravar.')
+        parser.add_argument('--owner', help='Username do professor; por padrão, todos.')
+
+    def handle(self, *args, verificar=False, owner=None, **options):
+        if owner is not None:
+            try:
+                owner = User.objects.get(username=owner)
+            except User.DoesNotExist:
+                raise CommandError(f'Usuário "{owner}" não encontrado.')
+
+        if not verificar:
+            alunos = pagamentos.reconstruir(owner)
+            self.stdout.write(self.style.SUCCESS(f'Saldos recalculados: {alunos} aluno(s).'))
+
+        divergencias = pagamentos.verificar(owner)
+        for aluno_id, esperado, gravado in divergencias:
+            self.stderr.write(f'aluno {aluno_id}: esperado {esperado}, gravado {gravado}')
+        if divergencias:
+            raise CommandError(f'{len(divergencias)} divergência(s) no saldo devedor.')
+        self.stdout.write(self.style.SUCCESS('Saldos devedores conferem com as mensalidades.'))
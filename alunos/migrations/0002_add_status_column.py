@@ -1,5 +1,6 @@
 from django.db import migrations, models
-from django.db import migrations
+
+from alunos.operacoes import RunSQLPostgres
 
 class Migration(migrations.Migration):
 
@@ -9,8 +10,9 @@ class Migration(migrations.Migration):
 
     operations = [
         migrations.SeparateDatabaseAndState(
+            # A coluna já vem da 0001; o IF NOT EXISTS só existe no Postgres
             database_operations=[
-                migrations.RunSQL(
+                RunSQLPostgres(
                     sql=(
                         "ALTER TABLE \"alunos_mensalidade\" "
                         "ADD COLUMN IF NOT EXISTS \"status\" varchar(10) NOT NULL DEFAULT 'PENDENTE'"
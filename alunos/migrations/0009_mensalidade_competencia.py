@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alunos', '0008_userprofile_terms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mensalidade',
+            name='competencia',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='mensalidade',
+            constraint=models.UniqueConstraint(fields=('aluno', 'competencia'), name='mensalidade_aluno_competencia_uniq'),
+        ),
+    ]
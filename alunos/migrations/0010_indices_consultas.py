@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+from alunos.operacoes import AddIndexConcorrente
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY não pode rodar dentro de transação
+    atomic = False
+
+    dependencies = [
+        ('alunos', '0009_mensalidade_competencia'),
+    ]
+
+    operations = [
+        AddIndexConcorrente(
+            model_name='aluno',
+            index=models.Index(fields=['owner', 'ativo', 'nome'], name='aluno_owner_ativo_nome_idx'),
+        ),
+        AddIndexConcorrente(
+            model_name='aluno',
+            index=models.Index(fields=['owner', 'nome'], name='aluno_owner_nome_idx'),
+        ),
+        AddIndexConcorrente(
+            model_name='mensalidade',
+            index=models.Index(fields=['aluno', 'status'], name='mensalidade_aluno_status_idx'),
+        ),
+        AddIndexConcorrente(
+            model_name='mensalidade',
+            index=models.Index(fields=['aluno', 'data_vencimento'], name='mensalidade_aluno_venc_idx'),
+        ),
+        AddIndexConcorrente(
+            model_name='mensalidade',
+            index=models.Index(fields=['status', 'data_pagamento'], name='mensalidade_status_pgto_idx'),
+        ),
+        AddIndexConcorrente(
+            model_name='mensalidade',
+            index=models.Index(condition=models.Q(('status', 'PENDENTE')), fields=['aluno'], name='mensalidade_pendente_idx'),
+        ),
+        AddIndexConcorrente(
+            model_name='presenca',
+            index=models.Index(fields=['data', 'aluno'], name='presenca_data_aluno_idx'),
+        ),
+    ]
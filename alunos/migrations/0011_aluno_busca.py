@@ -0,0 +1,60 @@
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+from alunos.busca import garantir_indice_busca
+
+
+# Cópia congelada da normalização de alunos/busca.py quando esta migração foi escrita:
+# mudanças posteriores lá não alteram o que ela grava
+def _normalizar(texto):
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return ' '.join(sem_acentos.lower().split())
+
+
+def _texto_de_busca(nome, telefone, email):
+    digitos = re.sub(r'\D', '', telefone or '')
+    return ' '.join(filter(None, [_normalizar(nome), _normalizar(email), digitos]))
+
+
+def preencher_busca(apps, schema_editor):
+    Aluno = apps.get_model('alunos', 'Aluno')
+    alunos = list(Aluno.objects.only('nome', 'telefone', 'email'))
+    for aluno in alunos:
+        aluno.busca = _texto_de_busca(aluno.nome, aluno.telefone, aluno.email)
+    Aluno.objects.bulk_update(alunos, ['busca'], batch_size=500)
+
+
+def criar_indice_busca(apps, schema_editor):
+    garantir_indice_busca(schema_editor.connection)
+
+
+def remover_indice_busca(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if schema_editor.connection.vendor == 'postgresql':
+            cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS aluno_busca_trgm_idx')
+        elif schema_editor.connection.vendor == 'sqlite':
+            for sufixo in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS alunos_aluno_fts_{sufixo}')
+            cursor.execute('DROP TABLE IF EXISTS alunos_aluno_fts')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY não pode rodar dentro de transação
+    atomic = False
+
+    dependencies = [
+        ('alunos', '0010_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aluno',
+            name='busca',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(preencher_busca, migrations.RunPython.noop, atomic=True),
+        migrations.RunPython(criar_indice_busca, remover_indice_busca),
+    ]
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+
+def preencher_receitas(apps, schema_editor):
+    Mensalidade = apps.get_model('alunos', 'Mensalidade')
+    ReceitaDiaria = apps.get_model('alunos', 'ReceitaDiaria')
+    por_dia = (
+        Mensalidade.objects
+        # Alunos sem professor (owner nulo) não têm receita onde entrar
+        .filter(status='PAGO', data_pagamento__isnull=False, aluno__owner__isnull=False)
+        .order_by()
+        .values_list('aluno__owner', 'data_pagamento')
+        .annotate(total=Sum('valor'), quantidade=Count('id'))
+    )
+    ReceitaDiaria.objects.bulk_create([
+        ReceitaDiaria(owner_id=owner_id, data=data, total=total, quantidade=quantidade)
+        for owner_id, data, total, quantidade in por_dia
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('alunos', '0011_aluno_busca'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReceitaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('quantidade', models.IntegerField(default=0)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='receitadiaria',
+            constraint=models.UniqueConstraint(fields=('owner', 'data'), name='receita_owner_data_uniq'),
+        ),
+        migrations.RunPython(preencher_receitas, migrations.RunPython.noop),
+    ]
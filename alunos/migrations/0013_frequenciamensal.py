@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def preencher_frequencias(apps, schema_editor):
+    Presenca = apps.get_model('alunos', 'Presenca')
+    FrequenciaMensal = apps.get_model('alunos', 'FrequenciaMensal')
+    por_mes = (
+        Presenca.objects
+        # Alunos sem professor (owner nulo) ficam sem contador
+        .filter(presente=True, aluno__owner__isnull=False)
+        .order_by()
+        .annotate(mes=TruncMonth('data'))
+        .values_list('aluno', 'mes', 'aluno__owner')
+        .annotate(total=Count('id'))
+    )
+    FrequenciaMensal.objects.bulk_create([
+        FrequenciaMensal(aluno_id=aluno_id, owner_id=owner_id, mes=mes, total=total)
+        for aluno_id, mes, owner_id, total in por_mes
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('alunos', '0012_receitadiaria'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FrequenciaMensal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField()),
+                ('total', models.IntegerField(default=0)),
+                ('aluno', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='alunos.aluno')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'mes', '-total'], name='frequencia_owner_mes_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='frequenciamensal',
+            constraint=models.UniqueConstraint(fields=('aluno', 'mes'), name='frequencia_aluno_mes_uniq'),
+        ),
+        migrations.RunPython(preencher_frequencias, migrations.RunPython.noop),
+    ]
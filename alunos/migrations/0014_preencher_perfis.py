@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def preencher_perfis(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    UserProfile = apps.get_model('alunos', 'UserProfile')
+    UserProfile.objects.bulk_create([
+        UserProfile(user_id=pk)
+        for pk in User.objects.filter(profile__isnull=True).values_list('pk', flat=True)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alunos', '0013_frequenciamensal'),
+    ]
+
+    operations = [
+        migrations.RunPython(preencher_perfis, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('alunos', '0014_preencher_perfis'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatorioMensalSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField()),
+                ('dados', models.JSONField()),
+                ('etag', models.CharField(max_length=64)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='relatoriomensalsnapshot',
+            constraint=models.UniqueConstraint(fields=('owner', 'mes'), name='relatorio_owner_mes_uniq'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('alunos', '0015_relatoriomensalsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tarefa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=50)),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('anexo', models.BinaryField(blank=True, null=True)),
+                ('chave', models.CharField(blank=True, max_length=100, null=True, unique=True)),
+                ('status', models.CharField(choices=[('PENDENTE', 'Pendente'), ('EXECUTANDO', 'Executando'), ('CONCLUIDA', 'Concluída'), ('FALHOU', 'Falhou')], default='PENDENTE', max_length=20)),
+                ('tentativas', models.PositiveSmallIntegerField(default=0)),
+                ('max_tentativas', models.PositiveSmallIntegerField(default=5)),
+                ('executar_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('reservada_ate', models.DateTimeField(blank=True, null=True)),
+                ('trabalhador', models.CharField(blank=True, max_length=100)),
+                ('progresso_atual', models.PositiveIntegerField(default=0)),
+                ('progresso_total', models.PositiveIntegerField(default=0)),
+                ('mensagem', models.CharField(blank=True, max_length=200)),
+                ('resultado', models.JSONField(blank=True, null=True)),
+                ('erro', models.TextField(blank=True)),
+                ('criada_em', models.DateTimeField(auto_now_add=True)),
+                ('concluida_em', models.DateTimeField(blank=True, null=True)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tarefas', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'executar_em'], name='tarefa_status_executar_idx')],
+            },
+        ),
+    ]
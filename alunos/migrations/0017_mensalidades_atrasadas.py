@@ -0,0 +1,35 @@
+from django.db import migrations, models
+from django.utils import timezone
+
+from alunos.operacoes import AddIndexConcorrente, RemoveIndexConcorrente
+
+
+def marcar_atrasadas(apps, schema_editor):
+    # O mesmo UPDATE de faturamento.atualizar_atrasadas, para o status já sair certo do deploy
+    Mensalidade = apps.get_model('alunos', 'Mensalidade')
+    Mensalidade.objects.filter(status='PENDENTE', data_vencimento__lt=timezone.localdate()).update(status='ATRASADO')
+
+
+class Migration(migrations.Migration):
+    # CREATE/DROP INDEX CONCURRENTLY não pode rodar dentro de transação
+    atomic = False
+
+    dependencies = [
+        ('alunos', '0016_tarefa'),
+    ]
+
+    operations = [
+        AddIndexConcorrente(
+            model_name='mensalidade',
+            index=models.Index(condition=models.Q(('status', 'PENDENTE')), fields=['data_vencimento'], name='mensalidade_pendente_venc_idx'),
+        ),
+        AddIndexConcorrente(
+            model_name='mensalidade',
+            index=models.Index(condition=models.Q(('status__in', ['PENDENTE', 'ATRASADO'])), fields=['aluno'], name='mensalidade_em_aberto_idx'),
+        ),
+        migrations.RunPython(marcar_atrasadas, migrations.RunPython.noop),
+        RemoveIndexConcorrente(
+            model_name='mensalidade',
+            name='mensalidade_pendente_idx',
+        ),
+    ]
@@ -0,0 +1,70 @@
+from django.db import migrations, models
+from django.db.models import Exists, F, OuterRef, Subquery, Sum
+
+from alunos.operacoes import AddIndexConcorrente
+
+TAMANHO_LOTE = 2000
+
+
+def preencher_livro(apps, schema_editor):
+    Aluno = apps.get_model('alunos', 'Aluno')
+    Mensalidade = apps.get_model('alunos', 'Mensalidade')
+    Pagamento = apps.get_model('alunos', 'Pagamento')
+    RelatorioMensalSnapshot = apps.get_model('alunos', 'RelatorioMensalSnapshot')
+
+    # Mensalidades pagas sem lançamento no livro: um pagamento "Não informado" do valor cheio
+    lancamentos = Pagamento.objects.filter(mensalidade=OuterRef('pk'))
+    sem_lancamento = list(
+        Mensalidade.objects.filter(status='PAGO').exclude(Exists(lancamentos))
+        .values_list('pk', 'valor', 'data_pagamento', 'data_vencimento')
+    )
+    Pagamento.objects.bulk_create([
+        Pagamento(mensalidade_id=pk, valor_pago=valor, data_pagamento=pagamento or vencimento, metodo_pagamento='NAO_INFORMADO')
+        for pk, valor, pagamento, vencimento in sem_lancamento
+    ], batch_size=TAMANHO_LOTE)
+
+    lancado = lancamentos.order_by().values('mensalidade').annotate(total=Sum('valor_pago')).values('total')
+    Mensalidade.objects.filter(Exists(lancamentos)).update(valor_pago=Subquery(lancado))
+
+    em_aberto = Mensalidade.objects.filter(aluno=OuterRef('pk'), status__in=['PENDENTE', 'ATRASADO'])
+    falta = em_aberto.order_by().values('aluno').annotate(total=Sum(F('valor') - F('valor_pago'))).values('total')
+    Aluno.objects.filter(Exists(em_aberto)).update(saldo_devedor=Subquery(falta))
+
+    # Os relatórios gravados não têm o recebido por forma de pagamento; são refeitos na próxima leitura
+    RelatorioMensalSnapshot.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY não pode rodar dentro de transação
+    atomic = False
+
+    dependencies = [
+        ('alunos', '0017_mensalidades_atrasadas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aluno',
+            name='saldo_devedor',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='mensalidade',
+            name='valor_pago',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=6),
+        ),
+        migrations.AlterField(
+            model_name='pagamento',
+            name='metodo_pagamento',
+            field=models.CharField(choices=[('DINHEIRO', 'Dinheiro'), ('PIX', 'PIX'), ('CARTAO', 'Cartão'), ('TRANSFERENCIA', 'Transferência'), ('NAO_INFORMADO', 'Não informado')], max_length=20),
+        ),
+        migrations.RunPython(preencher_livro, migrations.RunPython.noop, atomic=True),
+        AddIndexConcorrente(
+            model_name='aluno',
+            index=models.Index(condition=models.Q(('saldo_devedor__gt', 0)), fields=['owner', 'nome'], name='aluno_devedor_idx'),
+        ),
+        AddIndexConcorrente(
+            model_name='pagamento',
+            index=models.Index(fields=['data_pagamento', 'mensalidade'], name='pagamento_data_idx'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alunos', '0018_livro_de_pagamentos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pagamento',
+            name='chave',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+from alunos.operacoes import AddIndexConcorrente
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('alunos', '0019_pagamento_chave'),
+    ]
+
+    operations = [
+        AddIndexConcorrente(
+            model_name='mensalidade',
+            index=models.Index(fields=['data_vencimento'], name='mensalidade_venc_idx'),
+        ),
+    ]
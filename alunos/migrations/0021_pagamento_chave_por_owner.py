@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+def prefixar_chaves(apps, schema_editor):
+    Pagamento = apps.get_model('alunos', 'Pagamento')
+    gravadas = (
+        Pagamento.objects
+        .filter(chave__isnull=False, mensalidade__aluno__owner__isnull=False)
+        .values_list('pk', 'chave', 'mensalidade__aluno__owner')
+    )
+    for pk, chave, owner_id in gravadas.iterator():
+        Pagamento.objects.filter(pk=pk).update(chave=f'{owner_id}:{chave}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alunos', '0020_mensalidade_venc_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pagamento',
+            name='chave',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True, unique=True),
+        ),
+        migrations.RunPython(prefixar_chaves, migrations.RunPython.noop),
+    ]
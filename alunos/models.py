@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import User
@@ -38,22 +40,64 @@ class Aluno(models.Model):
     ])
     bolsista = models.BooleanField(default=False)
     ativo = models.BooleanField(default=True)
+    # Nome, email e telefone normalizados para a busca indexada (ver alunos/busca.py)
+    busca = models.TextField(blank=True, default='', editable=False)
+    # Soma do que falta pagar das mensalidades em aberto (ver alunos/pagamentos.py)
+    saldo_devedor = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'ativo', 'nome'], name='aluno_owner_ativo_nome_idx'),
+            models.Index(fields=['owner', 'nome'], name='aluno_owner_nome_idx'),
+            models.Index(fields=['owner', 'nome'], condition=models.Q(saldo_devedor__gt=0), name='aluno_devedor_idx'),
+        ]
     
     def __str__(self):
         return self.nome
 
+    def preencher_busca(self):
+        from .busca import texto_de_busca
+        self.busca = texto_de_busca(self.nome, self.telefone, self.email)
+
+    def save(self, *args, **kwargs):
+        self.preencher_busca()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'nome', 'telefone', 'email'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'busca'}
+        super().save(*args, **kwargs)
+
 class Mensalidade(models.Model):
     STATUS_CHOICES = [
         ('PENDENTE', 'Pendente'),
         ('PAGO', 'Pago'),
         ('ATRASADO', 'Atrasado'),
     ]
+    # Ainda não pagas: ATRASADO é a PENDENTE já vencida (ver faturamento.atualizar_atrasadas)
+    EM_ABERTO = ('PENDENTE', 'ATRASADO')
     
     aluno = models.ForeignKey(Aluno, on_delete=models.CASCADE)
     data_vencimento = models.DateField()
     valor = models.DecimalField(max_digits=6, decimal_places=2)
     data_pagamento = models.DateField(null=True, blank=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDENTE')
+    # Soma dos pagamentos (parciais) lançados; quitada, a mensalidade passa a PAGO
+    valor_pago = models.DecimalField(max_digits=6, decimal_places=2, default=0, editable=False)
+    # Competência (1º dia do mês) das mensalidades geradas em massa; nula nas avulsas
+    competencia = models.DateField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['aluno', 'competencia'], name='mensalidade_aluno_competencia_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['aluno', 'status'], name='mensalidade_aluno_status_idx'),
+            models.Index(fields=['aluno', 'data_vencimento'], name='mensalidade_aluno_venc_idx'),
+            models.Index(fields=['status', 'data_pagamento'], name='mensalidade_status_pgto_idx'),
+            models.Index(fields=['aluno'], condition=models.Q(status__in=['PENDENTE', 'ATRASADO']), name='mensalidade_em_aberto_idx'),
+            models.Index(fields=['data_vencimento'], condition=models.Q(status='PENDENTE'), name='mensalidade_pendente_venc_idx'),
+            # Navegação por data (date_hierarchy) e filtro por vencimento do admin
+            models.Index(fields=['data_vencimento'], name='mensalidade_venc_idx'),
+        ]
     
     def __str__(self):
         return f"Mensalidade de {self.aluno.nome} - {self.data_vencimento}"
@@ -61,18 +105,28 @@ class Mensalidade(models.Model):
     def save(self, *args, **kwargs):
         if not self.valor:
             self.valor = 100.00 if self.aluno.bolsista else 150.00
+        # Em aberto, o status segue o vencimento (ex.: ao adiar uma atrasada, ela volta a PENDENTE)
+        if self.status in self.EM_ABERTO:
+            self.status = 'ATRASADO' if self.data_vencimento < timezone.localdate() else 'PENDENTE'
         super().save(*args, **kwargs)
 
     @property
     def pago(self):
         return self.status == 'PAGO'
 
+    @property
+    def saldo(self):
+        """Quanto falta pagar (zero se já está paga)."""
+        return Decimal('0') if self.pago else Decimal(self.valor) - Decimal(self.valor_pago)
+
 class Pagamento(models.Model):
     METODO_CHOICES = [
         ('DINHEIRO', 'Dinheiro'),
         ('PIX', 'PIX'),
         ('CARTAO', 'Cartão'),
         ('TRANSFERENCIA', 'Transferência'),
+        # Pagamentos registrados sem a forma (ex.: anteriores ao livro de pagamentos)
+        ('NAO_INFORMADO', 'Não informado'),
     ]
     
     mensalidade = models.ForeignKey(Mensalidade, on_delete=models.CASCADE)
@@ -80,6 +134,14 @@ class Pagamento(models.Model):
     valor_pago = models.DecimalField(max_digits=10, decimal_places=2)
     metodo_pagamento = models.CharField(max_length=20, choices=METODO_CHOICES)
     data_registro = models.DateTimeField(auto_now_add=True)
+    # Chave de idempotência enviada pelo formulário, prefixada pelo owner ("<owner_id>:<chave>"):
+    # o reenvio não lança o pagamento de novo
+    chave = models.CharField(max_length=100, unique=True, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['data_pagamento', 'mensalidade'], name='pagamento_data_idx'),
+        ]
     
     def __str__(self):
         return f"Pagamento de {self.mensalidade.aluno.nome} - {self.data_pagamento}"
@@ -93,10 +155,128 @@ class Presenca(models.Model):
     class Meta:
         unique_together = (('aluno', 'data'),)
         ordering = ['-data', 'aluno__nome']
+        indexes = [
+            models.Index(fields=['data', 'aluno'], name='presenca_data_aluno_idx'),
+        ]
 
     def __str__(self):
         return f"{self.aluno.nome} - {self.data} - {'Presente' if self.presente else 'Ausente'}"
 
+class FrequenciaMensal(models.Model):
+    """Presenças (presente=True) de cada aluno por mês. Mantida por `alunos.frequencia`."""
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    aluno = models.ForeignKey(Aluno, on_delete=models.CASCADE)
+    mes = models.DateField()  # 1º dia do mês
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['aluno', 'mes'], name='frequencia_aluno_mes_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'mes', '-total'], name='frequencia_owner_mes_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.aluno.nome} - {self.mes:%m/%Y}: {self.total}"
+
+class ReceitaDiaria(models.Model):
+    """Total das mensalidades pagas por dia de pagamento, por owner. Mantida por `alunos.receitas`."""
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    data = models.DateField()
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    quantidade = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'data'], name='receita_owner_data_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Receita de {self.owner.username} em {self.data}: R$ {self.total}"
+
+class RelatorioMensalSnapshot(models.Model):
+    """Relatório de um mês já encerrado, calculado uma vez. Descartado por `alunos.receitas`
+    quando uma mensalidade paga naquele mês é alterada ou excluída."""
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    mes = models.DateField()
+    dados = models.JSONField()
+    etag = models.CharField(max_length=64)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'mes'], name='relatorio_owner_mes_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Relatório de {self.owner.username} em {self.mes:%m/%Y}"
+
+class Tarefa(models.Model):
+    """Trabalho pesado executado fora da requisição pelo `manage.py executar_tarefas`
+    (ver alunos/tarefas.py). A própria tabela é a fila; não há broker externo."""
+    STATUS_CHOICES = [
+        ('PENDENTE', 'Pendente'),
+        ('EXECUTANDO', 'Executando'),
+        ('CONCLUIDA', 'Concluída'),
+        ('FALHOU', 'Falhou'),
+    ]
+
+    tipo = models.CharField(max_length=50)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tarefas', null=True, blank=True)
+    parametros = models.JSONField(default=dict, blank=True)
+    anexo = models.BinaryField(null=True, blank=True)  # ex.: a planilha de uma importação
+    # Tarefas periódicas: uma por período ("faturamento_mensal:2024-05"), mesmo com vários workers
+    chave = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDENTE')
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    max_tentativas = models.PositiveSmallIntegerField(default=5)
+    executar_em = models.DateTimeField(default=timezone.now)
+    reservada_ate = models.DateTimeField(null=True, blank=True)
+    trabalhador = models.CharField(max_length=100, blank=True)
+    progresso_atual = models.PositiveIntegerField(default=0)
+    progresso_total = models.PositiveIntegerField(default=0)
+    mensagem = models.CharField(max_length=200, blank=True)
+    resultado = models.JSONField(null=True, blank=True)
+    erro = models.TextField(blank=True)
+    criada_em = models.DateTimeField(auto_now_add=True)
+    concluida_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'executar_em'], name='tarefa_status_executar_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} #{self.pk} ({self.get_status_display()})"
+
+    @property
+    def terminada(self):
+        return self.status in ('CONCLUIDA', 'FALHOU')
+
+    @property
+    def percentual(self):
+        if self.status == 'CONCLUIDA':
+            return 100
+        return min(100, self.progresso_atual * 100 // self.progresso_total) if self.progresso_total else 0
+
+    def informar_progresso(self, atual, total=None, mensagem=''):
+        """Grava o andamento (lido pela página da tarefa) e renova a reserva do worker.
+
+        Chamada fora de transações para que o andamento apareça enquanto a tarefa roda.
+        """
+        from .tarefas import TEMPO_RESERVA
+
+        self.progresso_atual = atual
+        if total is not None:
+            self.progresso_total = total
+        self.mensagem = mensagem[:200]
+        self.reservada_ate = timezone.now() + TEMPO_RESERVA
+        Tarefa.objects.filter(pk=self.pk).update(
+            progresso_atual=self.progresso_atual, progresso_total=self.progresso_total,
+            mensagem=self.mensagem, reservada_ate=self.reservada_ate,
+        )
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     # avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)  # Temporariamente comentado
@@ -110,14 +290,9 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username}'s profile"
 
-# Signal to create/update user profile
+# Cria o perfil junto com o usuário. Saves seguintes (como o last_login a cada login) não
+# tocam o banco; usuários antigos sem perfil foram preenchidos na migração 0014
 @receiver(post_save, sender=User)
-def create_or_update_user_profile(sender, instance, created, **kwargs):
-    if created:
+def create_user_profile(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
         UserProfile.objects.create(user=instance)
-    # For existing users, create a profile if it doesn't exist
-    else:
-        # This will get the profile if it exists, or create it if it doesn't
-        profile, created = UserProfile.objects.get_or_create(user=instance)
-        # If the profile already existed, you might want to save it here if you made other changes elsewhere
-        # profile.save()
@@ -0,0 +1,53 @@
+"""Operações de migração que dependem do banco em uso."""
+from django.contrib.postgres.operations import AddIndexConcurrently, RemoveIndexConcurrently
+from django.db import migrations
+
+
+class AddIndexConcorrente(AddIndexConcurrently):
+    """`CREATE INDEX CONCURRENTLY` no Postgres; `AddIndex` comum nos demais bancos.
+
+    Exige `atomic = False` na migração, como o `AddIndexConcurrently` original.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        return migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        return migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+class RemoveIndexConcorrente(RemoveIndexConcurrently):
+    """`DROP INDEX CONCURRENTLY` no Postgres; `RemoveIndex` comum nos demais bancos.
+
+    Exige `atomic = False` na migração, como o `RemoveIndexConcurrently` original.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        return migrations.RemoveIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        return migrations.RemoveIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+class RunSQLPostgres(migrations.RunSQL):
+    """`RunSQL` só no Postgres; nos demais bancos não faz nada.
+
+    Para SQL escrito para o Postgres (ex.: `ADD COLUMN IF NOT EXISTS`) cujo efeito o
+    schema criado pelas migrações anteriores já garante nos outros bancos.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
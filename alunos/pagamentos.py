@@ -0,0 +1,253 @@
+"""Livro de pagamentos (Pagamento) e saldos em aberto, atualizados na mesma transação.
+
+Cada pagamento, parcial ou não, vira uma linha de Pagamento e é somado em
+`Mensalidade.valor_pago`; quando a soma alcança o valor, a mensalidade passa a PAGO e
+entra na receita diária (ver receitas.py) na data do pagamento que a quitou.
+
+`Aluno.saldo_devedor` guarda o que falta pagar das mensalidades em aberto do aluno, para
+"quem deve quanto" ser uma leitura indexada. Quem altera uma mensalidade tira a foto da
+pendência antes (`pendencia`) e aplica a diferença depois (`registrar_alteracao`);
+exclusões em lote usam `registrar_remocao` e cargas em massa, `recalcular_saldos`.
+"""
+from collections import defaultdict
+from dataclasses import dataclass, replace
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import cache_academia, receitas
+from .models import Aluno, Mensalidade, Pagamento
+
+TEMPO_CHAVE = 60 * 60 * 24  # por quanto tempo o reenvio de uma chave é respondido pelo cache
+_DINHEIRO = DecimalField(max_digits=10, decimal_places=2)
+_FALTA_PAGAR = ExpressionWrapper(F('valor') - F('valor_pago'), output_field=_DINHEIRO)
+
+
+class ErroDePagamento(Exception):
+    """Pagamento recusado (mensalidade já paga, valor fora do saldo); nada é gravado."""
+
+
+def pendencia(mensalidade):
+    """(aluno_id, saldo) com que `mensalidade` entra no saldo devedor, ou None se não está em aberto."""
+    if mensalidade is None or mensalidade.status not in Mensalidade.EM_ABERTO:
+        return None
+    return (mensalidade.aluno_id, mensalidade.saldo)
+
+
+def aplicar_deltas(deltas):
+    """Soma `{aluno_id: valor}` ao saldo devedor dos alunos (UPDATE relativo, sem ler antes)."""
+    for aluno_id, valor in deltas.items():
+        if valor:
+            Aluno.objects.filter(pk=aluno_id).update(saldo_devedor=F('saldo_devedor') + valor)
+
+
+def registrar_alteracao(antes, depois):
+    """Aplica a troca de pendência `antes` -> `depois` (qualquer uma pode ser None)."""
+    deltas = defaultdict(Decimal)
+    if antes is not None:
+        deltas[antes[0]] -= antes[1]
+    if depois is not None:
+        deltas[depois[0]] += depois[1]
+    aplicar_deltas(deltas)
+
+
+def _saldo_em_aberto(mensalidades):
+    """Subconsulta: quanto falta pagar das mensalidades em aberto de `mensalidades` do aluno externo."""
+    por_aluno = (
+        mensalidades
+        .filter(aluno=OuterRef('pk'), status__in=Mensalidade.EM_ABERTO)
+        .order_by()
+        .values('aluno')
+        .annotate(saldo=Sum(_FALTA_PAGAR))
+        .values('saldo')
+    )
+    return Coalesce(Subquery(por_aluno), Value(Decimal('0')), output_field=_DINHEIRO)
+
+
+def descartar_relatorios(mensalidades):
+    """Apaga os relatórios gravados dos meses encerrados em que `mensalidades` receberam
+    pagamentos (o recebido por forma de pagamento sai do livro)."""
+    mes_atual = timezone.localdate().replace(day=1)
+    receitas.descartar_relatorios(
+        Pagamento.objects
+        .filter(mensalidade__in=mensalidades, data_pagamento__lt=mes_atual)
+        .order_by()
+        .values_list('mensalidade__aluno__owner', 'data_pagamento')
+        .distinct()
+    )
+
+
+def registrar_remocao(mensalidades):
+    """Retira do saldo devedor as mensalidades em aberto de `mensalidades` (chamar antes de excluí-las)."""
+    descartar_relatorios(mensalidades)
+    em_aberto = mensalidades.filter(status__in=Mensalidade.EM_ABERTO)
+    Aluno.objects.filter(pk__in=em_aberto.values('aluno')).update(
+        saldo_devedor=F('saldo_devedor') - _saldo_em_aberto(mensalidades),
+    )
+
+
+def recalcular_saldos(alunos):
+    """Refaz, num único UPDATE, o saldo devedor de `alunos` (queryset) a partir das mensalidades."""
+    return alunos.update(saldo_devedor=_saldo_em_aberto(Mensalidade.objects.all()))
+
+
+@dataclass(frozen=True)
+class Lancamento:
+    """Desfecho de `registrar_pagamento`, também guardado no cache pela chave de idempotência."""
+    pagamento_id: int
+    quitada: bool
+    saldo: Decimal  # o que ficou em aberto na mensalidade
+    repetido: bool = False  # reenvio de um pagamento já lançado com a mesma chave
+
+
+def _chave_cache(owner_id, chave):
+    return f'bel:pagamento:{owner_id}:{chave}'
+
+
+def _chave_no_livro(owner_id, chave):
+    """A chave gravada em Pagamento.chave: prefixada pelo owner, para a mesma chave enviada por
+    owners diferentes não colidir na restrição única."""
+    return f'{owner_id}:{chave}'
+
+
+def _lancamento_da_chave(owner, chave):
+    """O Lancamento já gravado com `chave` para o `owner`, ou None."""
+    if not chave:
+        return None
+    lancado = (
+        Pagamento.objects
+        .filter(chave=_chave_no_livro(owner.pk, chave), mensalidade__aluno__owner=owner)
+        .values_list('pk', 'mensalidade__status', 'mensalidade__valor', 'mensalidade__valor_pago')
+        .first()
+    )
+    if lancado is None:
+        return None
+    pk, status, valor, valor_pago = lancado
+    return Lancamento(pk, status == 'PAGO', Decimal('0') if status == 'PAGO' else valor - valor_pago, repetido=True)
+
+
+def _recusa(do_owner, owner, chave):
+    """Explica um UPDATE que não alterou nada: reenvio (devolve o Lancamento), mensalidade
+    inexistente (Mensalidade.DoesNotExist) ou já paga / valor acima do saldo (ErroDePagamento)."""
+    lancamento = _lancamento_da_chave(owner, chave)
+    if lancamento is not None:
+        return lancamento
+    status, valor, valor_pago = do_owner.values_list('status', 'valor', 'valor_pago').get()
+    if status == 'PAGO':
+        raise ErroDePagamento('Esta mensalidade já foi paga.')
+    raise ErroDePagamento(f'O valor passa do saldo da mensalidade (R$ {valor - valor_pago}).')
+
+
+def _lancar(owner, mensalidade_id, valor, metodo, data, chave):
+    # Sem junção no UPDATE: o dono entra como subconsulta em aluno_id, e o status e o valor pago
+    # ficam no WHERE da própria linha, que o Postgres reavalia se outra transação a alterou antes
+    do_owner = Mensalidade.objects.filter(pk=mensalidade_id, aluno__in=Aluno.objects.filter(owner=owner))
+    em_aberto = do_owner.exclude(status='PAGO')
+    if valor is None:
+        # Quitar: o valor do lançamento é o saldo lido agora. Se outra transação mudar a
+        # mensalidade antes do UPDATE, ele recusa (saldo menor) ou lança só esse valor e a
+        # mensalidade fica em aberto com o resto (valor aumentado), como num pagamento parcial
+        lida = em_aberto.values_list('valor', 'valor_pago').first()
+        if lida is None:
+            return _recusa(do_owner, owner, chave)
+        valor = lida[0] - lida[1]
+    valor = Decimal(valor)
+    if valor <= 0:
+        raise ErroDePagamento('Informe um valor maior que zero.')
+
+    novo_valor_pago = F('valor_pago') + valor
+    quita = Q(valor=novo_valor_pago)
+    atualizadas = em_aberto.filter(valor__gte=novo_valor_pago).update(
+        valor_pago=novo_valor_pago,
+        status=Case(When(quita, then=Value('PAGO')), default=F('status')),
+        data_pagamento=Case(When(quita, then=Value(data)), default=F('data_pagamento')),
+    )
+    if not atualizadas:
+        return _recusa(do_owner, owner, chave)
+
+    # A linha já está travada pelo UPDATE: a leitura vê o resultado dele, não o que foi lido antes
+    valor_total, valor_pago, aluno_id = (
+        Mensalidade.objects.filter(pk=mensalidade_id).values_list('valor', 'valor_pago', 'aluno_id').get()
+    )
+    saldo = valor_total - valor_pago
+    pagamento = Pagamento.objects.create(
+        mensalidade_id=mensalidade_id, data_pagamento=data, valor_pago=valor, metodo_pagamento=metodo,
+        chave=_chave_no_livro(owner.pk, chave) if chave else None,
+    )
+    aplicar_deltas({aluno_id: -valor})
+    if not saldo:
+        receitas.registrar_alteracao(None, (owner.pk, data, Decimal(valor_total)))
+    else:
+        receitas.descartar_relatorios([(owner.pk, data)])
+    cache_academia.invalidar(owner.pk)
+    return Lancamento(pagamento.pk, not saldo, saldo)
+
+
+def registrar_pagamento(owner, mensalidade_id, valor=None, metodo='NAO_INFORMADO', data=None, chave=None):
+    """Lança um pagamento de `valor` (padrão: todo o saldo) na mensalidade do `owner` e devolve o Lancamento.
+
+    Quem decide é um único UPDATE condicional (mensalidade do owner, não paga e com saldo
+    para o valor), sem SELECT FOR UPDATE; o número de linhas alteradas diz se o pagamento
+    entrou, e o saldo que ficou é lido da linha depois dele. Sem `valor`, o saldo é lido
+    antes só para fixar o valor do lançamento. Na mesma transação vêm o
+    lançamento no livro, o saldo devedor do aluno e, se a mensalidade foi quitada, a
+    receita do dia. Com `chave`, o reenvio do mesmo pedido devolve o Lancamento original
+    (do cache, sem ir ao banco, ou da chave única do livro) sem lançar de novo.
+
+    Levanta Mensalidade.DoesNotExist se a mensalidade não é do owner e ErroDePagamento se
+    ela já está paga ou se o valor não é positivo ou passa do saldo.
+    """
+    if chave:
+        lancamento = cache.get(_chave_cache(owner.pk, chave))
+        if lancamento is not None:
+            return replace(lancamento, repetido=True)
+    try:
+        with transaction.atomic():
+            lancamento = _lancar(owner, mensalidade_id, valor, metodo, data or timezone.localdate(), chave)
+    except IntegrityError:
+        # Um pedido com a mesma chave gravou antes; esta transação foi desfeita inteira
+        lancamento = _lancamento_da_chave(owner, chave)
+        if lancamento is None:
+            raise
+    if chave:
+        # Só depois do commit: dentro de uma transação maior o lançamento ainda pode ser desfeito
+        transaction.on_commit(lambda: cache.set(_chave_cache(owner.pk, chave), lancamento, TEMPO_CHAVE))
+    return lancamento
+
+
+def devedores(owner):
+    """Alunos do `owner` com saldo em aberto, em ordem de nome (índice parcial aluno_devedor_idx)."""
+    return Aluno.objects.filter(owner=owner, saldo_devedor__gt=0).order_by('nome', 'pk')
+
+
+def saldos_esperados(owner=None):
+    alunos = Aluno.objects.all()
+    if owner is not None:
+        alunos = alunos.filter(owner=owner)
+    return alunos.annotate(esperado=_saldo_em_aberto(Mensalidade.objects.all()))
+
+
+def reconstruir(owner=None):
+    """Recalcula o saldo devedor dos alunos (de `owner` ou de todos). Devolve quantos alunos."""
+    alunos = Aluno.objects.all()
+    if owner is not None:
+        alunos = alunos.filter(owner=owner)
+    with transaction.atomic():
+        afetados = set(alunos.values_list('owner', flat=True).distinct())
+        atualizados = recalcular_saldos(alunos)
+        cache_academia.invalidar(*afetados)
+    return atualizados
+
+
+def verificar(owner=None):
+    """Divergências entre o saldo devedor gravado e as mensalidades: [(aluno_id, esperado, gravado)]."""
+    return list(
+        saldos_esperados(owner)
+        .exclude(saldo_devedor=F('esperado'))
+        .order_by('pk')
+        .values_list('pk', 'esperado', 'saldo_devedor')
+    )
@@ -0,0 +1,198 @@
+"""Paginação por cursor (keyset): a página N custa o mesmo que a página 1.
+
+Em vez de OFFSET, o cursor guarda os valores da ordenação do último item exibido e a
+próxima página começa logo depois deles, usando o mesmo índice da ordenação.
+
+Para o admin, que pagina por número de página, `PaginadorEstimado` evita o COUNT(*)
+exato das tabelas grandes.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.http import JsonResponse
+from django.template.loader import render_to_string
+
+from . import cache_academia
+
+ITENS_POR_PAGINA = 50
+# Abaixo disso o COUNT(*) exato é barato e vale mais que a estimativa
+LIMITE_CONTAGEM_EXATA = 10000
+
+
+class PaginaKeyset:
+    def __init__(self, itens, cursor, proximo_cursor):
+        self.object_list = itens
+        self.cursor = cursor
+        self.proximo_cursor = proximo_cursor
+
+    @property
+    def has_next(self):
+        return self.proximo_cursor is not None
+
+    @property
+    def has_previous(self):
+        return bool(self.cursor)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def codificar_cursor(valores):
+    dados = json.dumps(valores, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(dados.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Valores do cursor, ou None se ele estiver ausente ou malformado."""
+    if not cursor:
+        return None
+    try:
+        dados = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        valores = json.loads(dados)
+    except (binascii.Error, ValueError):
+        return None
+    return valores if isinstance(valores, list) else None
+
+
+def _campo(modelo, campo):
+    for parte in campo.lstrip('-').split('__'):
+        field = modelo._meta.pk if parte == 'pk' else modelo._meta.get_field(parte)
+        modelo = field.related_model
+    return field
+
+
+def converter_cursor(modelo, ordenacao, valores):
+    """Valores do cursor convertidos pelos campos da ordenação, ou None se algum for inválido.
+
+    O cursor vem da URL: um valor adulterado (texto num id, objeto no lugar de uma data)
+    volta para a primeira página em vez de estourar na consulta.
+    """
+    if valores is None or len(valores) != len(ordenacao):
+        return None
+    convertidos = []
+    for campo, valor in zip(ordenacao, valores):
+        try:
+            convertido = _campo(modelo, campo).to_python(valor)
+        except (ValidationError, ValueError, TypeError):
+            return None
+        if convertido is None:
+            return None
+        convertidos.append(convertido)
+    return convertidos
+
+
+def _valor(obj, campo):
+    for parte in campo.lstrip('-').split('__'):
+        obj = getattr(obj, parte)
+    return obj
+
+
+def depois_de(ordenacao, valores):
+    """Filtro "estritamente depois de `valores`" na ordem `ordenacao` (ex.: ['-data', 'aluno__nome', 'pk'])."""
+    filtro = Q()
+    iguais = {}
+    for campo, valor in zip(ordenacao, valores):
+        nome = campo.lstrip('-')
+        operador = 'lt' if campo.startswith('-') else 'gt'
+        filtro |= Q(**iguais, **{f'{nome}__{operador}': valor})
+        iguais[nome] = valor
+    # Limite redundante na primeira chave: o OR acima sozinho impede o banco de usar o
+    # índice dela como intervalo (ainda mais quando as chaves seguintes vêm de um JOIN)
+    primeiro = ordenacao[0]
+    limite = 'lte' if primeiro.startswith('-') else 'gte'
+    return Q(**{f'{primeiro.lstrip("-")}__{limite}': valores[0]}) & filtro
+
+
+def paginar_keyset(queryset, ordenacao, cursor=None, por_pagina=ITENS_POR_PAGINA):
+    """Uma página de `queryset` em `ordenacao`, que deve terminar numa chave única (ex.: 'pk')."""
+    queryset = queryset.order_by(*ordenacao)
+    valores = converter_cursor(queryset.model, ordenacao, decodificar_cursor(cursor))
+    if valores is not None:
+        queryset = queryset.filter(depois_de(ordenacao, valores))
+    else:
+        cursor = None
+    itens = list(queryset[:por_pagina + 1])
+    proximo = None
+    if len(itens) > por_pagina:
+        itens = itens[:por_pagina]
+        proximo = codificar_cursor([_valor(itens[-1], campo) for campo in ordenacao])
+    return PaginaKeyset(itens, cursor, proximo)
+
+
+def resposta_fragmento(request, template_linhas, contexto, pagina):
+    """JSON para a rolagem infinita: as linhas já renderizadas e o cursor da próxima página."""
+    return JsonResponse({
+        'html': render_to_string(template_linhas, contexto, request=request),
+        'proximo_cursor': pagina.proximo_cursor,
+    })
+
+
+def quer_fragmento(request):
+    return request.GET.get('formato') == 'json'
+
+
+class PaginacaoKeysetMixin:
+    """Para ListViews: troca a paginação por OFFSET do Django pela paginação por cursor.
+
+    `?formato=json` devolve só as linhas da página (`template_linhas`) para a rolagem infinita.
+    Com `cache_nome`, cada página fica no cache da academia do usuário (ver cache_academia).
+    """
+    ordenacao_keyset = ('pk',)
+    paginate_by = ITENS_POR_PAGINA
+    template_linhas = None
+    cache_nome = None
+
+    def usa_keyset(self):
+        return True
+
+    def montar_pagina(self, queryset, page_size):
+        return paginar_keyset(queryset, self.ordenacao_keyset, self.request.GET.get('cursor'), page_size)
+
+    def chave_cache(self):
+        return f'{self.cache_nome}:{self.request.GET.get("cursor", "")}'
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.usa_keyset():
+            return super().paginate_queryset(queryset, page_size)
+        if self.cache_nome:
+            pagina = cache_academia.obter(
+                self.request.user.pk, self.chave_cache(), lambda: self.montar_pagina(queryset, page_size),
+            )
+        else:
+            pagina = self.montar_pagina(queryset, page_size)
+        return None, pagina, pagina.object_list, pagina.has_next or pagina.has_previous
+
+    def render_to_response(self, context, **response_kwargs):
+        if quer_fragmento(self.request) and self.usa_keyset():
+            return resposta_fragmento(self.request, self.template_linhas, context, context['page_obj'])
+        return super().render_to_response(context, **response_kwargs)
+
+
+def total_estimado(queryset):
+    """Linhas de `queryset` segundo o planejador do Postgres (EXPLAIN), ou None nos demais bancos."""
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    plano = json.loads(queryset.order_by().explain(format='json'))
+    return int(plano[0]['Plan']['Plan Rows'])
+
+
+class PaginadorEstimado(Paginator):
+    """Paginator do admin: no Postgres, acima de LIMITE_CONTAGEM_EXATA linhas, o total
+    exibido é a estimativa do planejador, sem percorrer a tabela com COUNT(*)."""
+
+    @cached_property
+    def count(self):
+        estimado = total_estimado(self.object_list)
+        if estimado is not None and estimado > LIMITE_CONTAGEM_EXATA:
+            return estimado
+        return super().count
@@ -0,0 +1,288 @@
+"""Receita diária (ReceitaDiaria), atualizada na mesma transação que altera as mensalidades.
+
+Cada mensalidade paga contribui com (owner, data_pagamento, valor). Quem altera uma
+mensalidade tira a foto da contribuição antes (`contribuicao`) e aplica a diferença
+depois (`registrar_alteracao`); exclusões em lote usam `registrar_remocao`.
+
+Os relatórios de meses encerrados ficam gravados (RelatorioMensalSnapshot) e são
+descartados pelas mesmas funções quando uma mensalidade paga no mês muda (e por
+pagamentos.py quando muda o livro de pagamentos do mês).
+"""
+import calendar
+import hashlib
+import json
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from . import cache_academia
+from .models import Mensalidade, Pagamento, ReceitaDiaria, RelatorioMensalSnapshot
+
+METODOS = dict(Pagamento.METODO_CHOICES)
+
+
+def contribuicao(mensalidade):
+    """(owner_id, data, valor) com que `mensalidade` entra na receita, ou None se não está paga.
+
+    Alunos sem professor (owner nulo, anteriores à 0004) não entram na receita de ninguém.
+    """
+    if mensalidade is None or mensalidade.status != 'PAGO' or mensalidade.data_pagamento is None:
+        return None
+    owner_id = mensalidade.aluno.owner_id
+    if owner_id is None:
+        return None
+    return (owner_id, mensalidade.data_pagamento, Decimal(mensalidade.valor))
+
+
+def aplicar_deltas(deltas):
+    """Soma `{(owner_id, data): (total, quantidade)}` às linhas da receita, criando-as se preciso."""
+    for (owner_id, data), (total, quantidade) in deltas.items():
+        if not total and not quantidade:
+            continue
+        with transaction.atomic():
+            receita, _ = ReceitaDiaria.objects.get_or_create(owner_id=owner_id, data=data)
+            ReceitaDiaria.objects.filter(pk=receita.pk).update(
+                total=F('total') + total,
+                quantidade=F('quantidade') + quantidade,
+            )
+
+
+def descartar_relatorios(chaves):
+    """Apaga os relatórios gravados dos meses de `chaves` [(owner_id, data)].
+
+    Meses em aberto nunca têm relatório gravado; sem mês encerrado não há consulta.
+    """
+    mes_atual = timezone.localdate().replace(day=1)
+    por_owner = defaultdict(set)
+    for owner_id, data in chaves:
+        if data < mes_atual:
+            por_owner[owner_id].add(data.replace(day=1))
+    if por_owner:
+        filtro = Q()
+        for owner_id, meses in por_owner.items():
+            filtro |= Q(owner_id=owner_id, mes__in=meses)
+        RelatorioMensalSnapshot.objects.filter(filtro).delete()
+
+
+def registrar_alteracao(antes, depois):
+    """Aplica a troca de contribuição `antes` -> `depois` (qualquer uma pode ser None)."""
+    # Mesmo sem mudar o total, a linha do relatório pode mudar (ex.: outro aluno)
+    descartar_relatorios([c[:2] for c in (antes, depois) if c is not None])
+    deltas = defaultdict(lambda: (Decimal('0'), 0))
+    if antes is not None:
+        owner_id, data, valor = antes
+        total, quantidade = deltas[(owner_id, data)]
+        deltas[(owner_id, data)] = (total - valor, quantidade - 1)
+    if depois is not None:
+        owner_id, data, valor = depois
+        total, quantidade = deltas[(owner_id, data)]
+        deltas[(owner_id, data)] = (total + valor, quantidade + 1)
+    aplicar_deltas(deltas)
+
+
+def _agregado_pago(mensalidades):
+    return (
+        mensalidades
+        .filter(status='PAGO', data_pagamento__isnull=False, aluno__owner__isnull=False)
+        .order_by()
+        .values_list('aluno__owner', 'data_pagamento')
+        .annotate(total=Sum('valor'), quantidade=Count('id'))
+    )
+
+
+def registrar_remocao(mensalidades):
+    """Retira da receita as mensalidades pagas de `mensalidades` (chamar antes de excluí-las)."""
+    deltas = {
+        (owner_id, data): (-total, -quantidade)
+        for owner_id, data, total, quantidade in _agregado_pago(mensalidades)
+    }
+    descartar_relatorios(deltas)
+    aplicar_deltas(deltas)
+
+
+def registrar_inclusao(mensalidades):
+    """Soma à receita as mensalidades pagas de `mensalidades`."""
+    deltas = {
+        (owner_id, data): (total, quantidade)
+        for owner_id, data, total, quantidade in _agregado_pago(mensalidades)
+    }
+    descartar_relatorios(deltas)
+    aplicar_deltas(deltas)
+
+
+def receita_esperada(owner=None):
+    mensalidades = Mensalidade.objects.all()
+    if owner is not None:
+        mensalidades = mensalidades.filter(aluno__owner=owner)
+    return {
+        (owner_id, data): (total, quantidade)
+        for owner_id, data, total, quantidade in _agregado_pago(mensalidades)
+    }
+
+
+def reconstruir(owner=None, tamanho_lote=1000):
+    """Recalcula a receita diária a partir das mensalidades. Devolve o número de linhas gravadas."""
+    with transaction.atomic():
+        existentes = ReceitaDiaria.objects.all()
+        if owner is not None:
+            existentes = existentes.filter(owner=owner)
+        afetados = set(existentes.values_list('owner', flat=True).distinct())
+        existentes.delete()
+        relatorios = RelatorioMensalSnapshot.objects.all()
+        if owner is not None:
+            relatorios = relatorios.filter(owner=owner)
+        relatorios.delete()
+        linhas = [
+            ReceitaDiaria(owner_id=owner_id, data=data, total=total, quantidade=quantidade)
+            for (owner_id, data), (total, quantidade) in receita_esperada(owner).items()
+        ]
+        ReceitaDiaria.objects.bulk_create(linhas, batch_size=tamanho_lote)
+        cache_academia.invalidar(*afetados, *{linha.owner_id for linha in linhas})
+    return len(linhas)
+
+
+def verificar(owner=None):
+    """Divergências entre a receita diária e as mensalidades: [(owner_id, data, esperado, gravado)]."""
+    esperada = receita_esperada(owner)
+    gravadas = ReceitaDiaria.objects.exclude(total=0, quantidade=0)
+    if owner is not None:
+        gravadas = gravadas.filter(owner=owner)
+    gravada = {(o, d): (t, q) for o, d, t, q in gravadas.values_list('owner', 'data', 'total', 'quantidade')}
+    divergencias = []
+    for chave in sorted(esperada.keys() | gravada.keys(), key=lambda c: (c[0], c[1])):
+        if esperada.get(chave) != gravada.get(chave):
+            divergencias.append((*chave, esperada.get(chave), gravada.get(chave)))
+    return divergencias
+
+
+def recebido_por_metodo(owner, inicio, fim):
+    """[(metodo, total, quantidade)] dos pagamentos lançados no período, numa consulta agrupada.
+
+    Vem do livro de pagamentos, então inclui os pagamentos parciais de mensalidades ainda em aberto.
+    """
+    return list(
+        Pagamento.objects
+        .filter(mensalidade__aluno__owner=owner, data_pagamento__gte=inicio, data_pagamento__lte=fim)
+        .order_by('metodo_pagamento')
+        .values_list('metodo_pagamento')
+        .annotate(total=Sum('valor_pago'), quantidade=Count('id'))
+    )
+
+
+def relatorio_do_mes(owner, inicio, fim):
+    """Dados do relatório mensal, serializáveis em JSON: totais e série diária (da receita
+    diária, no máximo 31 linhas), o recebido por forma de pagamento e a lista detalhada das
+    mensalidades pagas no período."""
+    chart_values = [0 for _ in range(fim.day)]
+    total_receita = Decimal('0')
+    quantidade = 0
+    receita_do_mes = (
+        ReceitaDiaria.objects
+        .filter(owner=owner, data__gte=inicio, data__lte=fim)
+        .values_list('data', 'total', 'quantidade')
+    )
+    for data, total, qtd in receita_do_mes:
+        chart_values[data.day - 1] = float(total)
+        total_receita += total
+        quantidade += qtd
+    itens = (
+        Mensalidade.objects
+        .filter(
+            aluno__owner=owner,
+            status='PAGO',
+            data_pagamento__isnull=False,
+            data_pagamento__gte=inicio,
+            data_pagamento__lte=fim,
+        )
+        .order_by('data_pagamento', 'pk')
+        .values_list('data_pagamento', 'aluno__nome', 'valor')
+    )
+    return {
+        'total_receita': str(total_receita),
+        'quantidade': quantidade,
+        'chart_values': chart_values,
+        'itens': [
+            {'data_pagamento': data.isoformat(), 'aluno': nome, 'valor': str(valor)}
+            for data, nome, valor in itens
+        ],
+        'por_metodo': [
+            {'metodo': metodo, 'total': str(total), 'quantidade': qtd}
+            for metodo, total, qtd in recebido_por_metodo(owner, inicio, fim)
+        ],
+    }
+
+
+def contexto_do_relatorio(dados):
+    """Converte os dados de `relatorio_do_mes` para o template do relatório."""
+    return {
+        'total_receita': Decimal(dados['total_receita']),
+        'quantidade': dados['quantidade'],
+        'chart_labels': list(range(1, len(dados['chart_values']) + 1)),
+        'chart_values': dados['chart_values'],
+        'mensalidades_pagas': [
+            {
+                'data_pagamento': date.fromisoformat(item['data_pagamento']),
+                'aluno': {'nome': item['aluno']},
+                'valor': Decimal(item['valor']),
+            }
+            for item in dados['itens']
+        ],
+        # Dados gravados antes do livro de pagamentos não têm a divisão por forma
+        'por_metodo': [
+            {
+                'metodo': METODOS.get(item['metodo'], item['metodo']),
+                'total': Decimal(item['total']),
+                'quantidade': item['quantidade'],
+            }
+            for item in dados.get('por_metodo', [])
+        ],
+    }
+
+
+def mes_encerrado(inicio):
+    return inicio < timezone.localdate().replace(day=1)
+
+
+def _sem_movimento(dados):
+    return not (dados['quantidade'] or dados['itens'] or dados['por_metodo'])
+
+
+def relatorio_encerrado(owner, inicio):
+    """Relatório gravado do mês encerrado que começa em `inicio`, calculado na primeira leitura.
+
+    Um mês sem nenhum pagamento não é gravado (o relatório volta sem salvar): são só
+    consultas vazias, e assim um mês qualquer pedido na URL não cria linhas na tabela."""
+    relatorio = RelatorioMensalSnapshot.objects.filter(owner=owner, mes=inicio).first()
+    if relatorio is not None:
+        return relatorio
+    fim = inicio.replace(day=calendar.monthrange(inicio.year, inicio.month)[1])
+    dados = relatorio_do_mes(owner, inicio, fim)
+    texto = json.dumps(dados, cls=DjangoJSONEncoder, sort_keys=True, separators=(',', ':'))
+    relatorio = RelatorioMensalSnapshot(owner=owner, mes=inicio, dados=dados, etag=hashlib.sha256(texto.encode()).hexdigest())
+    if _sem_movimento(dados):
+        return relatorio
+    try:
+        with transaction.atomic():
+            relatorio.save()
+    except IntegrityError:
+        # Outra requisição gravou o mesmo mês antes
+        return RelatorioMensalSnapshot.objects.get(owner=owner, mes=inicio)
+    return relatorio
+
+
+def preparar_relatorios(owner, anos=5):
+    """Grava os relatórios dos meses encerrados dos últimos `anos` anos que ainda não existem."""
+    hoje = timezone.localdate()
+    gravados = set(RelatorioMensalSnapshot.objects.filter(owner=owner).values_list('mes', flat=True))
+    criados = 0
+    for ano in range(hoje.year - anos, hoje.year + 1):
+        for mes in range(1, 13):
+            inicio = date(ano, mes, 1)
+            if mes_encerrado(inicio) and inicio not in gravados and relatorio_encerrado(owner, inicio).pk:
+                criados += 1
+    return criados
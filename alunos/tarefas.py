@@ -0,0 +1,260 @@
+"""Fila de tarefas no banco, executada pelo `manage.py executar_tarefas`.
+
+Operações pesadas (importações grandes, faturamento e relatórios agendados) viram linhas
+de `Tarefa` e rodam fora dos workers do gunicorn. O worker reserva uma tarefa por vez: no
+Postgres com `SELECT ... FOR UPDATE SKIP LOCKED`, para vários workers não disputarem a
+mesma linha; nos demais bancos com um UPDATE condicional, que só um processo consegue
+aplicar. Falhas voltam para a fila com espera crescente até `max_tentativas`; uma reserva
+não renovada (worker morto no meio) expira e a tarefa é retomada por outro.
+
+Os tipos de tarefa são funções `f(tarefa, **parametros)` registradas com `@registrar`;
+o que devolvem (serializável em JSON) fica em `Tarefa.resultado`.
+"""
+import calendar
+import io
+import logging
+import os
+import socket
+import time
+import traceback
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import cache_academia, importacao, receitas
+from .faturamento import atualizar_atrasadas, gerar_mensalidades_em_massa
+from .models import Tarefa
+
+logger = logging.getLogger(__name__)
+
+TEMPO_RESERVA = timedelta(minutes=15)
+ESPERA_INICIAL = timedelta(seconds=30)
+ESPERA_MAXIMA = timedelta(hours=1)
+GUARDAR_TERMINADAS = timedelta(days=30)
+INTERVALO = 5  # segundos entre consultas à fila quando ela está vazia
+
+# Caches que o site, em outro processo ou outra instância, não enxerga
+CACHES_LOCAIS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+)
+
+TIPOS = {}
+
+
+def registrar(tipo):
+    def decorador(funcao):
+        TIPOS[tipo] = funcao
+        return funcao
+    return decorador
+
+
+def enfileirar(tipo, owner=None, parametros=None, anexo=None, executar_em=None, chave=None):
+    """Cria a tarefa `tipo`. Com `chave`, não duplica: devolve a tarefa já criada com ela."""
+    if tipo not in TIPOS:
+        raise ValueError(f'Tipo de tarefa desconhecido: {tipo}')
+    dados = dict(
+        tipo=tipo, owner=owner, parametros=parametros or {}, anexo=anexo,
+        executar_em=executar_em or timezone.now(),
+    )
+    if chave is None:
+        return Tarefa.objects.create(**dados)
+    try:
+        with transaction.atomic():
+            return Tarefa.objects.create(chave=chave, **dados)
+    except IntegrityError:
+        return Tarefa.objects.get(chave=chave)
+
+
+def espera(tentativas):
+    """Intervalo até a próxima tentativa: 30 s, 1 min, 2 min... até ESPERA_MAXIMA."""
+    return min(ESPERA_INICIAL * 2 ** max(tentativas - 1, 0), ESPERA_MAXIMA)
+
+
+def reservar(trabalhador):
+    """Reserva para `trabalhador` a próxima tarefa pronta para rodar, ou devolve None."""
+    agora = timezone.now()
+    prontas = Tarefa.objects.filter(
+        Q(status='PENDENTE', executar_em__lte=agora) | Q(status='EXECUTANDO', reservada_ate__lt=agora)
+    ).order_by('executar_em', 'pk')
+    reserva = dict(
+        status='EXECUTANDO', trabalhador=trabalhador, reservada_ate=agora + TEMPO_RESERVA,
+        tentativas=F('tentativas') + 1,
+    )
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            pk = prontas.select_for_update(skip_locked=True).values_list('pk', flat=True).first()
+            if pk is None:
+                return None
+            Tarefa.objects.filter(pk=pk).update(**reserva)
+    else:
+        # O UPDATE repete o filtro: se outro processo reservou antes, nenhuma linha muda
+        for pk in prontas.values_list('pk', flat=True)[:10]:
+            if prontas.filter(pk=pk).update(**reserva):
+                break
+        else:
+            return None
+    return Tarefa.objects.get(pk=pk)
+
+
+def executar(tarefa):
+    """Roda a tarefa reservada e grava o desfecho. Devolve True se ela foi concluída."""
+    funcao = TIPOS.get(tarefa.tipo)
+    # Só o worker que ainda tem a reserva grava o desfecho
+    da_reserva = Tarefa.objects.filter(pk=tarefa.pk, trabalhador=tarefa.trabalhador)
+    try:
+        if funcao is None:
+            raise LookupError(f'Tipo de tarefa desconhecido: {tarefa.tipo}')
+        if tarefa.tentativas > tarefa.max_tentativas:
+            raise RuntimeError('Reserva expirada na última tentativa (o worker parou no meio da tarefa).')
+        resultado = funcao(tarefa, **tarefa.parametros)
+    except Exception:
+        logger.exception('Tarefa %s (%s) falhou na tentativa %d', tarefa.pk, tarefa.tipo, tarefa.tentativas)
+        agora = timezone.now()
+        if funcao is not None and tarefa.tentativas < tarefa.max_tentativas:
+            da_reserva.update(
+                status='PENDENTE', executar_em=agora + espera(tarefa.tentativas), reservada_ate=None,
+                erro=traceback.format_exc(),
+            )
+        else:
+            da_reserva.update(status='FALHOU', concluida_em=agora, reservada_ate=None, erro=traceback.format_exc())
+        return False
+    da_reserva.update(
+        status='CONCLUIDA', resultado=resultado, concluida_em=timezone.now(), reservada_ate=None,
+        anexo=None, erro='',
+    )
+    return True
+
+
+@dataclass(frozen=True)
+class Periodica:
+    tipo: str
+    hora: int = None  # hora local a partir da qual roda; None = de hora em hora
+    dia: int = None  # dia do mês (o último, nos meses mais curtos); None = todo dia
+
+    def chave(self, agora):
+        """Chave do período de `agora` se a tarefa já deve ter rodado nele, senão None."""
+        if self.hora is None:
+            return f'{self.tipo}:{agora:%Y-%m-%dT%H}'
+        if self.dia is None:
+            return f'{self.tipo}:{agora:%Y-%m-%d}' if agora.hour >= self.hora else None
+        dia = min(self.dia, calendar.monthrange(agora.year, agora.month)[1])
+        if (agora.day, agora.hour) >= (dia, self.hora):
+            return f'{self.tipo}:{agora:%Y-%m}'
+        return None
+
+
+def periodicas():
+    return [Periodica(*definicao) for definicao in getattr(settings, 'TAREFAS_PERIODICAS', [])]
+
+
+def agendar_periodicas(agora=None):
+    """Enfileira as periódicas do período atual que ainda não foram criadas.
+
+    A chave única por período faz com que, com vários workers, só um a crie; um worker
+    que estava parado na hora marcada a cria quando voltar, dentro do mesmo período.
+    """
+    agora = timezone.localtime(agora)
+    for periodica in periodicas():
+        chave = periodica.chave(agora)
+        if chave is not None and not Tarefa.objects.filter(chave=chave).exists():
+            enfileirar(periodica.tipo, chave=chave)
+
+
+def nome_do_trabalhador():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def cache_local():
+    """O backend do cache padrão, se as invalidações feitas pelo worker não chegam ao site; senão
+    None (também quando o cache das academias está desligado e não há o que invalidar)."""
+    backend = settings.CACHES['default']['BACKEND']
+    return backend if backend in CACHES_LOCAIS and cache_academia.ativo() else None
+
+
+def trabalhar(parar=lambda: False, uma_vez=False, intervalo=INTERVALO):
+    """Laço do worker: agenda as periódicas e executa as tarefas prontas até `parar()`.
+
+    Com `uma_vez`, sai assim que a fila ficar vazia. Devolve quantas tarefas executou.
+    """
+    trabalhador = nome_do_trabalhador()
+    executadas = 0
+    while not parar():
+        # Como ao fim de uma requisição: descarta conexões vencidas (CONN_MAX_AGE) ou quebradas,
+        # a não ser que o laço rode dentro de uma transação de quem o chamou
+        if not connection.in_atomic_block:
+            close_old_connections()
+        agendar_periodicas()
+        tarefa = reservar(trabalhador)
+        if tarefa is None:
+            if uma_vez:
+                break
+            time.sleep(intervalo)
+            continue
+        logger.info('Executando tarefa %s (%s), tentativa %d', tarefa.pk, tarefa.tipo, tarefa.tentativas)
+        executar(tarefa)
+        executadas += 1
+    return executadas
+
+
+@registrar('importar_alunos')
+def _importar_alunos(tarefa, simular=False):
+    def progresso(resultado):
+        tarefa.informar_progresso(resultado.linhas, mensagem=f'{resultado.linhas} linha(s) lida(s)')
+
+    arquivo = io.BytesIO(bytes(tarefa.anexo))
+    tarefa.informar_progresso(0, importacao.contar_linhas(arquivo), 'Validando a planilha')
+    resultado = importacao.importar_alunos(tarefa.owner, arquivo, simular, progresso)
+    return asdict(resultado)
+
+
+@registrar('faturamento_mensal')
+def _faturamento_mensal(tarefa):
+    """Mensalidades da próxima competência para todos os professores (idempotente)."""
+    professores = list(User.objects.filter(is_staff=True).order_by('pk'))
+    criadas = 0
+    for feitos, professor in enumerate(professores, 1):
+        resultado = gerar_mensalidades_em_massa(professor, timezone.localdate())
+        if resultado.criadas:
+            cache_academia.invalidar(professor.pk)
+        criadas += resultado.criadas
+        tarefa.informar_progresso(feitos, len(professores), professor.username)
+    return {'criadas': criadas}
+
+
+@registrar('gerar_mensalidades')
+def _gerar_mensalidades(tarefa):
+    """Geração em massa pedida na tela de mensalidades por uma academia grande."""
+    tarefa.informar_progresso(0, 1, 'Gerando as mensalidades')
+    resultado = gerar_mensalidades_em_massa(tarefa.owner, timezone.localdate())
+    if resultado.criadas:
+        cache_academia.invalidar(tarefa.owner_id)
+    tarefa.informar_progresso(1, 1, f'{resultado.criadas} mensalidade(s) gerada(s)')
+    return {'criadas': resultado.criadas}
+
+
+@registrar('atualizar_atrasadas')
+def _atualizar_atrasadas(tarefa):
+    return {'atualizadas': atualizar_atrasadas(timezone.localdate())}
+
+
+@registrar('preparar_relatorios')
+def _preparar_relatorios(tarefa, anos=5):
+    professores = list(User.objects.filter(is_staff=True).order_by('pk'))
+    gravados = 0
+    for feitos, professor in enumerate(professores, 1):
+        gravados += receitas.preparar_relatorios(professor, anos)
+        tarefa.informar_progresso(feitos, len(professores), professor.username)
+    return {'gravados': gravados}
+
+
+@registrar('limpar_tarefas')
+def _limpar_tarefas(tarefa):
+    limite = timezone.now() - GUARDAR_TERMINADAS
+    apagadas, _ = Tarefa.objects.filter(status__in=['CONCLUIDA', 'FALHOU'], concluida_em__lt=limite).delete()
+    return {'apagadas': apagadas}
@@ -1,3 +1,1962 @@
+import io
+import json
+import os
+import re
+from io import StringIO
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Count, Sum
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import cache_academia, frequencia, pagamentos, receitas, tarefas
+from .dados_sinteticos import atualizar_estatisticas
+from .models import Aluno, FrequenciaMensal, Mensalidade, Pagamento, Presenca, ReceitaDiaria, RelatorioMensalSnapshot, Tarefa, UserProfile
+
+SAVEPOINT = re.compile(r'(RELEASE |ROLLBACK TO )?SAVEPOINT ')
+FAIXAS = [codigo for _, grupo in Aluno._meta.get_field('faixa').choices for codigo, _ in grupo]
+
+
+class CacheLimpoTestCase(TestCase):
+    """O banco volta ao estado inicial a cada teste, mas o cache (em memória) não."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+def semear_academia(owner, alunos=200, meses=24, presencas=20, hoje=None):
+    """Cria alunos, `meses` de mensalidades e presenças recentes para `owner`, via bulk_create."""
+    hoje = hoje or timezone.localdate()
+    alunos_novos = [
+        Aluno(
+            nome=f'Aluno {owner.pk}-{i:05d}',
+            data_nascimento=date(1990 + i % 25, 1 + i % 12, 1 + i % 28),
+            telefone=f'(11) 9 {i:04d}-{owner.pk:04d}',
+            email=f'aluno{i}@academia{owner.pk}.com.br',
+            endereco='Rua Teste, 100',
+            faixa=FAIXAS[i % len(FAIXAS)],
+            bolsista=i % 7 == 0,
+            ativo=i % 10 != 0,
+            owner=owner,
+        )
+        for i in range(alunos)
+    ]
+    for aluno in alunos_novos:
+        aluno.preencher_busca()
+    novos = Aluno.objects.bulk_create(alunos_novos)
+    inicio = hoje.replace(day=1)
+    mensalidades = []
+    for aluno in novos:
+        for m in range(meses):
+            vencimento = (inicio - timedelta(days=31 * m)).replace(day=10)
+            pago = m > 0 or aluno.pk % 3 == 0
+            mensalidades.append(Mensalidade(
+                aluno=aluno,
+                data_vencimento=vencimento,
+                valor=100 if aluno.bolsista else 150,
+                valor_pago=(100 if aluno.bolsista else 150) if pago else 0,
+                status='PAGO' if pago else 'PENDENTE',
+                data_pagamento=vencimento if pago else None,
+            ))
+    Mensalidade.objects.bulk_create(mensalidades, batch_size=2000)
+    Presenca.objects.bulk_create([
+        Presenca(aluno=aluno, data=hoje - timedelta(days=d * 365 // presencas), presente=d % 5 != 0)
+        for aluno in novos
+        for d in range(presencas)
+    ], batch_size=2000)
+    atualizar_estatisticas(Aluno, Mensalidade, Presenca)
+    receitas.reconstruir(owner)
+    pagamentos.reconstruir(owner)
+    frequencia.reconstruir(owner)
+    return novos
+
+
+class PlanoDeConsultaTests(CacheLimpoTestCase):
+    """Garante que as consultas das views usam índices (sem varredura completa das tabelas semeadas)."""
+
+    TABELAS_GRANDES = {Aluno._meta.db_table, Mensalidade._meta.db_table, Presenca._meta.db_table}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owners = [
+            User.objects.create_user(f'professor{i}', password='senha', is_staff=True)
+            for i in range(20)
+        ]
+        for owner in cls.owners:
+            semear_academia(owner, alunos=150, meses=12)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owners[0])
+
+    def varreduras_completas(self, sql):
+        """Tabelas grandes lidas por varredura completa no plano de `sql`."""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('EXPLAIN ' + sql)
+                plano = '\n'.join(linha[0] for linha in cursor.fetchall())
+                tabelas = re.findall(r'Seq Scan on (\w+)', plano)
+            else:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plano = '\n'.join(linha[-1] for linha in cursor.fetchall())
+                # O SQLite mostra o apelido (U0, V0...) das subconsultas no lugar da tabela
+                apelidos = dict((apelido, tabela) for tabela, apelido in re.findall(r'"(\w+)" (\w+)', sql))
+                tabelas = [apelidos.get(t, t) for t in re.findall(r'^SCAN (\w+)$', plano, re.MULTILINE)]
+        return [tabela for tabela in tabelas if tabela in self.TABELAS_GRANDES]
+
+    def assertConsultasIndexadas(self, metodo, url, **kwargs):
+        with CaptureQueriesContext(connection) as consultas:
+            response = getattr(self.client, metodo)(url, **kwargs)
+        self.assertLess(response.status_code, 400)
+        for consulta in consultas.captured_queries:
+            sql = consulta['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            with self.subTest(url=url, sql=sql):
+                self.assertEqual(self.varreduras_completas(sql), [], f'Varredura completa em:\n{sql}')
+
+    def test_lista_de_alunos(self):
+        self.assertConsultasIndexadas('get', reverse('aluno-list'))
+
+    def test_busca_de_alunos(self):
+        from .busca import trigram_disponivel
+        if connection.vendor == 'postgresql' and not trigram_disponivel():
+            self.skipTest('pg_trgm indisponível: a busca roda sem índice')
+        self.assertConsultasIndexadas('get', reverse('aluno-list'), data={'search': 'aluno 1-0001'})
+        self.assertConsultasIndexadas('get', reverse('aluno-list'), data={'search': '(11) 9 0001'})
+
+    def test_lista_de_mensalidades(self):
+        self.assertConsultasIndexadas('get', reverse('mensalidade-list'))
+
+    def test_relatorio_mensal(self):
+        self.assertConsultasIndexadas('get', reverse('relatorio-mensal'))
+
+    def test_presencas(self):
+        self.assertConsultasIndexadas('get', reverse('presencas'))
+
+    def test_chamada(self):
+        self.assertConsultasIndexadas('get', reverse('chamada'))
+
+    def test_paginas_seguintes(self):
+        for nome, pagina in (('aluno-list', 'page_obj'), ('mensalidade-list', 'page_obj'), ('presencas', 'pagina')):
+            cursor = self.client.get(reverse(nome)).context[pagina].proximo_cursor
+            self.assertConsultasIndexadas('get', reverse(nome), data={'cursor': cursor})
+
+    def test_gerar_mensalidades_em_massa(self):
+        self.assertConsultasIndexadas('post', reverse('gerar-mensalidades'))
+
+
+class GeracaoEmMassaTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hoje = date(2024, 5, 20)
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        dados = dict(data_nascimento=date(2000, 1, 1), telefone='(11) 9 1234-5678', endereco='Rua', faixa='AZUL', owner=cls.owner)
+        cls.regular = Aluno.objects.create(nome='Regular', **dados)
+        cls.bolsista = Aluno.objects.create(nome='Bolsista', bolsista=True, **dados)
+        cls.inativo = Aluno.objects.create(nome='Inativo', ativo=False, **dados)
+        cls.devendo = Aluno.objects.create(nome='Devendo', **dados)
+        Mensalidade.objects.bulk_create([
+            Mensalidade(aluno=cls.devendo, data_vencimento=date(2024, 5, 1), valor=150, status='ATRASADO'),
+            Mensalidade(aluno=cls.regular, data_vencimento=date(2024, 5, 1), valor=150, valor_pago=150, status='PAGO'),
+        ])
+
+    def test_cria_uma_por_aluno_com_o_valor_do_plano(self):
+        from .faturamento import gerar_mensalidades_em_massa
+        resultado = gerar_mensalidades_em_massa(self.owner, self.hoje)
+        self.assertEqual((resultado.competencia, resultado.criadas), (date(2024, 6, 1), 2))
+        novas = Mensalidade.objects.filter(competencia=date(2024, 6, 1))
+        self.assertEqual(
+            sorted(novas.values_list('aluno__nome', 'valor', 'status', 'data_vencimento')),
+            [('Bolsista', 100, 'PENDENTE', date(2024, 6, 1)), ('Regular', 150, 'PENDENTE', date(2024, 6, 1))],
+        )
+        # Inativos e alunos com mensalidade em aberto ficam de fora
+        self.assertFalse(Mensalidade.objects.filter(aluno__in=[self.inativo, self.devendo], competencia__isnull=False).exists())
+
+    def test_segunda_execucao_nao_cria_nada(self):
+        from .faturamento import gerar_mensalidades_em_massa
+        self.assertEqual(gerar_mensalidades_em_massa(self.owner, self.hoje).criadas, 2)
+        self.assertEqual(gerar_mensalidades_em_massa(self.owner, self.hoje).criadas, 0)
+        self.assertEqual(Mensalidade.objects.filter(competencia__isnull=False).count(), 2)
+
+    def test_envio_duplicado_respeita_a_restricao_unica(self):
+        from unittest import mock
+        from . import faturamento
+
+        self.client.force_login(self.owner)
+        with mock.patch('alunos.views.timezone.localdate', return_value=self.hoje):
+            self.client.post(reverse('gerar-mensalidades'))
+            self.client.post(reverse('gerar-mensalidades'))
+        self.assertEqual(Mensalidade.objects.filter(competencia=date(2024, 6, 1)).count(), 2)
+
+        # Dois envios simultâneos: o segundo leu os candidatos antes do primeiro gravar
+        candidatos = list(Aluno.objects.filter(pk__in=[self.regular.pk, self.bolsista.pk]))
+        with mock.patch.object(faturamento, 'alunos_a_faturar', return_value=Aluno.objects.filter(pk__in=[a.pk for a in candidatos])):
+            resultado = faturamento.gerar_mensalidades_em_massa(self.owner, self.hoje)
+        self.assertEqual(resultado.criadas, 0)
+        self.assertEqual(
+            list(Mensalidade.objects.filter(competencia=date(2024, 6, 1)).values('aluno').annotate(n=Count('pk')).values_list('n', flat=True)),
+            [1, 1],
+        )
+
+    def test_concorrente_conta_so_as_que_gravou(self):
+        from unittest import mock
+        from . import faturamento
+
+        def outro_envio_fatura_o_regular(owner, competencia):
+            # Os candidatos foram lidos; o outro envio grava a do regular logo em seguida
+            candidatos = list(Aluno.objects.filter(pk__in=[self.regular.pk, self.bolsista.pk]).values_list('pk', 'bolsista'))
+            Mensalidade.objects.create(aluno=self.regular, competencia=competencia, data_vencimento=competencia, valor=150)
+            return mock.Mock(values_list=lambda *campos: candidatos)
+
+        with mock.patch.object(faturamento, 'alunos_a_faturar', side_effect=outro_envio_fatura_o_regular):
+            resultado = faturamento.gerar_mensalidades_em_massa(self.owner, self.hoje)
+        self.assertEqual(resultado.criadas, 1)
+        self.assertEqual(
+            sorted(Mensalidade.objects.filter(competencia=date(2024, 6, 1)).values_list('aluno__nome', flat=True)), ['Bolsista', 'Regular'],
+        )
+        self.assertEqual(Aluno.objects.get(pk=self.bolsista.pk).saldo_devedor, 100)
+
+    def test_academia_grande_gera_na_fila(self):
+        from unittest import mock
+        from . import faturamento
+
+        self.client.force_login(self.owner)
+        with mock.patch.object(faturamento, 'LIMITE_NA_REQUISICAO', 1):
+            resposta = self.client.post(reverse('gerar-mensalidades'))
+        tarefa = Tarefa.objects.get(tipo='gerar_mensalidades', owner=self.owner)
+        self.assertRedirects(resposta, reverse('tarefa', args=[tarefa.pk]))
+        self.assertFalse(Mensalidade.objects.filter(competencia__isnull=False).exists())
+
+        with self.settings(TAREFAS_PERIODICAS=[]), mock.patch('alunos.tarefas.timezone.localdate', return_value=self.hoje):
+            with self.assertLogs('alunos.tarefas', 'INFO'):
+                tarefas.trabalhar(uma_vez=True)
+        tarefa.refresh_from_db()
+        self.assertEqual((tarefa.status, tarefa.resultado, tarefa.mensagem), ('CONCLUIDA', {'criadas': 2}, '2 mensalidade(s) gerada(s)'))
+        self.assertEqual(Mensalidade.objects.filter(competencia=date(2024, 6, 1)).count(), 2)
+        self.assertContains(self.client.get(reverse('tarefa', args=[tarefa.pk])), 'Geração de Mensalidades')
+
+
+class MensalidadeAtualTests(CacheLimpoTestCase):
+    """`mensalidades_atuais` escolhe a mesma mensalidade que a seleção em Python que substituiu."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hoje = date(2024, 5, 20)
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        dados = dict(data_nascimento=date(2000, 1, 1), telefone='(11) 9 1234-5678', endereco='Rua', faixa='AZUL', owner=cls.owner)
+        pendente = Aluno.objects.create(nome='A pendente', **dados)
+        so_pagas = Aluno.objects.create(nome='B só pagas', **dados)
+        futura = Aluno.objects.create(nome='C só futuras', **dados)
+        Aluno.objects.create(nome='D sem mensalidade', **dados)
+        Mensalidade.objects.bulk_create([
+            Mensalidade(aluno=pendente, data_vencimento=date(2024, 3, 10), valor=150, valor_pago=150, status='PAGO'),
+            Mensalidade(aluno=pendente, data_vencimento=date(2024, 5, 10), valor=150, status='PENDENTE'),
+            Mensalidade(aluno=pendente, data_vencimento=date(2024, 6, 10), valor=150, status='PENDENTE'),
+            Mensalidade(aluno=so_pagas, data_vencimento=date(2024, 4, 10), valor=150, valor_pago=150, status='PAGO'),
+            Mensalidade(aluno=so_pagas, data_vencimento=date(2024, 5, 20), valor=150, valor_pago=150, status='PAGO'),
+            Mensalidade(aluno=futura, data_vencimento=date(2024, 7, 10), valor=150, status='PENDENTE'),
+            Mensalidade(aluno=futura, data_vencimento=date(2024, 6, 10), valor=150, status='PENDENTE'),
+        ])
+
+    def selecao_em_python(self):
+        """A seleção da MensalidadeListView antes de ir para o banco."""
+        atuais, ultima = {}, {}
+        for m in Mensalidade.objects.filter(aluno__owner=self.owner).order_by('aluno', '-data_vencimento'):
+            ultima[m.aluno_id] = m
+            if m.data_vencimento <= self.hoje and m.aluno_id not in atuais:
+                atuais[m.aluno_id] = m
+        for aluno_id, m in ultima.items():
+            atuais.setdefault(aluno_id, m)
+        return atuais
+
+    def test_mesma_selecao_da_versao_em_python(self):
+        from .faturamento import carregar_mensalidades, mensalidades_atuais
+        alunos = list(mensalidades_atuais(self.owner, self.hoje))
+        self.assertEqual([a.nome for a in alunos], ['A pendente', 'B só pagas', 'C só futuras'])
+        esperadas = self.selecao_em_python()
+        self.assertEqual({a.pk: a.mensalidade_atual for a in alunos}, {a: m.pk for a, m in esperadas.items()})
+        status = {m.aluno.nome: (m.data_vencimento, m.status_exibicao) for m in carregar_mensalidades(alunos, self.hoje)}
+        self.assertEqual(status, {
+            'A pendente': (date(2024, 5, 10), 'ATRASADO'),
+            'B só pagas': (date(2024, 5, 20), 'PAGO'),
+            'C só futuras': (date(2024, 6, 10), 'PENDENTE'),
+        })
+
+
+class BuscaDeAlunosTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        cls.outro = User.objects.create_user('outro', password='senha', is_staff=True)
+        dados = {'data_nascimento': date(2000, 1, 1), 'endereco': 'Rua A', 'faixa': 'AZUL'}
+        cls.joao = Aluno.objects.create(nome='João Conceição', telefone='(11) 9 8765-4321', owner=cls.owner, **dados)
+        cls.maria = Aluno.objects.create(nome='Maria José', telefone='(21) 9 1111-2222', email='maria@exemplo.com', owner=cls.owner, **dados)
+        Aluno.objects.create(nome='João Outro Dono', telefone='(11) 9 8765-4321', owner=cls.outro, **dados)
+
+    def buscar(self, termo):
+        from .busca import buscar_alunos
+        return list(buscar_alunos(self.owner, termo))
+
+    def test_ignora_acentos_e_caixa(self):
+        self.assertEqual(self.buscar('JOAO conceicao'), [self.joao])
+        self.assertEqual(self.buscar('josé'), [self.maria])
+
+    def test_telefone_com_ou_sem_mascara(self):
+        self.assertEqual(self.buscar('98765-4321'), [self.joao])
+        self.assertEqual(self.buscar('(21) 9 1111'), [self.maria])
+
+    def test_email_e_termos_curtos(self):
+        self.assertEqual(self.buscar('exemplo.com'), [self.maria])
+        self.assertEqual(self.buscar('ma'), [self.maria])
+
+    def test_edicao_atualiza_indice(self):
+        self.maria.nome = 'Mariana Souza'
+        self.maria.save()
+        self.assertEqual(self.buscar('souza'), [self.maria])
+        self.assertEqual(self.buscar('josé'), [])
+
+    def test_todos_os_resultados_sao_paginados(self):
+        dados = {'data_nascimento': date(2000, 1, 1), 'telefone': '(11) 9 0000-0000', 'endereco': 'Rua A', 'faixa': 'AZUL', 'owner': self.owner}
+        silvas = [Aluno(nome=f'Silva {i:03d}', **dados) for i in range(300)]
+        for aluno in silvas:
+            aluno.preencher_busca()
+        Aluno.objects.bulk_create(silvas)
+        self.assertEqual(len(self.buscar('silva')), 300)
+
+        self.client.force_login(self.owner)
+        resposta = self.client.get(reverse('aluno-list'), {'search': 'silva', 'page': 6})
+        pagina = resposta.context['page_obj']
+        self.assertEqual((pagina.paginator.count, pagina.number, len(pagina.object_list)), (300, 6, 50))
+
+
+class PaginacaoKeysetTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        semear_academia(cls.owner, alunos=120, meses=2, presencas=3)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def percorrer(self, nome):
+        """Segue os cursores do fragmento JSON até o fim; devolve o html de cada página."""
+        paginas, cursor = [], None
+        while True:
+            dados = {'formato': 'json'}
+            if cursor:
+                dados['cursor'] = cursor
+            resposta = self.client.get(reverse(nome), data=dados).json()
+            paginas.append(resposta['html'])
+            cursor = resposta['proximo_cursor']
+            if not cursor:
+                return paginas
+
+    def test_percorre_todos_os_alunos_em_ordem(self):
+        paginas = self.percorrer('aluno-list')
+        nomes = re.findall(r'<strong>(.*?)</strong>', ''.join(paginas))
+        esperados = list(Aluno.objects.filter(owner=self.owner).order_by('nome', 'pk').values_list('nome', flat=True))
+        self.assertEqual(len(paginas), 3)
+        self.assertEqual(nomes, esperados)
+
+    def test_percorre_todo_o_historico_de_presencas(self):
+        paginas = self.percorrer('presencas')
+        linhas = ''.join(paginas).count('<tr>')
+        self.assertEqual(linhas, Presenca.objects.filter(aluno__owner=self.owner).count())
+
+    def test_pagina_n_custa_o_mesmo_que_a_primeira(self):
+        for nome in ('aluno-list', 'mensalidade-list', 'presencas'):
+            with CaptureQueriesContext(connection) as primeira:
+                resposta = self.client.get(reverse(nome), data={'formato': 'json'})
+            cursor = resposta.json()['proximo_cursor']
+            with CaptureQueriesContext(connection) as seguinte:
+                self.client.get(reverse(nome), data={'formato': 'json', 'cursor': cursor})
+            self.assertEqual(len(seguinte), len(primeira), nome)
+            self.assertFalse(any('OFFSET' in q['sql'] for q in seguinte.captured_queries), nome)
+
+    def test_cursor_invalido_volta_ao_inicio(self):
+        resposta = self.client.get(reverse('aluno-list'), data={'cursor': 'nao-e-um-cursor'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.context['alunos'][0], Aluno.objects.filter(owner=self.owner).order_by('nome', 'pk').first())
+
+        # Cursores bem formados, mas com valores adulterados, também voltam ao início
+        from .paginacao import codificar_cursor
+        for nome, valores in (('presencas', ['x', 'y', 'z']), ('presencas', ['2024-02-30', 'a', 1]),
+                              ('aluno-list', [{'a': 1}, 'y']), ('mensalidade-list', ['a', None])):
+            with self.subTest(nome=nome, valores=valores):
+                resposta = self.client.get(reverse(nome), data={'cursor': codificar_cursor(valores), 'formato': 'json'})
+                self.assertEqual(resposta.status_code, 200)
+                primeira = self.client.get(reverse(nome), data={'formato': 'json'})
+                self.assertEqual(resposta.json()['proximo_cursor'], primeira.json()['proximo_cursor'])
+
+    def test_busca_mantem_paginas_numeradas(self):
+        resposta = self.client.get(reverse('aluno-list'), data={'search': 'aluno'})
+        self.assertFalse(resposta.context['paginacao_keyset'])
+        self.assertEqual(resposta.context['page_obj'].number, 1)
+
+
+class ReceitaDiariaTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        cls.hoje = timezone.localdate()
+        semear_academia(cls.owner, alunos=12, meses=3, presencas=1, hoje=cls.hoje)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def assertReceitaConfere(self):
+        self.assertEqual(receitas.verificar(), [])
+
+    def relatorio(self):
+        return self.client.get(reverse('relatorio-mensal'), data={'mes': self.hoje.month, 'ano': self.hoje.year}).context
+
+    def test_pagamento_edicao_e_exclusao(self):
+        pendente = Mensalidade.objects.filter(aluno__owner=self.owner, aluno__ativo=True, status='PENDENTE').first()
+        antes = self.relatorio()
+
+        self.client.post(reverse('registrar-pagamento', args=[pendente.pk]))
+        self.assertReceitaConfere()
+        depois = self.relatorio()
+        self.assertEqual(depois['total_receita'], antes['total_receita'] + pendente.valor)
+        self.assertEqual(depois['quantidade'], antes['quantidade'] + 1)
+        self.assertEqual(depois['chart_values'][self.hoje.day - 1], float(depois['total_receita'] - antes['total_receita']))
+
+        self.client.post(reverse('editar-mensalidade', args=[pendente.pk]), data={
+            'aluno': pendente.aluno_id, 'valor': '80.00', 'data_vencimento': pendente.data_vencimento.isoformat(),
+        })
+        self.assertReceitaConfere()
+        self.assertEqual(self.relatorio()['total_receita'], antes['total_receita'] + 80)
+
+        self.client.post(reverse('excluir-mensalidade', args=[pendente.pk]))
+        self.assertReceitaConfere()
+        self.assertEqual(self.relatorio()['total_receita'], antes['total_receita'])
+
+    def test_relatorio_le_a_receita_diaria(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self.relatorio()
+        tabela = ReceitaDiaria._meta.db_table
+        self.assertTrue(any(tabela in q['sql'] for q in consultas.captured_queries))
+
+    def test_comando_reconstroi_e_verifica(self):
+        ReceitaDiaria.objects.filter(owner=self.owner).update(total=0)
+        with self.assertRaises(CommandError):
+            call_command('reconstruir_receitas', '--verificar', stdout=StringIO(), stderr=StringIO())
+        call_command('reconstruir_receitas', stdout=StringIO())
+        self.assertReceitaConfere()
+
+    def test_aluno_sem_professor_fica_fora_da_receita(self):
+        import importlib
+        from django.apps import apps
+
+        sem_dono = Aluno.objects.create(nome='Sem Dono', data_nascimento=date(2000, 1, 1), telefone='(11) 9 1234-5678', endereco='Rua', faixa='AZUL')
+        paga = Mensalidade.objects.create(aluno=sem_dono, data_vencimento=self.hoje, valor=150, status='PAGO', data_pagamento=self.hoje)
+        linhas = ReceitaDiaria.objects.count()
+
+        self.assertIsNone(receitas.contribuicao(paga))
+        receitas.registrar_alteracao(None, receitas.contribuicao(paga))
+        receitas.registrar_inclusao(Mensalidade.objects.filter(pk=paga.pk))
+        receitas.registrar_remocao(Mensalidade.objects.filter(pk=paga.pk))
+        self.assertEqual(ReceitaDiaria.objects.count(), linhas)
+        call_command('reconstruir_receitas', stdout=StringIO())
+        self.assertReceitaConfere()
+
+        # O preenchimento da migração também ignora o aluno sem professor
+        ReceitaDiaria.objects.all().delete()
+        importlib.import_module('alunos.migrations.0012_receitadiaria').preencher_receitas(apps, None)
+        self.assertReceitaConfere()
+        self.assertEqual(ReceitaDiaria.objects.count(), linhas)
+
+
+class ChamadaTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        cls.outro = User.objects.create_user('outro', password='senha', is_staff=True)
+        cls.alunos = [a for a in semear_academia(cls.owner, alunos=44, meses=1, presencas=0) if a.ativo]
+        cls.alheio = semear_academia(cls.outro, alunos=1, meses=1, presencas=0)[0]
+        cls.data = date(2025, 3, 10)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def chamada(self):
+        return dict(Presenca.objects.filter(data=self.data).values_list('aluno_id', 'presente'))
+
+    def test_chamada_inteira_num_unico_insert(self):
+        ids = [a.pk for a in self.alunos]
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.post(reverse('chamada'), data={
+                'data': self.data.isoformat(), 'alunos': ids, 'presentes': ids[:30],
+            })
+        tabela = Presenca._meta.db_table
+        inserts = [q for q in consultas.captured_queries if q['sql'].startswith(f'INSERT INTO "{tabela}"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(self.chamada(), {pk: pk in ids[:30] for pk in ids})
+
+    def test_reenvio_atualiza_sem_duplicar(self):
+        ids = [a.pk for a in self.alunos]
+        self.client.post(reverse('chamada'), data={'data': self.data.isoformat(), 'alunos': ids, 'presentes': ids})
+        self.client.post(reverse('chamada'), data={'data': self.data.isoformat(), 'alunos': ids, 'presentes': ids[:5]})
+        self.assertEqual(Presenca.objects.filter(data=self.data).count(), len(ids))
+        self.assertEqual(sum(self.chamada().values()), 5)
+        resposta = self.client.get(reverse('chamada'), data={'data': self.data.isoformat()})
+        self.assertEqual(sum(bool(a.presente) for a in resposta.context['alunos']), 5)
+
+    def test_json_em_lotes_ignora_alunos_de_outro_dono(self):
+        corpo = {'data': self.data.isoformat(), 'presencas': [
+            {'aluno': self.alunos[0].pk, 'presente': True},
+            {'aluno': self.alunos[1].pk, 'presente': False},
+            {'aluno': self.alheio.pk, 'presente': True},
+        ]}
+        resposta = self.client.post(reverse('chamada'), data=json.dumps(corpo), content_type='application/json')
+        self.assertEqual(resposta.json(), {
+            'success': True, 'data': self.data.isoformat(), 'gravadas': 2, 'ignorados': [self.alheio.pk],
+        })
+        self.assertEqual(self.chamada(), {self.alunos[0].pk: True, self.alunos[1].pk: False})
+
+    def test_json_invalido(self):
+        resposta = self.client.post(reverse('chamada'), data='{"presencas": [{}]}', content_type='application/json')
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(Presenca.objects.count(), 0)
+
+    def test_data_inexistente_abre_a_chamada_de_hoje(self):
+        for data in ('2026-02-30', 'ontem'):
+            resposta = self.client.get(reverse('chamada'), data={'data': data})
+            self.assertEqual(resposta.status_code, 200)
+            self.assertEqual(resposta.context['data'], timezone.localdate())
+
+
+class FrequenciaMensalTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        cls.hoje = timezone.localdate()
+        cls.alunos = [a for a in semear_academia(cls.owner, alunos=12, meses=1, presencas=40, hoje=cls.hoje) if a.ativo]
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def test_chamada_e_presenca_avulsa_atualizam_contadores(self):
+        data = self.hoje.replace(day=1)
+        ids = [a.pk for a in self.alunos]
+        self.client.post(reverse('chamada'), data={'data': data.isoformat(), 'alunos': ids, 'presentes': ids[:3]})
+        self.assertEqual(frequencia.verificar(), [])
+        self.client.post(reverse('chamada'), data={'data': data.isoformat(), 'alunos': ids, 'presentes': []})
+        self.assertEqual(frequencia.verificar(), [])
+
+        avulsa = self.hoje.replace(day=2) if self.hoje.day != 2 else self.hoje.replace(day=3)
+        Presenca.objects.filter(aluno=self.alunos[0], data=avulsa).delete()
+        frequencia.atualizar_frequencias([self.alunos[0].pk], avulsa)
+        self.client.post(reverse('presencas'), data={'aluno': self.alunos[0].pk, 'data': avulsa.isoformat(), 'presente': 'on'})
+        self.assertEqual(frequencia.verificar(), [])
+
+    def test_ranking_e_tendencia_nao_leem_as_presencas(self):
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get(reverse('presencas'))
+        agregados = [q['sql'] for q in consultas.captured_queries if 'COUNT(' in q['sql'].upper()]
+        self.assertEqual(agregados, [])
+        esperado = sorted(
+            (total for (aluno_id, mes), (_, total) in frequencia.frequencia_esperada(self.owner).items()
+             if mes == self.hoje.replace(day=1)),
+            reverse=True,
+        )[:10]
+        self.assertEqual(resposta.context['rank_values'], esperado)
+        self.assertEqual(len(resposta.context['tendencia_values']), 6)
+        self.assertEqual(
+            resposta.context['tendencia_values'][-1],
+            FrequenciaMensal.objects.filter(owner=self.owner, mes=self.hoje.replace(day=1)).aggregate(s=Sum('total'))['s'],
+        )
+
+    def test_comando_reconstroi_e_verifica(self):
+        FrequenciaMensal.objects.filter(owner=self.owner).update(total=99)
+        with self.assertRaises(CommandError):
+            call_command('reconstruir_frequencias', '--verificar', stdout=StringIO(), stderr=StringIO())
+        call_command('reconstruir_frequencias', stdout=StringIO())
+        self.assertEqual(frequencia.verificar(), [])
+
+    def test_aluno_sem_professor_fica_sem_contador(self):
+        import importlib
+        from django.apps import apps
+
+        sem_dono = Aluno.objects.create(nome='Sem Dono', data_nascimento=date(2000, 1, 1), telefone='(11) 9 1234-5678', endereco='Rua', faixa='AZUL')
+        Presenca.objects.create(aluno=sem_dono, data=self.hoje, presente=True)
+        linhas = FrequenciaMensal.objects.count()
+
+        frequencia.atualizar_frequencias([sem_dono.pk, self.alunos[0].pk], self.hoje)
+        self.assertFalse(FrequenciaMensal.objects.filter(aluno=sem_dono).exists())
+        self.assertEqual(frequencia.verificar(), [])
+        call_command('reconstruir_frequencias', stdout=StringIO())
+        self.assertEqual(FrequenciaMensal.objects.count(), linhas)
+
+        # O preenchimento da migração também ignora o aluno sem professor
+        FrequenciaMensal.objects.all().delete()
+        importlib.import_module('alunos.migrations.0013_frequenciamensal').preencher_frequencias(apps, None)
+        self.assertEqual(frequencia.verificar(), [])
+
+        # Presença lançada pelo admin (que reconta o mês) também não quebra
+        admin = User.objects.create_superuser('admin', password='senha')
+        self.client.force_login(admin)
+        resposta = self.client.post(reverse('admin:alunos_presenca_add'), data={
+            'aluno': sem_dono.pk, 'data': (self.hoje - timedelta(days=1)).isoformat(), 'presente': 'on',
+        })
+        self.assertEqual(resposta.status_code, 302)
+
+
+class PerfilTests(CacheLimpoTestCase):
+
+    def test_save_do_usuario_nao_consulta_o_perfil(self):
+        user = User.objects.create_user('professor', password='senha', is_staff=True)
+        self.assertTrue(UserProfile.objects.filter(user=user).exists())
+        user = User.objects.get(pk=user.pk)
+        with CaptureQueriesContext(connection) as capturadas:
+            user.save(update_fields=['last_login'])
+        self.assertEqual(len(capturadas), 1)
+        self.assertNotIn(UserProfile._meta.db_table, capturadas[0]['sql'])
+
+    def test_perfil_vem_no_select_da_sessao(self):
+        user = User.objects.create_user('professor', password='senha', is_staff=True)
+        self.client.post(reverse('aluno-login'), {'username': 'professor', 'password': 'senha'})
+        with CaptureQueriesContext(connection) as capturadas:
+            self.client.get(reverse('settings'))
+        sql_perfil = [q['sql'] for q in capturadas if UserProfile._meta.db_table in q['sql']]
+        self.assertEqual(len(sql_perfil), 1)
+        self.assertIn('JOIN', sql_perfil[0])
+
+    def test_usuario_sem_perfil_ganha_um_ao_entrar(self):
+        user = User.objects.create_user('aluno', password='senha')
+        UserProfile.objects.filter(user=user).delete()
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('aluno-portal')).status_code, 302)
+        self.assertTrue(UserProfile.objects.filter(user=user).exists())
+
+
+class CacheDaAcademiaTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        cls.outro = User.objects.create_user('outro', password='senha', is_staff=True)
+        semear_academia(cls.owner, alunos=30, meses=2, presencas=3)
+        semear_academia(cls.outro, alunos=5, meses=2, presencas=3)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def consultas_nas_tabelas(self, url, *modelos):
+        with CaptureQueriesContext(connection) as capturadas:
+            resposta = self.client.get(url)
+        tabelas = [f'"{modelo._meta.db_table}"' for modelo in modelos]
+        return resposta, [q['sql'] for q in capturadas if any(tabela in q['sql'] for tabela in tabelas)]
+
+    def test_segunda_visita_nao_consulta_os_dados(self):
+        # Em presenças só o ranking e a tendência vêm do cache; o histórico e o formulário não
+        cacheadas = {
+            'aluno-list': (Aluno,),
+            'mensalidade-list': (Aluno, Mensalidade),
+            'presencas': (FrequenciaMensal,),
+            'relatorio-mensal': (Mensalidade, ReceitaDiaria),
+        }
+        for rota, modelos in cacheadas.items():
+            with self.subTest(rota=rota):
+                _, primeira = self.consultas_nas_tabelas(reverse(rota), *modelos)
+                resposta, segunda = self.consultas_nas_tabelas(reverse(rota), *modelos)
+                self.assertTrue(primeira)
+                self.assertEqual(segunda, [])
+                self.assertEqual(resposta.status_code, 200)
+
+    def test_escritas_invalidam_so_a_academia_do_owner(self):
+        self.client.get(reverse('aluno-list'))
+        versao_outro = cache_academia.versao(self.outro.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('aluno-create'), data={
+                'nome': 'AAA Novo Aluno', 'data_nascimento': '2000-01-01', 'telefone': '(11) 9 1234-5678',
+                'endereco': 'Rua Nova, 1', 'faixa': FAIXAS[0], 'ativo': True,
+            })
+        resposta = self.client.get(reverse('aluno-list'))
+        self.assertIn('AAA Novo Aluno', [aluno.nome for aluno in resposta.context['alunos']])
+        self.assertEqual(cache_academia.versao(self.outro.pk), versao_outro)
+
+    def test_pagamento_atualiza_lista_e_relatorio(self):
+        pendente = Mensalidade.objects.filter(aluno__owner=self.owner, aluno__ativo=True, status='PENDENTE').first()
+        total = self.client.get(reverse('relatorio-mensal')).context['total_receita']
+        self.client.get(reverse('mensalidade-list'))
+        self.client.post(reverse('registrar-pagamento', args=[pendente.pk]))
+        self.assertEqual(self.client.get(reverse('relatorio-mensal')).context['total_receita'], total + pendente.valor)
+        linhas = {m.pk: m for m in self.client.get(reverse('mensalidade-list')).context['mensalidades']}
+        self.assertNotEqual(linhas.get(pendente.pk, pendente).status, 'PENDENTE')
+
+    def test_reconstrucao_concorrente_espera_a_primeira(self):
+        import threading
+
+        chave = f'bel:{self.owner.pk}:{cache_academia.versao(self.owner.pk)}:teste'
+        # Outro processo está reconstruindo a entrada e a grava logo depois
+        cache.add(f'{chave}:trava', 1)
+        threading.Timer(0.1, lambda: cache.set(chave, 'do outro processo')).start()
+        chamadas = []
+        valor = cache_academia.obter(self.owner.pk, 'teste', lambda: chamadas.append(1) or 'reconstruido')
+        self.assertEqual(valor, 'do outro processo')
+        self.assertEqual(chamadas, [])
+
+    @override_settings(CACHE_ACADEMIA=False)
+    def test_desligado_vai_sempre_ao_banco(self):
+        # Sem um cache que o worker da fila enxergue, as páginas não são guardadas
+        _, primeira = self.consultas_nas_tabelas(reverse('aluno-list'), Aluno)
+        _, segunda = self.consultas_nas_tabelas(reverse('aluno-list'), Aluno)
+        self.assertEqual(len(segunda), len(primeira))
+        self.assertTrue(segunda)
+        self.assertIsNone(cache.get(f'bel:versao:{self.owner.pk}'))
+        self.assertIsNone(tarefas.cache_local())
+
+
+class RelatorioEncerradoTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        cls.hoje = timezone.localdate()
+        semear_academia(cls.owner, alunos=12, meses=4, presencas=1, hoje=cls.hoje)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def relatorio(self, mes, **cabecalhos):
+        return self.client.get(reverse('relatorio-mensal'), data={'mes': mes.month, 'ano': mes.year}, **cabecalhos)
+
+    def paga_em_mes_encerrado(self):
+        return (
+            Mensalidade.objects
+            .filter(aluno__owner=self.owner, aluno__ativo=True, status='PAGO', data_pagamento__lt=self.hoje.replace(day=1))
+            .order_by('-data_pagamento').first()
+        )
+
+    def test_mes_encerrado_e_calculado_uma_vez(self):
+        mes = self.paga_em_mes_encerrado().data_pagamento.replace(day=1)
+        primeira = self.relatorio(mes)
+        self.assertGreater(primeira.context['quantidade'], 0)
+        self.assertEqual(RelatorioMensalSnapshot.objects.filter(owner=self.owner, mes=mes).count(), 1)
+        self.assertEqual(primeira['Cache-Control'], 'private, no-cache')
+        with CaptureQueriesContext(connection) as capturadas:
+            segunda = self.relatorio(mes)
+        tabelas = (f'"{Mensalidade._meta.db_table}"', f'"{ReceitaDiaria._meta.db_table}"')
+        self.assertFalse([q for q in capturadas if any(tabela in q['sql'] for tabela in tabelas)])
+        self.assertEqual(segunda.context['total_receita'], primeira.context['total_receita'])
+        self.assertEqual(len(segunda.context['mensalidades_pagas']), primeira.context['quantidade'])
+        self.assertEqual(segunda['ETag'], primeira['ETag'])
+
+        nao_modificado = self.relatorio(mes, HTTP_IF_NONE_MATCH=primeira['ETag'])
+        self.assertEqual(nao_modificado.status_code, 304)
+        self.assertEqual(nao_modificado['ETag'], primeira['ETag'])
+        self.assertEqual(nao_modificado['Cache-Control'], 'private, no-cache')
+
+    def test_mes_em_aberto_nao_e_gravado(self):
+        resposta = self.relatorio(self.hoje)
+        self.assertFalse(resposta.has_header('ETag'))
+        self.assertFalse(RelatorioMensalSnapshot.objects.exists())
+
+    def test_edicao_no_mes_descarta_so_o_relatorio_dele(self):
+        paga = self.paga_em_mes_encerrado()
+        mes = paga.data_pagamento.replace(day=1)
+        anterior = (mes - timedelta(days=1)).replace(day=1)
+        etag = self.relatorio(mes)['ETag']
+        self.relatorio(anterior)
+
+        self.client.post(reverse('editar-mensalidade', args=[paga.pk]), data={
+            'aluno': paga.aluno_id, 'valor': str(paga.valor + 7), 'data_vencimento': paga.data_vencimento.isoformat(),
+        })
+        self.assertEqual(list(RelatorioMensalSnapshot.objects.values_list('mes', flat=True)), [anterior])
+        resposta = self.relatorio(mes, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta['ETag'], etag)
+        self.assertIn(paga.valor + 7, [item['valor'] for item in resposta.context['mensalidades_pagas']])
+        self.assertEqual(receitas.verificar(), [])
+
+    def test_comando_prepara_os_anos_do_seletor(self):
+        call_command('preparar_relatorios', owner='professor', stdout=StringIO())
+        meses = set(RelatorioMensalSnapshot.objects.filter(owner=self.owner).values_list('mes', flat=True))
+        self.assertIn(self.paga_em_mes_encerrado().data_pagamento.replace(day=1), meses)
+        self.assertNotIn(self.hoje.replace(day=1), meses)
+        # Meses sem pagamento (antes dos 4 meses semeados) não ocupam linha
+        self.assertNotIn(date(self.hoje.year - 5, 1, 1), meses)
+        self.assertEqual(self.relatorio(date(self.hoje.year - 5, 1, 1)).context['total_receita'], 0)
+
+    def test_ano_fora_do_seletor_nao_grava_relatorio(self):
+        for ano, mes in ((1900, 1), (9999, 12), (self.hoje.year, 13)):
+            with self.subTest(ano=ano, mes=mes):
+                resposta = self.client.get(reverse('relatorio-mensal'), data={'mes': mes, 'ano': ano})
+                self.assertEqual((resposta.context['ano'], resposta.context['mes']), (self.hoje.year, self.hoje.month))
+        self.assertFalse(RelatorioMensalSnapshot.objects.exists())
+
+
+class ExportacaoTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        cls.outro = User.objects.create_user('outro', password='senha', is_staff=True)
+        semear_academia(cls.owner, alunos=25, meses=3, presencas=4)
+        semear_academia(cls.outro, alunos=5, meses=3, presencas=4)
+        cls.owner.alunos.filter(pk=cls.owner.alunos.order_by('pk').first().pk).update(nome='=HYPERLINK("x")')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def exportar(self, tipo, **parametros):
+        cabecalhos = {'HTTP_ACCEPT_ENCODING': parametros.pop('accept_encoding')} if 'accept_encoding' in parametros else {}
+        resposta = self.client.get(reverse('exportar', args=[tipo]), data=parametros, **cabecalhos)
+        self.assertTrue(resposta.streaming)
+        return resposta, b''.join(resposta.streaming_content)
+
+    def csv(self, tipo, **parametros):
+        import csv
+        _, conteudo = self.exportar(tipo, **parametros)
+        return list(csv.reader(StringIO(conteudo.decode('utf-8-sig'))))
+
+    def test_csv_so_com_os_dados_do_owner(self):
+        linhas = self.csv('mensalidades')
+        self.assertEqual(linhas[0], ['Aluno', 'Competência', 'Vencimento', 'Valor', 'Status', 'Pagamento'])
+        self.assertEqual(len(linhas) - 1, Mensalidade.objects.filter(aluno__owner=self.owner).count())
+        self.assertEqual(len(self.csv('presencas')) - 1, Presenca.objects.filter(aluno__owner=self.owner).count())
+        nomes = {linha[0] for linha in self.csv('alunos')[1:]}
+        self.assertFalse(nomes & set(self.outro.alunos.values_list('nome', flat=True)))
+        # Texto que o Excel leria como fórmula sai escapado
+        self.assertIn('\'=HYPERLINK("x")', nomes)
+
+    def test_filtros_de_periodo_e_status(self):
+        hoje = timezone.localdate()
+        inicio = hoje.replace(day=1) - timedelta(days=40)
+        linhas = self.csv('mensalidades', status='pago', inicio=inicio.isoformat(), fim=hoje.isoformat())
+        esperadas = Mensalidade.objects.filter(
+            aluno__owner=self.owner, status='PAGO', data_vencimento__gte=inicio, data_vencimento__lte=hoje,
+        )
+        self.assertEqual(len(linhas) - 1, esperadas.count())
+        self.assertEqual({linha[4] for linha in linhas[1:]}, {'PAGO'})
+        self.assertEqual(self.client.get(reverse('exportar', args=['mensalidades']), {'status': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('exportar', args=['mensalidades']), {'inicio': '2024-02-30'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('exportar', args=['usuarios'])).status_code, 404)
+
+    def test_gzip_quando_aceito(self):
+        import gzip
+        resposta, comprimido = self.exportar('presencas', accept_encoding='gzip, deflate')
+        self.assertEqual(resposta['Content-Encoding'], 'gzip')
+        _, simples = self.exportar('presencas')
+        self.assertEqual(gzip.decompress(comprimido), simples)
+
+    def test_xlsx(self):
+        import zipfile
+        from xml.etree import ElementTree
+
+        resposta, conteudo = self.exportar('alunos', formato='xlsx', status='ativos')
+        self.assertIn('spreadsheetml', resposta['Content-Type'])
+        with zipfile.ZipFile(io.BytesIO(conteudo)) as pacote:
+            self.assertIsNone(pacote.testzip())
+            planilha = ElementTree.fromstring(pacote.read('xl/worksheets/sheet1.xml'))
+        ns = {'s': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+        linhas = planilha.findall('.//s:row', ns)
+        self.assertEqual(len(linhas) - 1, self.owner.alunos.filter(ativo=True).count())
+        cabecalho = [t.text for t in linhas[0].findall('.//s:t', ns)]
+        self.assertEqual(cabecalho[:3], ['Nome', 'Nascimento', 'Telefone'])
+
+
+class ImportacaoDeAlunosTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        cls.outro = User.objects.create_user('outro', password='senha', is_staff=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def enviar(self, conteudo, codificacao='utf-8', **dados):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        arquivo = SimpleUploadedFile('alunos.csv', conteudo.encode(codificacao), content_type='text/csv')
+        return self.client.post(reverse('importar-alunos'), {'arquivo': arquivo, **dados})
+
+    def test_importa_as_validas_e_relata_as_demais(self):
+        planilha = (
+            'Nome;Data de Nascimento;Celular;Endereço;Faixa;Bolsista\n'
+            'João Conceição;01/02/1990;11987654321;Rua A;Branca;sim\n'
+            'Ana Kids;15/03/2015;+55 (21) 3333-4444;Rua B;Branca (Infantil);\n'
+            'Pedro;2014-06-01;(11) 9 1111-2222;Rua C;Cinza e Branca;não\n'
+            'Data Ruim;30/02/2010;11911112222;Rua D;Azul;\n'
+            'Faixa Ruim;01/01/2000;11911112222;Rua E;Rosa;\n'
+            'Telefone Ruim;01/01/2000;1234;Rua F;Roxa;talvez\n'
+            'joao conceição;01/02/1990;11987654321;Rua A;Branca;sim\n'
+        )
+        resposta = self.enviar(planilha, codificacao='cp1252')
+        self.assertEqual(resposta.status_code, 200)
+        resultado = resposta.context['resultado']
+        self.assertEqual((resultado.linhas, resultado.importados, resultado.total_erros), (7, 3, 4))
+        self.assertEqual([linha for linha, _ in resultado.erros], [5, 6, 7, 8])
+        self.assertIn('Telefone', dict(resultado.erros)[7])
+        self.assertIn('Bolsista', dict(resultado.erros)[7])
+        self.assertIn('já cadastrado', dict(resultado.erros)[8])
+
+        alunos = {a.nome: a for a in Aluno.objects.filter(owner=self.owner)}
+        self.assertEqual(set(alunos), {'João Conceição', 'Ana Kids', 'Pedro'})
+        self.assertEqual(alunos['João Conceição'].faixa, 'BRANCA')
+        self.assertEqual(alunos['Ana Kids'].faixa, 'BRANCA_KIDS')
+        self.assertEqual(alunos['Pedro'].faixa, 'CINZA_BRANCA')
+        self.assertEqual(alunos['João Conceição'].telefone, '(11) 9 8765-4321')
+        self.assertEqual(alunos['Ana Kids'].telefone, '(21) 3333-4444')
+        self.assertTrue(alunos['João Conceição'].bolsista)
+        self.assertTrue(alunos['Ana Kids'].ativo)
+        # bulk_create não chama save(): a busca indexada precisa ter sido preenchida
+        from .busca import buscar_alunos
+        self.assertEqual(list(buscar_alunos(self.owner, '98765-4321')), [alunos['João Conceição']])
+
+    def test_formulario_de_edicao_aceita_telefone_antigo(self):
+        from django.forms.models import model_to_dict
+        from .forms import AlunoForm
+
+        antigo = Aluno.objects.create(
+            nome='Cadastro Antigo', data_nascimento=date(1980, 1, 1), telefone='3333-4444',
+            endereco='Rua', faixa='AZUL', owner=self.owner,
+        )
+        form = AlunoForm(data=model_to_dict(antigo), instance=antigo)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['telefone'], '3333-4444')
+        # Um número com DDD continua normalizado para o formato da máscara
+        form = AlunoForm(data={**model_to_dict(antigo), 'telefone': '+55 11 98765 4321'}, instance=antigo)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['telefone'], '(11) 9 8765-4321')
+
+    def test_linha_passa_pela_validacao_do_modelo(self):
+        from unittest import mock
+        from django.core.exceptions import ValidationError
+
+        def regra_do_modelo(aluno):
+            if aluno.nome == 'Sem Regra':
+                raise ValidationError({'nome': 'Nome reservado.', 'faixa': 'Faixa incompatível.'})
+
+        planilha = (
+            'Nome;Data de Nascimento;Celular;Endereço;Faixa\n'
+            'Sem Regra;01/02/1990;11987654321;Rua A;Azul\n'
+            'Com Regra;01/02/1990;11987654321;Rua A;Azul\n'
+        )
+        with mock.patch.object(Aluno, 'clean', regra_do_modelo):
+            resultado = self.enviar(planilha).context['resultado']
+        self.assertEqual((resultado.importados, resultado.erros), (1, [(2, 'Nome: Nome reservado. Faixa: Faixa incompatível.')]))
+        self.assertEqual(list(Aluno.objects.filter(owner=self.owner).values_list('nome', flat=True)), ['Com Regra'])
+
+    def test_planilha_exportada_volta_igual_e_simulacao_nao_grava(self):
+        semear_academia(self.outro, alunos=30, meses=1, presencas=0)
+        self.client.force_login(self.outro)
+        exportada = b''.join(self.client.get(reverse('exportar', args=['alunos'])).streaming_content).decode('utf-8-sig')
+        self.client.force_login(self.owner)
+
+        resposta = self.enviar(exportada, simular='on')
+        self.assertEqual(resposta.context['resultado'].importados, 30)
+        self.assertFalse(Aluno.objects.filter(owner=self.owner).exists())
+
+        resposta = self.enviar(exportada)
+        self.assertRedirects(resposta, reverse('aluno-list'))
+        campos = ('nome', 'data_nascimento', 'telefone', 'faixa', 'bolsista', 'ativo')
+        self.assertEqual(
+            sorted(Aluno.objects.filter(owner=self.owner).values_list(*campos)),
+            sorted(Aluno.objects.filter(owner=self.outro).values_list(*campos)),
+        )
+        # Reenviar a mesma planilha não duplica ninguém
+        self.assertEqual(self.enviar(exportada).context['resultado'].total_erros, 30)
+        self.assertEqual(Aluno.objects.filter(owner=self.owner).count(), 30)
+
+    def test_planilha_grande_em_lotes(self):
+        from . import importacao
+        planilha = 'nome,nascimento,telefone,endereco,faixa\n' + ''.join(
+            f'Aluno {i},2000-01-01,1198765{i:04d},Rua {i},Azul\n' for i in range(2500)
+        )
+        with CaptureQueriesContext(connection) as capturadas:
+            resultado = importacao.importar_alunos(self.owner, io.BytesIO(planilha.encode()))
+        self.assertEqual(resultado.importados, 2500)
+        self.assertEqual(Aluno.objects.filter(owner=self.owner).count(), 2500)
+        self.assertLess(len(capturadas), 60)
+
+        self.assertEqual(importacao.contar_linhas(io.BytesIO(planilha.encode())), 2500)
+        andamento = []
+        importacao.importar_alunos(self.outro, io.BytesIO(planilha.encode()), simular=True, progresso=lambda r: andamento.append(r.linhas))
+        self.assertEqual(andamento, [1000, 2000, 2500])
+        self.assertFalse(Aluno.objects.filter(owner=self.outro).exists())
+
+    def test_colunas_obrigatorias_e_comando(self):
+        resposta = self.enviar('nome,telefone\nFulano,11987654321\n')
+        self.assertFormError(resposta.context['form'], 'arquivo', 'Colunas obrigatórias ausentes: data_nascimento, endereco, faixa.')
+        self.assertFalse(Aluno.objects.exists())
+
+        import tempfile
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as arquivo:
+            arquivo.write('Nome,Nascimento,Telefone,Endereço,Faixa\nFulano,01/01/2000,11987654321,Rua A,Preta\n')
+        self.addCleanup(os.remove, arquivo.name)
+        saida = StringIO()
+        call_command('importar_alunos', arquivo.name, owner='outro', stdout=saida)
+        self.assertIn('1 de 1 linha(s) importadas', saida.getvalue())
+        self.assertEqual(self.outro.alunos.get().faixa, 'PRETA')
+        with self.assertRaises(CommandError):
+            call_command('importar_alunos', arquivo.name, owner='ninguem')
+
+
+class MensalidadesAtrasadasTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hoje = timezone.localdate()
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        cls.outro = User.objects.create_user('outro', password='senha', is_staff=True)
+        dados = dict(data_nascimento=date(2000, 1, 1), telefone='(11) 9 1234-5678', endereco='Rua', faixa='AZUL')
+        cls.joao = Aluno.objects.create(nome='João', owner=cls.owner, **dados)
+        cls.maria = Aluno.objects.create(nome='Maria', owner=cls.owner, **dados)
+        cls.pedro = Aluno.objects.create(nome='Pedro', owner=cls.outro, **dados)
+        # bulk_create não passa pelo save(): ficam PENDENTE como antes da passada
+        cls.vencida, cls.a_vencer, cls.paga, cls.do_outro = Mensalidade.objects.bulk_create([
+            Mensalidade(aluno=cls.joao, data_vencimento=cls.hoje - timedelta(days=3), valor=150, status='PENDENTE'),
+            Mensalidade(aluno=cls.maria, data_vencimento=cls.hoje, valor=150, status='PENDENTE'),
+            Mensalidade(aluno=cls.maria, data_vencimento=cls.hoje - timedelta(days=40), valor=150, status='PAGO',
+                        data_pagamento=cls.hoje - timedelta(days=40)),
+            Mensalidade(aluno=cls.pedro, data_vencimento=cls.hoje - timedelta(days=1), valor=150, status='PENDENTE'),
+        ])
+
+    def status(self, *mensalidades):
+        return [Mensalidade.objects.get(pk=m.pk).status for m in mensalidades]
+
+    def test_passada_unica_e_idempotente(self):
+        from .faturamento import atualizar_atrasadas
+        versoes = cache_academia.versao(self.owner.pk), cache_academia.versao(self.outro.pk)
+        with CaptureQueriesContext(connection) as capturadas:
+            self.assertEqual(atualizar_atrasadas(self.hoje), 2)
+        consultas = [q['sql'] for q in capturadas.captured_queries if not SAVEPOINT.match(q['sql'])]
+        self.assertEqual(len(consultas), 2)  # os donos afetados (para o cache) e o UPDATE
+        self.assertTrue(consultas[1].startswith('UPDATE'))
+        self.assertEqual(self.status(self.vencida, self.a_vencer, self.paga, self.do_outro), ['ATRASADO', 'PENDENTE', 'PAGO', 'ATRASADO'])
+        self.assertNotEqual((cache_academia.versao(self.owner.pk), cache_academia.versao(self.outro.pk)), versoes)
+
+        with CaptureQueriesContext(connection) as capturadas:
+            self.assertEqual(atualizar_atrasadas(self.hoje), 0)
+        self.assertEqual(len([q for q in capturadas.captured_queries if not SAVEPOINT.match(q['sql'])]), 1)
+
+        # A tarefa de hora em hora tem uma chave por hora
+        from datetime import datetime, timezone as tz
+        self.assertEqual(tarefas.Periodica('atualizar_atrasadas').chave(datetime(2024, 5, 25, 7, 30, tzinfo=tz.utc)), 'atualizar_atrasadas:2024-05-25T07')
+
+    def test_status_segue_o_vencimento_ao_salvar(self):
+        self.client.force_login(self.owner)
+        self.client.post(reverse('editar-mensalidade', args=[self.a_vencer.pk]), data={
+            'aluno': self.maria.pk, 'valor': '150.00', 'data_vencimento': (self.hoje - timedelta(days=1)).isoformat(),
+        })
+        self.assertEqual(self.status(self.a_vencer), ['ATRASADO'])
+        self.client.post(reverse('editar-mensalidade', args=[self.a_vencer.pk]), data={
+            'aluno': self.maria.pk, 'valor': '150.00', 'data_vencimento': (self.hoje + timedelta(days=10)).isoformat(),
+        })
+        self.assertEqual(self.status(self.a_vencer), ['PENDENTE'])
+        call_command('atualizar_atrasadas', stdout=StringIO())
+        self.client.post(reverse('registrar-pagamento', args=[self.vencida.pk]))
+        self.assertEqual(self.status(self.vencida), ['PAGO'])
+
+    def test_leituras_filtram_atrasadas_no_banco(self):
+        import csv
+        from .faturamento import alunos_a_faturar, atualizar_atrasadas, proxima_competencia
+        atualizar_atrasadas(self.hoje)
+
+        self.client.force_login(self.owner)
+        resposta = self.client.get(reverse('exportar', args=['mensalidades']), {'status': 'atrasado'})
+        linhas = list(csv.reader(StringIO(b''.join(resposta.streaming_content).decode('utf-8-sig'))))[1:]
+        self.assertEqual([(linha[0], linha[4]) for linha in linhas], [('João', 'ATRASADO')])
+
+        admin = User.objects.create_superuser('admin', password='senha')
+        self.client.force_login(admin)
+        resposta = self.client.get(reverse('admin:alunos_mensalidade_changelist'), {'status__exact': 'ATRASADO'})
+        self.assertEqual({m.pk for m in resposta.context['cl'].result_list}, {self.vencida.pk, self.do_outro.pk})
+
+        # Quem tem mensalidade atrasada também não recebe a próxima cobrança
+        competencia = proxima_competencia(self.hoje)
+        self.assertFalse(alunos_a_faturar(self.owner, competencia).exists())
+
+
+class LivroDePagamentosTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hoje = timezone.localdate()
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        dados = dict(data_nascimento=date(2000, 1, 1), telefone='(11) 9 1234-5678', endereco='Rua', faixa='AZUL', owner=cls.owner)
+        cls.joao = Aluno.objects.create(nome='João', **dados)
+        cls.maria = Aluno.objects.create(nome='Maria', **dados)
+        cls.mensalidade, cls.da_maria = Mensalidade.objects.bulk_create([
+            Mensalidade(aluno=cls.joao, data_vencimento=cls.hoje, valor=150, status='PENDENTE'),
+            Mensalidade(aluno=cls.maria, data_vencimento=cls.hoje, valor=100, status='PENDENTE'),
+        ])
+        pagamentos.reconstruir(cls.owner)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def pagar(self, mensalidade, **dados):
+        return self.client.post(reverse('registrar-pagamento', args=[mensalidade.pk]), data=dados)
+
+    def assertSaldosConferem(self):
+        self.assertEqual(pagamentos.verificar(), [])
+        self.assertEqual(receitas.verificar(), [])
+
+    def test_pagamentos_parciais_ate_quitar(self):
+        self.assertEqual(self.client.get(reverse('registrar-pagamento', args=[self.mensalidade.pk])).context['form'].initial['valor'], 150)
+
+        self.pagar(self.mensalidade, valor='50.00', metodo_pagamento='PIX')
+        mensalidade = Mensalidade.objects.get(pk=self.mensalidade.pk)
+        self.assertEqual((mensalidade.status, mensalidade.valor_pago, mensalidade.saldo), ('PENDENTE', 50, 100))
+        self.assertEqual(Aluno.objects.get(pk=self.joao.pk).saldo_devedor, 100)
+        self.assertFalse(ReceitaDiaria.objects.filter(owner=self.owner).exclude(total=0).exists())
+        self.assertSaldosConferem()
+
+        # Sem valor, o botão da lista quita o que falta
+        self.pagar(self.mensalidade)
+        mensalidade = Mensalidade.objects.get(pk=self.mensalidade.pk)
+        self.assertEqual((mensalidade.status, mensalidade.valor_pago, mensalidade.data_pagamento), ('PAGO', 150, self.hoje))
+        self.assertEqual(Aluno.objects.get(pk=self.joao.pk).saldo_devedor, 0)
+        self.assertEqual(
+            list(Pagamento.objects.filter(mensalidade=mensalidade).order_by('pk').values_list('valor_pago', 'metodo_pagamento')),
+            [(50, 'PIX'), (100, 'NAO_INFORMADO')],
+        )
+        self.assertEqual(ReceitaDiaria.objects.get(owner=self.owner, data=self.hoje).total, 150)
+        self.assertSaldosConferem()
+        self.assertEqual([a.pk for a in pagamentos.devedores(self.owner)], [self.maria.pk])
+
+    def test_recusa_pagamento_acima_do_saldo_ou_repetido(self):
+        self.pagar(self.da_maria, valor='100.01')
+        self.pagar(self.da_maria)
+        self.pagar(self.da_maria)
+        self.assertEqual(list(Pagamento.objects.values_list('valor_pago', flat=True)), [100])
+        self.assertEqual(Mensalidade.objects.get(pk=self.da_maria.pk).valor_pago, 100)
+        self.assertSaldosConferem()
+
+    def test_um_update_condicional_decide_o_pagamento(self):
+        with CaptureQueriesContext(connection) as capturadas:
+            self.pagar(self.da_maria)
+        consultas = [q['sql'] for q in capturadas.captured_queries if not SAVEPOINT.match(q['sql'])]
+        tabela = Mensalidade._meta.db_table
+        escritas = [sql for sql in consultas if sql.startswith(f'UPDATE "{tabela}"')]
+        self.assertEqual(len(escritas), 1)
+        self.assertIn('NOT ("alunos_mensalidade"."status" = ', escritas[0])
+        self.assertNotIn(' JOIN ', escritas[0])
+        self.assertFalse([sql for sql in consultas if 'FOR UPDATE' in sql])
+
+        # O segundo clique (sem chave) não passa pelo UPDATE e não lança de novo
+        resposta = self.pagar(self.da_maria)
+        self.assertEqual([str(m) for m in get_messages(resposta.wsgi_request)][-1], 'Esta mensalidade já foi paga.')
+        self.assertEqual(Pagamento.objects.filter(mensalidade=self.da_maria).count(), 1)
+        self.assertSaldosConferem()
+
+        outro = User.objects.create_user('outro', password='senha', is_staff=True)
+        self.client.force_login(outro)
+        self.assertEqual(self.pagar(self.mensalidade).status_code, 404)
+        self.assertEqual(Mensalidade.objects.get(pk=self.mensalidade.pk).valor_pago, 0)
+
+    def test_reenvio_com_a_mesma_chave_nao_lanca_de_novo(self):
+        dados = {'valor': '50.00', 'metodo_pagamento': 'PIX', 'chave': 'reenvio-1'}
+        # A resposta vai para o cache quando a transação é confirmada
+        with self.captureOnCommitCallbacks(execute=True):
+            primeira = self.pagar(self.mensalidade, **dados)
+        with CaptureQueriesContext(connection) as capturadas:
+            segunda = self.pagar(self.mensalidade, **dados)
+        # Respondido do cache: só a sessão e o usuário vêm do banco
+        tabelas = {Mensalidade._meta.db_table, Pagamento._meta.db_table, Aluno._meta.db_table}
+        self.assertFalse([q['sql'] for q in capturadas.captured_queries if any(t in q['sql'] for t in tabelas)])
+        mensagens = [[str(m) for m in get_messages(r.wsgi_request)][-1] for r in (primeira, segunda)]
+        self.assertEqual(mensagens, ['Pagamento parcial registrado. Saldo em aberto: R$ 100.00.'] * 2)
+
+        # Sem o cache (outro worker, cache reiniciado), a chave única do livro segura o reenvio
+        cache.clear()
+        self.pagar(self.mensalidade, **dados)
+        self.assertEqual(list(Pagamento.objects.values_list('valor_pago', flat=True)), [50])
+        self.assertEqual(Mensalidade.objects.get(pk=self.mensalidade.pk).valor_pago, 50)
+        self.assertSaldosConferem()
+
+        # O botão da lista leva uma chave por exibição da página
+        pagina = self.client.get(reverse('mensalidade-list'))
+        self.assertContains(pagina, f'name="chave" value="{pagina.context["chave_pagamento"]}-{self.mensalidade.pk}"')
+
+    def test_a_mesma_chave_em_owners_diferentes(self):
+        self.pagar(self.mensalidade, valor='50.00', chave='chave-1')
+        outro = User.objects.create_user('outro', password='senha', is_staff=True)
+        aluno = Aluno.objects.create(
+            nome='Pedro', data_nascimento=date(2000, 1, 1), telefone='(11) 9 1234-5678', endereco='Rua', faixa='AZUL', owner=outro,
+        )
+        do_outro = Mensalidade.objects.create(aluno=aluno, data_vencimento=self.hoje, valor=80, status='PENDENTE')
+        pagamentos.reconstruir(outro)
+
+        lancamento = pagamentos.registrar_pagamento(outro, do_outro.pk, chave='chave-1')
+        self.assertEqual((lancamento.quitada, lancamento.repetido), (True, False))
+        self.assertEqual(
+            sorted(Pagamento.objects.values_list('mensalidade', 'valor_pago')), sorted([(self.mensalidade.pk, 50), (do_outro.pk, 80)]),
+        )
+        self.assertSaldosConferem()
+
+    def test_quitar_com_valor_alterado_no_meio_deixa_o_resto_em_aberto(self):
+        from unittest import mock
+
+        from django.db.models import QuerySet
+
+        ler = QuerySet.first
+
+        def ler_e_aumentar(queryset):
+            # Outra transação aumenta a mensalidade entre a leitura do saldo e o UPDATE
+            lida = ler(queryset)
+            Mensalidade.objects.filter(pk=self.mensalidade.pk).update(valor=180)
+            pagamentos.aplicar_deltas({self.joao.pk: 30})
+            return lida
+
+        with mock.patch.object(QuerySet, 'first', ler_e_aumentar):
+            lancamento = pagamentos.registrar_pagamento(self.owner, self.mensalidade.pk)
+        self.assertEqual((lancamento.quitada, lancamento.saldo), (False, 30))
+        mensalidade = Mensalidade.objects.get(pk=self.mensalidade.pk)
+        self.assertEqual((mensalidade.status, mensalidade.valor_pago), ('PENDENTE', 150))
+        self.assertFalse(ReceitaDiaria.objects.filter(owner=self.owner).exclude(total=0).exists())
+        self.assertSaldosConferem()
+
+    def test_recebido_por_metodo_numa_consulta(self):
+        self.pagar(self.mensalidade, valor='50.00', metodo_pagamento='PIX')
+        self.pagar(self.mensalidade, valor='30.00', metodo_pagamento='PIX')
+        self.pagar(self.da_maria, metodo_pagamento='DINHEIRO')
+        with CaptureQueriesContext(connection) as capturadas:
+            contexto = self.client.get(reverse('relatorio-mensal')).context
+        self.assertEqual(
+            [(item['metodo'], item['total'], item['quantidade']) for item in contexto['por_metodo']],
+            [('Dinheiro', 100, 1), ('PIX', 80, 2)],
+        )
+        # O relatório conta só a mensalidade quitada; o recebido inclui o pagamento parcial
+        self.assertEqual(contexto['total_receita'], 100)
+        tabela = Pagamento._meta.db_table
+        self.assertEqual(len([q for q in capturadas.captured_queries if tabela in q['sql']]), 1)
+
+    def test_saldo_acompanha_faturamento_edicao_e_exclusao(self):
+        from .faturamento import gerar_mensalidades_em_massa
+        self.pagar(self.mensalidade, valor='50.00')
+        self.client.post(reverse('editar-mensalidade', args=[self.mensalidade.pk]), data={
+            'aluno': self.maria.pk, 'valor': '120.00', 'data_vencimento': self.hoje.isoformat(),
+        })
+        self.assertEqual(Aluno.objects.get(pk=self.maria.pk).saldo_devedor, 170)
+        # Abaixo do já pago, a edição é recusada
+        resposta = self.client.post(reverse('editar-mensalidade', args=[self.mensalidade.pk]), data={
+            'aluno': self.maria.pk, 'valor': '40.00', 'data_vencimento': self.hoje.isoformat(),
+        })
+        self.assertTrue(resposta.context['form'].errors['valor'])
+        self.assertSaldosConferem()
+
+        self.pagar(self.da_maria)
+        self.client.post(reverse('excluir-mensalidade', args=[self.mensalidade.pk]))
+        self.assertFalse(Pagamento.objects.filter(mensalidade=self.mensalidade.pk).exists())
+        self.assertEqual(Aluno.objects.get(pk=self.maria.pk).saldo_devedor, 0)
+        self.assertEqual(gerar_mensalidades_em_massa(self.owner, self.hoje).criadas, 2)
+        self.assertEqual(Aluno.objects.get(pk=self.joao.pk).saldo_devedor, 150)
+        self.assertSaldosConferem()
+
+        Aluno.objects.filter(pk=self.joao.pk).update(saldo_devedor=0)
+        with self.assertRaises(CommandError):
+            call_command('reconstruir_saldos', '--verificar', stdout=StringIO(), stderr=StringIO())
+        call_command('reconstruir_saldos', stdout=StringIO())
+        self.assertSaldosConferem()
+
+
+class AcoesEmLoteTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hoje = timezone.localdate()
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        cls.outro = User.objects.create_user('outro', password='senha', is_staff=True)
+        dados = dict(data_nascimento=date(2000, 1, 1), telefone='(11) 9 1234-5678', endereco='Rua', faixa='AZUL')
+        cls.joao = Aluno.objects.create(nome='João', owner=cls.owner, **dados)
+        cls.maria = Aluno.objects.create(nome='Maria', owner=cls.owner, **dados)
+        cls.pedro = Aluno.objects.create(nome='Pedro', owner=cls.outro, **dados)
+        cls.atrasada, cls.pendente, cls.do_outro = Mensalidade.objects.bulk_create([
+            Mensalidade(aluno=cls.joao, data_vencimento=cls.hoje - timedelta(days=10), valor=150, status='ATRASADO'),
+            Mensalidade(aluno=cls.maria, data_vencimento=cls.hoje, valor=100, status='PENDENTE'),
+            Mensalidade(aluno=cls.pedro, data_vencimento=cls.hoje, valor=150, status='PENDENTE'),
+        ])
+        pagamentos.reconstruir()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def em_lote(self, acao, mensalidades, **dados):
+        return self.client.post(reverse('mensalidades-em-lote'), data={
+            'acao': acao, 'mensalidades': [m.pk for m in mensalidades], **dados,
+        })
+
+    def assertSaldosConferem(self):
+        self.assertEqual(pagamentos.verificar(), [])
+        self.assertEqual(receitas.verificar(), [])
+
+    def test_quitar_num_unico_update_so_as_do_owner(self):
+        self.client.post(reverse('registrar-pagamento', args=[self.atrasada.pk]), data={'valor': '50.00'})
+        with CaptureQueriesContext(connection) as capturadas:
+            resposta = self.em_lote('quitar', [self.atrasada, self.pendente, self.do_outro], metodo_pagamento='PIX')
+        self.assertEqual([str(m) for m in get_messages(resposta.wsgi_request)][-1], '2 mensalidade(s) marcada(s) como paga(s).')
+        tabela = Mensalidade._meta.db_table
+        self.assertEqual(len([q for q in capturadas.captured_queries if q['sql'].startswith(f'UPDATE "{tabela}"')]), 1)
+
+        self.assertEqual(
+            list(Mensalidade.objects.filter(aluno__owner=self.owner).order_by('pk').values_list('status', 'valor_pago', 'data_pagamento')),
+            [('PAGO', 150, self.hoje), ('PAGO', 100, self.hoje)],
+        )
+        # O que faltava de cada uma vira um lançamento no livro
+        self.assertEqual(
+            list(Pagamento.objects.order_by('pk').values_list('valor_pago', 'metodo_pagamento')),
+            [(50, 'NAO_INFORMADO'), (100, 'PIX'), (100, 'PIX')],
+        )
+        self.assertEqual(ReceitaDiaria.objects.get(owner=self.owner, data=self.hoje).total, 250)
+        self.assertEqual(Mensalidade.objects.get(pk=self.do_outro.pk).status, 'PENDENTE')
+        self.assertSaldosConferem()
+
+        # Reenviar não lança de novo
+        self.em_lote('quitar', [self.atrasada, self.pendente])
+        self.assertEqual(Pagamento.objects.count(), 3)
+
+    def test_adiar_e_excluir(self):
+        self.em_lote('adiar', [self.atrasada, self.pendente, self.do_outro], dias='30')
+        self.assertEqual(
+            list(Mensalidade.objects.order_by('pk').values_list('data_vencimento', 'status')),
+            [(self.hoje + timedelta(days=20), 'PENDENTE'), (self.hoje + timedelta(days=30), 'PENDENTE'), (self.hoje, 'PENDENTE')],
+        )
+        self.em_lote('adiar', [self.pendente], dias='-31')
+        self.assertEqual(Mensalidade.objects.get(pk=self.pendente.pk).status, 'ATRASADO')
+        resposta = self.em_lote('adiar', [self.pendente])
+        self.assertEqual([str(m) for m in get_messages(resposta.wsgi_request)][-1], 'Informe quantos dias adiar o vencimento.')
+
+        self.client.post(reverse('registrar-pagamento', args=[self.pendente.pk]))
+        self.em_lote('excluir', [self.atrasada, self.pendente, self.do_outro])
+        self.assertEqual(list(Mensalidade.objects.values_list('pk', flat=True)), [self.do_outro.pk])
+        self.assertEqual(Aluno.objects.get(pk=self.joao.pk).saldo_devedor, 0)
+        self.assertSaldosConferem()
+
+    def test_acoes_do_admin(self):
+        admin = User.objects.create_superuser('admin', password='senha')
+        self.client.force_login(admin)
+        url = reverse('admin:alunos_mensalidade_changelist')
+        selecionadas = [self.atrasada.pk, self.do_outro.pk]
+        self.client.post(url, {'action': 'adiar', '_selected_action': selecionadas, 'dias': '15'})
+        self.assertEqual(Mensalidade.objects.get(pk=self.atrasada.pk).status, 'PENDENTE')
+        self.assertEqual(Mensalidade.objects.get(pk=self.do_outro.pk).data_vencimento, self.hoje + timedelta(days=15))
+
+        self.client.post(url, {'action': 'quitar', '_selected_action': selecionadas, 'metodo_pagamento': 'DINHEIRO'})
+        self.assertEqual(set(Pagamento.objects.values_list('metodo_pagamento', flat=True)), {'DINHEIRO'})
+        self.assertEqual(Aluno.objects.get(pk=self.pedro.pk).saldo_devedor, 0)
+        self.assertSaldosConferem()
+
+        self.client.post(url, {'action': 'delete_selected', '_selected_action': selecionadas, 'post': 'yes'})
+        self.assertEqual(list(Mensalidade.objects.values_list('pk', flat=True)), [self.pendente.pk])
+        self.assertFalse(ReceitaDiaria.objects.exclude(total=0).exists())
+        self.assertSaldosConferem()
+
+
+class AdminDeTabelasGrandesTests(CacheLimpoTestCase):
+
+    LISTAS = ['aluno', 'mensalidade', 'pagamento', 'presenca', 'userprofile', 'tarefa']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='senha')
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        semear_academia(cls.owner, alunos=5, meses=2, presencas=2)
+        Tarefa.objects.create(owner=cls.owner, tipo='importar_alunos')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def consultas(self, modelo, **params):
+        with CaptureQueriesContext(connection) as capturadas:
+            resposta = self.client.get(reverse(f'admin:alunos_{modelo}_changelist'), params)
+        self.assertEqual(resposta.status_code, 200, modelo)
+        return resposta, [q['sql'] for q in capturadas.captured_queries if not SAVEPOINT.match(q['sql'])]
+
+    def test_listas_sem_consulta_por_linha(self):
+        antes = {modelo: len(self.consultas(modelo)[1]) for modelo in self.LISTAS}
+        outro = User.objects.create_user('outro', password='senha', is_staff=True)
+        semear_academia(outro, alunos=40, meses=3, presencas=3)
+        Tarefa.objects.bulk_create([Tarefa(owner=outro, tipo='importar_alunos') for _ in range(10)])
+        depois = {modelo: len(self.consultas(modelo)[1]) for modelo in self.LISTAS}
+        self.assertEqual(depois, antes)
+
+        # Navegação por data e filtro não contam a tabela inteira de novo
+        hoje = timezone.localdate()
+        resposta, consultas = self.consultas('mensalidade', data_vencimento__year=hoje.year, status__exact='PAGO')
+        self.assertEqual(len([sql for sql in consultas if 'COUNT(*)' in sql]), 1)
+        self.assertEqual(
+            resposta.context['cl'].result_count,
+            Mensalidade.objects.filter(data_vencimento__year=hoje.year, status='PAGO').count(),
+        )
+
+    def test_busca_pelo_campo_indexado(self):
+        dados = dict(data_nascimento=date(2000, 1, 1), endereco='Rua', faixa='AZUL', owner=self.owner)
+        joao = Aluno.objects.create(nome='João Conceição', telefone='(11) 9 8765-4321', **dados)
+        Mensalidade.objects.create(aluno=joao, data_vencimento=timezone.localdate(), valor=150)
+        for modelo, busca in [('aluno', 'joao conceicao'), ('aluno', '11987654321'), ('mensalidade', 'CONCEIÇÃO')]:
+            with self.subTest(modelo=modelo, busca=busca):
+                resposta, consultas = self.consultas(modelo, q=busca)
+                self.assertEqual(resposta.context['cl'].result_count, 1)
+                # No Postgres: "busca"::text LIKE, atendido pelo índice de trigramas
+                self.assertTrue([sql for sql in consultas if re.search(r'"busca"(::text)? LIKE', sql)])
+
+        # A ajuda da busca pelo aluno só aparece nas listas que buscam por ele
+        ajudas = {modelo: self.consultas(modelo)[0].context['cl'].search_help_text for modelo in self.LISTAS}
+        for modelo in ('aluno', 'mensalidade', 'pagamento', 'presenca'):
+            self.assertIn('email do aluno', ajudas[modelo])
+        self.assertEqual(ajudas['userprofile'], 'Nome de usuário exato.')
+        self.assertNotIn('aluno', ajudas['tarefa'] or '')
+
+    def test_presenca_pelo_admin_atualiza_a_frequencia(self):
+        aluno = Aluno.objects.filter(owner=self.owner).first()
+        data = timezone.localdate() - timedelta(days=400)
+        self.client.post(reverse('admin:alunos_presenca_add'), {'aluno': aluno.pk, 'data': data.isoformat(), 'presente': 'on'})
+        presenca = Presenca.objects.get(aluno=aluno, data=data)
+        self.assertEqual(frequencia.verificar(), [])
+        self.client.post(reverse('admin:alunos_presenca_changelist'), {
+            'action': 'delete_selected', '_selected_action': [presenca.pk], 'post': 'yes',
+        })
+        self.assertFalse(Presenca.objects.filter(pk=presenca.pk).exists())
+        self.assertEqual(frequencia.verificar(), [])
+
+        # O livro de pagamentos é só leitura
+        em_aberto = Mensalidade.objects.filter(status__in=Mensalidade.EM_ABERTO).first()
+        pagamento = Pagamento.objects.get(pk=pagamentos.registrar_pagamento(self.owner, em_aberto.pk).pagamento_id)
+        self.assertEqual(self.client.get(reverse('admin:alunos_pagamento_change', args=[pagamento.pk])).status_code, 200)
+        self.client.post(reverse('admin:alunos_pagamento_change', args=[pagamento.pk]), {'valor_pago': '1.00'})
+        self.assertEqual(Pagamento.objects.get(pk=pagamento.pk).valor_pago, pagamento.valor_pago)
+        self.assertEqual(self.client.get(reverse('admin:alunos_pagamento_add')).status_code, 403)
+
+    def test_total_estimado_no_postgres(self):
+        from unittest import mock
+        from . import paginacao
+
+        if connection.vendor != 'postgresql':
+            self.skipTest('Estimativa do planejador só existe no Postgres')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        with mock.patch.object(paginacao, 'LIMITE_CONTAGEM_EXATA', 0):
+            resposta, consultas = self.consultas('mensalidade')
+        self.assertFalse([sql for sql in consultas if 'COUNT(*)' in sql])
+        self.assertTrue([sql for sql in consultas if sql.startswith('EXPLAIN')])
+        self.assertGreater(resposta.context['cl'].result_count, 0)
+
+
+@override_settings(TAREFAS_PERIODICAS=[])
+class TarefaTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('professor', password='senha', is_staff=True)
+        cls.outro = User.objects.create_user('outro', password='senha', is_staff=True)
+
+    def registrar(self, tipo, funcao):
+        tarefas.registrar(tipo)(funcao)
+        self.addCleanup(tarefas.TIPOS.pop, tipo)
+
+    def test_importacao_grande_vai_para_a_fila(self):
+        from unittest import mock
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from . import importacao
+
+        planilha = 'Nome,Nascimento,Telefone,Endereço,Faixa\n' + ''.join(
+            f'Aluno {i},01/01/2000,1198765432{i},Rua {i},Azul\n' for i in range(3)
+        )
+        self.client.force_login(self.owner)
+        with mock.patch.object(importacao, 'LIMITE_LINHAS', 2):
+            resposta = self.client.post(reverse('importar-alunos'), {
+                'arquivo': SimpleUploadedFile('alunos.csv', planilha.encode()),
+            })
+        tarefa = Tarefa.objects.get(owner=self.owner)
+        self.assertRedirects(resposta, reverse('tarefa', args=[tarefa.pk]))
+        self.assertEqual((tarefa.tipo, tarefa.status, bytes(tarefa.anexo)), ('importar_alunos', 'PENDENTE', planilha.encode()))
+        self.assertFalse(Aluno.objects.exists())
+        self.assertContains(self.client.get(reverse('tarefa', args=[tarefa.pk])), 'Aguardando na fila')
+        self.assertEqual(self.client.get(reverse('tarefa-progresso', args=[tarefa.pk])).json()['status'], 'PENDENTE')
+
+        # O cache dos testes é da memória deste processo: o worker só roda se isso for aceito
+        with self.assertRaisesMessage(CommandError, 'não é compartilhado com o site'):
+            call_command('executar_tarefas', '--uma-vez', stdout=StringIO())
+        saida = StringIO()
+        with self.assertLogs('alunos.tarefas', 'INFO'):
+            call_command('executar_tarefas', '--uma-vez', '--cache-local', stdout=saida)
+        self.assertIn('1 tarefa(s) executada(s)', saida.getvalue())
+        tarefa.refresh_from_db()
+        self.assertEqual(tarefa.status, 'CONCLUIDA')
+        self.assertIsNone(tarefa.anexo)
+        self.assertEqual((tarefa.progresso_atual, tarefa.progresso_total, tarefa.percentual), (3, 3, 100))
+        self.assertEqual(tarefa.resultado['importados'], 3)
+        self.assertEqual(self.owner.alunos.count(), 3)
+        self.assertContains(self.client.get(reverse('tarefa', args=[tarefa.pk])), '3 de 3 linha(s) importadas')
+        self.assertTrue(self.client.get(reverse('tarefa-progresso', args=[tarefa.pk])).json()['terminada'])
+
+        # Cada professor só vê as próprias tarefas
+        self.client.force_login(self.outro)
+        self.assertEqual(self.client.get(reverse('tarefa', args=[tarefa.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('tarefa-progresso', args=[tarefa.pk])).status_code, 404)
+
+    def test_falha_volta_para_a_fila_com_espera_e_desiste_no_limite(self):
+        def falhar(tarefa):
+            raise ValueError('banco fora do ar')
+        self.registrar('teste_falha', falhar)
+        tarefa = tarefas.enfileirar('teste_falha')
+        Tarefa.objects.filter(pk=tarefa.pk).update(max_tentativas=2)
+
+        with self.assertLogs('alunos.tarefas', 'ERROR'):
+            self.assertFalse(tarefas.executar(tarefas.reservar('w1')))
+        tarefa.refresh_from_db()
+        self.assertEqual((tarefa.status, tarefa.tentativas), ('PENDENTE', 1))
+        self.assertIn('banco fora do ar', tarefa.erro)
+        self.assertAlmostEqual((tarefa.executar_em - timezone.now()).total_seconds(), 30, delta=5)
+        self.assertIsNone(tarefas.reservar('w1'))  # ainda esperando
+        self.assertEqual(tarefas.espera(2), timedelta(minutes=1))
+        self.assertEqual(tarefas.espera(20), tarefas.ESPERA_MAXIMA)
+
+        Tarefa.objects.filter(pk=tarefa.pk).update(executar_em=timezone.now())
+        with self.assertLogs('alunos.tarefas', 'ERROR'):
+            tarefas.executar(tarefas.reservar('w1'))
+        tarefa.refresh_from_db()
+        self.assertEqual((tarefa.status, tarefa.tentativas), ('FALHOU', 2))
+        self.assertIsNotNone(tarefa.concluida_em)
+
+    def test_reserva_exclusiva_e_retomada_quando_expira(self):
+        self.registrar('teste_ok', lambda tarefa: {'ok': True})
+        primeira = tarefas.enfileirar('teste_ok')
+        segunda = tarefas.enfileirar('teste_ok')
+        reservada = tarefas.reservar('w1')
+        self.assertEqual(reservada.pk, primeira.pk)
+        self.assertEqual(tarefas.reservar('w2').pk, segunda.pk)
+        self.assertIsNone(tarefas.reservar('w3'))
+
+        # O worker w1 parou sem renovar a reserva: w3 retoma a tarefa, e w1 não grava mais nada nela
+        Tarefa.objects.filter(pk=primeira.pk).update(reservada_ate=timezone.now() - timedelta(seconds=1))
+        retomada = tarefas.reservar('w3')
+        self.assertEqual((retomada.pk, retomada.tentativas), (primeira.pk, 2))
+        tarefas.executar(reservada)
+        self.assertEqual(Tarefa.objects.get(pk=primeira.pk).status, 'EXECUTANDO')
+        self.assertTrue(tarefas.executar(retomada))
+        self.assertEqual(Tarefa.objects.get(pk=primeira.pk).resultado, {'ok': True})
+
+    def test_periodicas_uma_vez_por_periodo(self):
+        from datetime import datetime, timezone as tz
+
+        def chaves():
+            return sorted(Tarefa.objects.values_list('chave', flat=True))
+
+        with self.settings(TAREFAS_PERIODICAS=[('preparar_relatorios', 3), ('faturamento_mensal', 6, 25)]):
+            tarefas.agendar_periodicas(datetime(2024, 5, 25, 2, tzinfo=tz.utc))
+            self.assertEqual(chaves(), [])
+            tarefas.agendar_periodicas(datetime(2024, 5, 25, 7, tzinfo=tz.utc))
+            tarefas.agendar_periodicas(datetime(2024, 5, 25, 8, tzinfo=tz.utc))
+            self.assertEqual(chaves(), ['faturamento_mensal:2024-05', 'preparar_relatorios:2024-05-25'])
+            # Worker parado no dia 25: o faturamento do mês ainda sai depois; o do mês seguinte só no dia 25
+            tarefas.agendar_periodicas(datetime(2024, 6, 1, 3, tzinfo=tz.utc))
+            self.assertEqual(chaves(), [
+                'faturamento_mensal:2024-05', 'preparar_relatorios:2024-05-25', 'preparar_relatorios:2024-06-01',
+            ])
+
+        # Dia 31 num mês mais curto: roda no último dia dele
+        mensal = tarefas.Periodica('faturamento_mensal', 6, 31)
+        self.assertIsNone(mensal.chave(datetime(2024, 2, 28, 7, tzinfo=tz.utc)))
+        self.assertEqual(mensal.chave(datetime(2024, 2, 29, 7, tzinfo=tz.utc)), 'faturamento_mensal:2024-02')
+        self.assertEqual(mensal.chave(datetime(2024, 4, 30, 7, tzinfo=tz.utc)), 'faturamento_mensal:2024-04')
+        self.assertIsNone(mensal.chave(datetime(2024, 5, 30, 7, tzinfo=tz.utc)))
+
+    def test_faturamento_mensal_pela_fila(self):
+        for i in range(3):
+            Aluno.objects.create(
+                nome=f'Aluno {i}', data_nascimento=date(2000, 1, 1), telefone='(11) 9 1234-5678',
+                endereco='Rua', faixa='AZUL', owner=self.owner, bolsista=i == 0,
+            )
+        tarefa = tarefas.enfileirar('faturamento_mensal')
+        with self.assertLogs('alunos.tarefas', 'INFO') as registros:
+            self.assertEqual(tarefas.trabalhar(uma_vez=True), 1)
+        self.assertIn('faturamento_mensal', registros.output[0])
+        tarefa.refresh_from_db()
+        self.assertEqual((tarefa.status, tarefa.resultado), ('CONCLUIDA', {'criadas': 3}))
+        self.assertEqual((tarefa.progresso_atual, tarefa.progresso_total), (2, 2))
+        competencia = (timezone.localdate().replace(day=1) + timedelta(days=32)).replace(day=1)
+        self.assertEqual(Mensalidade.objects.filter(aluno__owner=self.owner, competencia=competencia).count(), 3)
+
+
+class OrcamentoDeConsultasTests(CacheLimpoTestCase):
+    """Cada rota de `alunos/urls.py` tem um número máximo de consultas, igual para um owner
+    pequeno e para um com milhares de alunos e anos de histórico (pega N+1 nos templates)."""
+
+    # Rota -> consultas permitidas. Rotas novas precisam entrar aqui (ver test_todas_as_rotas_tem_orcamento)
+    ORCAMENTOS = {
+        ('role-select', 'get'): 2,
+        ('aluno-login', 'get'): 2,
+        ('aluno-signup', 'get'): 2,
+        ('aluno-portal', 'get'): 2,
+        ('aluno-termos', 'get'): 2,
+        ('aluno-list', 'get'): 3,
+        ('aluno-create', 'get'): 2,
+        ('importar-alunos', 'get'): 2,
+        ('tarefa', 'get'): 3,
+        ('tarefa-progresso', 'get'): 3,
+        ('aluno-update', 'get'): 3,
+        ('mensalidade-list', 'get'): 4,
+        ('registrar-pagamento', 'get'): 3,
+        ('registrar-pagamento', 'post'): 10,  # saldo a quitar, UPDATE condicional e releitura, livro, saldo do aluno e receita do dia (criada no 1º do dia)
+        ('mensalidades-em-lote', 'post'): 10,  # leitura travada, UPDATE, livro, saldos dos alunos e receita do dia
+        ('gerar-mensalidades', 'get'): 3,
+        ('gerar-mensalidades', 'post'): 12,  # 8 (com a contagem que decide pela fila) + INSERTs em lotes de 500 para o owner grande
+        ('excluir-mensalidade', 'post'): 9,  # + DELETE do relatório gravado do mês encerrado
+        ('editar-mensalidade', 'get'): 4,
+        ('editar-mensalidade', 'post'): 9,  # idem
+        ('signup', 'get'): 2,
+        ('profile', 'get'): 2,
+        ('settings', 'get'): 2,
+        ('update-theme', 'post'): 3,
+        ('relatorio-mensal', 'get'): 5,
+        ('presencas', 'get'): 6,
+        ('chamada', 'get'): 3,
+        ('chamada', 'post'): 6,
+        ('exportar', 'get'): 3,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pequeno = User.objects.create_user('pequeno', password='senha', is_staff=True)
+        cls.grande = User.objects.create_user('grande', password='senha', is_staff=True)
+        semear_academia(cls.pequeno, alunos=5, meses=2, presencas=2)
+        semear_academia(cls.grande, alunos=2000, meses=36, presencas=30)
+        for owner in (cls.pequeno, cls.grande):
+            owner.profile.accepted_terms_at = timezone.now()
+            owner.profile.save()
+
+    def pedido(self, nome, metodo, owner):
+        """(args da URL, dados) da requisição de `nome` para `owner`."""
+        mensalidades = Mensalidade.objects.filter(aluno__owner=owner, aluno__ativo=True).order_by('pk')
+        # Paga num mês encerrado: o caso mais caro (descarta o relatório gravado do mês)
+        paga = mensalidades.filter(status='PAGO', data_pagamento__lt=timezone.localdate().replace(day=1)).first()
+        pendente = mensalidades.filter(status='PENDENTE').first()
+        em_aberto = list(mensalidades.filter(status__in=Mensalidade.EM_ABERTO).values_list('pk', flat=True)[:30])
+        ativos = list(Aluno.objects.filter(owner=owner, ativo=True).order_by('pk').values_list('pk', flat=True)[:30])
+        tarefa, _ = Tarefa.objects.get_or_create(owner=owner, tipo='importar_alunos')
+        return {
+            'aluno-update': ([paga.aluno_id], {}),
+            'registrar-pagamento': ([pendente.pk], {}),
+            'mensalidades-em-lote': ([], {'acao': 'quitar', 'mensalidades': em_aberto}),
+            'excluir-mensalidade': ([paga.pk], {}),
+            'editar-mensalidade': ([paga.pk], {
+                'aluno': paga.aluno_id, 'valor': '120.00', 'data_vencimento': paga.data_vencimento.isoformat(),
+            }),
+            'update-theme': ([], json.dumps({'dark_mode': True})),
+            'chamada': ([], {'data': timezone.localdate().isoformat(), 'alunos': ativos, 'presentes': ativos[::2]}),
+            'exportar': (['mensalidades'], {}),
+            'tarefa': ([tarefa.pk], {}),
+            'tarefa-progresso': ([tarefa.pk], {}),
+        }.get(nome, ([], {}))
+
+    def consultas(self, nome, metodo, owner):
+        args, dados = self.pedido(nome, metodo, owner)
+        extra = {'content_type': 'application/json'} if isinstance(dados, str) else {}
+        self.client.force_login(owner)
+        # Cada requisição é desfeita ao fim, para não mudar os dados das seguintes
+        with transaction.atomic(), CaptureQueriesContext(connection) as capturadas:
+            resposta = getattr(self.client, metodo)(reverse(nome, args=args), data=dados if metodo == 'post' else {}, **extra)
+            if resposta.streaming:
+                b''.join(resposta.streaming_content)
+            transaction.set_rollback(True)
+        self.assertLess(resposta.status_code, 400, nome)
+        return [q['sql'] for q in capturadas.captured_queries if not SAVEPOINT.match(q['sql'])]
+
+    def assertNoOrcamento(self, consultas, orcamento, rota):
+        if len(consultas) > orcamento:
+            listagem = '\n'.join(f'{i}. {sql}' for i, sql in enumerate(consultas, 1))
+            self.fail(f'{rota}: {len(consultas)} consultas (orçamento {orcamento}):\n{listagem}')
+
+    def test_todas_as_rotas_tem_orcamento(self):
+        from .urls import urlpatterns
+        nomes = {rota.name for rota in urlpatterns}
+        self.assertEqual(nomes - {nome for nome, _ in self.ORCAMENTOS}, set())
+
+    def test_orcamento_de_consultas(self):
+        for (nome, metodo), orcamento in self.ORCAMENTOS.items():
+            with self.subTest(rota=nome, metodo=metodo):
+                pequeno = self.consultas(nome, metodo, self.pequeno)
+                grande = self.consultas(nome, metodo, self.grande)
+                self.assertNoOrcamento(pequeno, orcamento, f'{metodo.upper()} {nome} (owner pequeno)')
+                self.assertNoOrcamento(grande, orcamento, f'{metodo.upper()} {nome} (owner grande)')
+                # Os INSERTs em massa vão em lotes de tamanho fixo; o resto não pode crescer com os dados
+                sem_lotes = [[sql for sql in consultas if not sql.startswith('INSERT')] for consultas in (pequeno, grande)]
+                self.assertEqual(len(sem_lotes[0]), len(sem_lotes[1]), '\n'.join(
+                    ['Número de consultas varia com o volume de dados:', '-- owner pequeno:', *sem_lotes[0],
+                     '-- owner grande:', *sem_lotes[1]]
+                ))
+
+
+class ComandosDeBenchmarkTests(CacheLimpoTestCase):
+
+    def test_gera_dados_e_mede_todas_as_rotas(self):
+        import tempfile
+        from .bench import rotas
+
+        call_command('gerar_dados_sinteticos', owners=2, alunos=15, meses=3, presencas=5, seed=1, stdout=StringIO())
+        self.assertEqual(Aluno.objects.filter(owner__username='sintetico1').count(), 15)
+        self.assertEqual(receitas.verificar(), [])
+        self.assertEqual(frequencia.verificar(), [])
+        # As páginas de tarefa precisam de uma tarefa do owner (os dados sintéticos não criam)
+        Tarefa.objects.create(owner=User.objects.get(username='sintetico1'), tipo='importar_alunos', status='CONCLUIDA')
+
+        with tempfile.TemporaryDirectory() as pasta:
+            saida = os.path.join(pasta, 'bench.json')
+            call_command('bench', usuario='sintetico1', repeticoes=1, aquecimento=0, saida=saida, stdout=StringIO())
+            with open(saida, encoding='utf-8') as arquivo:
+                resultado = json.load(arquivo)
+        medidas = {(r['rota'], r['metodo'].lower()): r for r in resultado['resultados']}
+        self.assertEqual(set(medidas), set(rotas()))
+        for rota, medida in medidas.items():
+            self.assertLess(medida['status'], 400, rota)
+            self.assertGreater(medida['consultas'], 0, rota)
+        # As repetições rodam em transações desfeitas
+        self.assertEqual(receitas.verificar(), [])
+
+
+class MedicaoDeDesempenhoTests(CacheLimpoTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('medido', password='senha', is_staff=True)
+        semear_academia(cls.owner, alunos=20, meses=2, presencas=2)
+        cls.owner.profile.accepted_terms_at = timezone.now()
+        cls.owner.profile.save()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def test_server_timing_nas_requisicoes_amostradas(self):
+        with self.settings(PERF_SAMPLE_RATE=1):
+            resposta = self.client.get(reverse('aluno-list'))
+        metricas = dict(
+            (parte.split(';')[0].strip(), parte) for parte in resposta['Server-Timing'].split(',')
+        )
+        self.assertEqual(set(metricas), {'db', 'tpl', 'app', 'total'})
+        consultas = int(re.search(r'desc="(\d+) consultas"', metricas['db']).group(1))
+        self.assertGreater(consultas, 0)
+        self.assertGreater(float(re.search(r'dur=([\d.]+)', metricas['tpl']).group(1)), 0)
+        self.assertEqual(resposta.wsgi_request.desempenho.consultas, consultas)
+
+    def test_sem_amostragem_nao_ha_cabecalho(self):
+        with self.settings(PERF_SAMPLE_RATE=0):
+            resposta = self.client.get(reverse('aluno-list'))
+        self.assertNotIn('Server-Timing', resposta)
+        # A contagem de consultas continua, para o log de lentas
+        self.assertGreater(resposta.wsgi_request.desempenho.consultas, 0)
+        self.assertEqual(resposta.wsgi_request.desempenho.template_ms, 0)
+
+    def test_requisicao_lenta_vai_para_o_log_com_o_sql(self):
+        with self.settings(PERF_SAMPLE_RATE=0, PERF_SLOW_REQUEST_MS=0), \
+                self.assertLogs('ct_gouveia.desempenho', 'WARNING') as logs:
+            self.client.get(reverse('aluno-list'))
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('Requisição lenta: GET /alunos/', logs.output[0])
+        self.assertIn('FROM "alunos_aluno"', logs.output[0])
+
+    def test_guarda_so_as_consultas_mais_lentas(self):
+        from unittest import mock
+        from ct_gouveia.middleware import CONSULTAS_NO_LOG, Medicao
+
+        # Consultas de 0 a 99 ms, fora de ordem: o relógio marca início (0) e fim de cada uma
+        duracoes = [(i * 37 % 100) / 1000 for i in range(100)]
+        relogio = iter([t for duracao in duracoes for t in (0, duracao)])
+        medicao = Medicao(amostrada=False)
+        with mock.patch('ct_gouveia.middleware.time.perf_counter', side_effect=lambda: next(relogio)):
+            for i in range(100):
+                medicao(lambda *args: None, f'SELECT {i}', None, False, None)
+        self.assertEqual(medicao.consultas, 100)
+        self.assertEqual(len(medicao.sql), CONSULTAS_NO_LOG)
+        self.assertEqual(sorted(round(duracao) for duracao, _, _ in medicao.sql), list(range(80, 100)))
+
+
+class MetricasTests(CacheLimpoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        import tempfile
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        self.pasta = pasta.name
+        configuracao = self.settings(METRICS_DIR=self.pasta, METRICS_TOKEN='segredo')
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.professor = User.objects.create_user('professor', password='senha', is_staff=True)
+        self.professor.profile.accepted_terms_at = timezone.now()
+        self.professor.profile.save()
+
+    def series(self):
+        resposta = self.client.get(reverse('metricas'), HTTP_AUTHORIZATION='Bearer segredo')
+        self.assertEqual(resposta.status_code, 200)
+        linhas = [linha for linha in resposta.content.decode().splitlines() if not linha.startswith('#')]
+        return {serie: float(valor) for serie, valor in (linha.rsplit(' ', 1) for linha in linhas)}
+
+    def test_contadores_e_histogramas_por_rota(self):
+        antes = self.series()
+        self.client.force_login(self.professor)
+        for _ in range(2):
+            self.client.get(reverse('aluno-list'))
+        depois = self.series()
+
+        def delta(serie):
+            return depois.get(serie, 0) - antes.get(serie, 0)
+
+        self.assertEqual(delta('bel_requisicoes_total{rota="aluno-list",metodo="GET",status="200"}'), 2)
+        self.assertEqual(delta('bel_requisicao_segundos_count{rota="aluno-list"}'), 2)
+        self.assertEqual(delta('bel_requisicao_segundos_bucket{rota="aluno-list",le="+Inf"}'), 2)
+        self.assertEqual(delta('bel_consultas_por_requisicao_count{rota="aluno-list"}'), 2)
+        self.assertGreater(delta('bel_consultas_por_requisicao_sum{rota="aluno-list"}'), 0)
+
+    def test_soma_os_arquivos_de_outros_workers(self):
+        from ct_gouveia import metricas
+
+        antes = self.series()
+        serie = 'bel_requisicoes_total{rota="aluno-list",metodo="GET",status="200"}'
+        with open(os.path.join(self.pasta, '99999-outro.json'), 'w', encoding='utf-8') as arquivo:
+            json.dump({serie: 5, 'bel_cache_total{cache="outro_worker",resultado="acerto"}': 3}, arquivo)
+        metricas.registrar_cache('outro_worker', acerto=False)
+        depois = self.series()
+        self.assertEqual(depois[serie] - antes.get(serie, 0), 5)
+        self.assertEqual(depois['bel_cache_taxa_acerto{cache="outro_worker"}'], 0.75)
+
+    def test_arquivos_de_workers_encerrados_viram_um_so(self):
+        from unittest import mock
+        from ct_gouveia import metricas
+
+        serie = 'bel_requisicoes_total{rota="aluno-list",metodo="GET",status="200"}'
+        for pid in (4001, 4002, 4003):
+            with open(os.path.join(self.pasta, f'{pid}-abcd1234.json'), 'w', encoding='utf-8') as arquivo:
+                json.dump({serie: 2}, arquivo)
+        # 4001 e 4002 já saíram (ex.: reciclados por max_requests); 4003 segue vivo
+        with mock.patch.object(metricas, '_processo_vivo', side_effect=lambda pid: pid == 4003):
+            with mock.patch.object(metricas, 'compactar'):
+                antes = self.series()
+            depois = self.series()
+            self.assertEqual(depois[serie], antes[serie])
+            arquivos = sorted(os.listdir(self.pasta))
+            self.assertIn(metricas.ARQUIVO_ENCERRADOS, arquivos)
+            self.assertIn('4003-abcd1234.json', arquivos)
+            self.assertNotIn('4001-abcd1234.json', arquivos)
+            self.assertNotIn('4002-abcd1234.json', arquivos)
+            # Coletas seguintes não somam os encerrados de novo
+            self.assertEqual(self.series()[serie], antes[serie])
+
+            # O worker que sai incorpora o próprio arquivo na saída
+            metricas.registrar_cache('saindo', acerto=True)
+            proprio = [nome for nome in os.listdir(self.pasta) if nome.startswith(f'{os.getpid()}-')]
+            metricas.registro.encerrar()
+            self.assertFalse(os.path.exists(os.path.join(self.pasta, proprio[0])))
+            self.assertEqual(self.series()['bel_cache_total{cache="saindo",resultado="acerto"}'], 1)
+
+    def test_acesso_restrito(self):
+        self.assertEqual(self.client.get(reverse('metricas')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metricas'), HTTP_AUTHORIZATION='Bearer errado').status_code, 403)
+        self.client.force_login(self.professor)
+        self.assertEqual(self.client.get(reverse('metricas')).status_code, 403)
+        self.professor.is_superuser = True
+        self.professor.save()
+        self.assertEqual(self.client.get(reverse('metricas')).status_code, 200)
+
+
+class SaudeTests(CacheLimpoTestCase):
+
+    def test_vivo_sem_banco_sessao_nem_template(self):
+        with CaptureQueriesContext(connection) as capturadas:
+            # Host fora de ALLOWED_HOSTS, como o IP interno da sonda do Render
+            resposta = self.client.get('/healthz/', HTTP_HOST='10.0.0.7')
+        self.assertEqual((resposta.status_code, resposta.json()), (200, {'status': 'ok'}))
+        self.assertEqual(capturadas.captured_queries, [])
+        self.assertEqual(resposta.templates, [])
+        self.assertNotIn('Set-Cookie', resposta.headers)
+        self.assertNotIn('Server-Timing', resposta.headers)
+
+    def test_pronto_consulta_o_banco_uma_vez_por_intervalo(self):
+        with CaptureQueriesContext(connection) as capturadas:
+            primeira = self.client.get('/readyz/', HTTP_HOST='10.0.0.7')
+        self.assertEqual(primeira.status_code, 200)
+        self.assertEqual(primeira.json()['status'], 'ok')
+        self.assertEqual(primeira['Cache-Control'], 'no-store')
+        self.assertIn('SELECT 1', [q['sql'] for q in capturadas.captured_queries])
+        # As sondas seguintes, dentro do intervalo, respondem com o último resultado
+        with CaptureQueriesContext(connection) as capturadas:
+            segunda = self.client.get('/readyz')
+        self.assertEqual(capturadas.captured_queries, [])
+        self.assertEqual(segunda.json()['banco_ms'], primeira.json()['banco_ms'])
+
+        # Com intervalo zero, cada sonda consulta o banco (as migrações já foram conferidas)
+        with self.settings(SAUDE_INTERVALO=0, SAUDE_BANCO_LENTO_MS=0):
+            with CaptureQueriesContext(connection) as capturadas:
+                resposta = self.client.get('/readyz/')
+        self.assertEqual([q['sql'] for q in capturadas.captured_queries], ['SELECT 1'])
+        self.assertEqual((resposta.status_code, resposta.json()['status']), (200, 'degradado'))
+
+    def test_pronto_indisponivel_sem_banco_ou_com_migracao_pendente(self):
+        from unittest import mock
+        from django.db import OperationalError
+        from ct_gouveia import saude
+
+        with mock.patch.object(saude, 'migracoes_pendentes', return_value=1):
+            resposta = self.client.get('/readyz/')
+        self.assertEqual(resposta.status_code, 503)
+        self.assertEqual(resposta.json()['erro'], 'migracoes_pendentes')
+
+        with self.settings(SAUDE_INTERVALO=0), \
+                mock.patch.object(connection, 'cursor', side_effect=OperationalError('sem conexão')):
+            resposta = self.client.get('/readyz/')
+        self.assertEqual(resposta.status_code, 503)
+        self.assertEqual((resposta.json()['status'], resposta.json()['erro']), ('indisponivel', 'OperationalError'))
+
+
+class PerfilGunicornTests(CacheLimpoTestCase):
+    def test_aquecimento_das_rotas_e_templates_e_conferencia_do_banco(self):
+        from unittest import mock
+        from ct_gouveia import aquecimento
+
+        self.assertGreater(aquecimento.aquecer_rotas(), 0)
+        contagens = aquecimento.aquecer_master()
+        self.assertGreater(contagens['templates'], 0)
+        # Só os templates do projeto, não os do admin e de outros pacotes instalados
+        pastas = list(aquecimento._pastas_de_templates_do_projeto())
+        self.assertTrue(pastas)
+        self.assertFalse([p for p in pastas if 'site-packages' in p])
+        # Fechar a conexão de verdade desfaria a transação do teste
+        with mock.patch.object(connection, 'close') as fechar:
+            self.assertIsInstance(aquecimento.conferir_banco(), float)
+        fechar.assert_called_once_with()
+
+    def test_configuracao_com_preload_e_reciclagem_escalonada(self):
+        import runpy
+        from unittest import mock
+        from django.conf import settings
 
-# Create your tests here.
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '3', 'GUNICORN_THREADS': '8'}):
+            perfil = runpy.run_path(os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'))
+        self.assertTrue(perfil['preload_app'])
+        self.assertEqual((perfil['worker_class'], perfil['workers'], perfil['threads']), ('gthread', 3, 8))
+        self.assertGreater(perfil['max_requests_jitter'], 0)
+        for hook in ('when_ready', 'post_worker_init', 'pre_request', 'worker_exit'):
+            self.assertTrue(callable(perfil[hook]), hook)
@@ -9,9 +9,13 @@ urlpatterns = [
     path('aluno/termos/', views.aluno_termos, name='aluno-termos'),
     path('', views.AlunoListView.as_view(), name='aluno-list'),
     path('novo/', views.AlunoCreateView.as_view(), name='aluno-create'),
+    path('importar/', views.importar_alunos, name='importar-alunos'),
+    path('tarefas/<int:pk>/', views.tarefa_view, name='tarefa'),
+    path('tarefas/<int:pk>/progresso/', views.tarefa_progresso, name='tarefa-progresso'),
     path('editar/<int:pk>/', views.AlunoUpdateView.as_view(), name='aluno-update'),
     path('mensalidades/', views.MensalidadeListView.as_view(), name='mensalidade-list'),
     path('mensalidades/registrar-pagamento/<int:pk>/', views.registrar_pagamento, name='registrar-pagamento'),
+    path('mensalidades/lote/', views.mensalidades_em_lote, name='mensalidades-em-lote'),
     path('mensalidades/gerar/', views.gerar_mensalidades, name='gerar-mensalidades'),
     path('mensalidades/excluir/<int:pk>/', views.excluir_mensalidade, name='excluir-mensalidade'),
     path('mensalidades/editar-mensalidade/<int:pk>/', views.editar_mensalidade, name='editar-mensalidade'),
@@ -21,4 +25,6 @@ urlpatterns = [
     path('update-theme/', views.update_theme, name='update-theme'),
     path('relatorios/mensal/', views.relatorio_mensal, name='relatorio-mensal'),
     path('presencas/', views.presencas_view, name='presencas'),
+    path('presencas/chamada/', views.chamada_view, name='chamada'),
+    path('exportar/<str:tipo>/', views.exportar, name='exportar'),
 ] 
\ No newline at end of file
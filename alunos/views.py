@@ -1,19 +1,31 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
-from django.urls import reverse_lazy
-from .models import Aluno, Mensalidade, Pagamento
+from django.urls import reverse, reverse_lazy
+from django.utils.dateparse import parse_date
+from .models import Aluno, Mensalidade, Pagamento, Tarefa
 from django.utils import timezone
 from datetime import timedelta
 from django.db.models import Q, OuterRef, Subquery, Max, Case, When, Value, F, CharField, Count
 from django.db import transaction
-from .forms import GerarMensalidadeForm, AlunoForm, SignUpForm, ProfileForm, PresencaForm
+from .forms import GerarMensalidadeForm, AlunoForm, ImportacaoAlunosForm, MensalidadesEmLoteForm, PagamentoForm, SignUpForm, ProfileForm, PresencaForm
+from .busca import buscar_alunos
+from .faturamento import carregar_mensalidades, faturar_na_fila, gerar_mensalidades_em_massa, mensalidades_atuais
+from .paginacao import PaginacaoKeysetMixin, paginar_keyset, quer_fragmento, resposta_fragmento
+from . import cache_academia, exportacao, frequencia, importacao, lote, pagamentos, receitas, tarefas
+from .chamada import alunos_da_chamada, registrar_chamada
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth import login as auth_login
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 import calendar
-from django.http import JsonResponse
+import hashlib
+import os
+import re
+import uuid
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.text import compress_sequence
 import json
 from django.contrib.auth.decorators import login_required
 from decimal import Decimal
@@ -32,25 +44,26 @@ def professor_required(view_func):
 
 
 @method_decorator(user_passes_test(is_professor, login_url='role-select'), name='dispatch')
-class AlunoListView(LoginRequiredMixin, ListView):
+class AlunoListView(LoginRequiredMixin, PaginacaoKeysetMixin, ListView):
     model = Aluno
     template_name = 'alunos/aluno_list.html'
+    template_linhas = 'alunos/_aluno_linhas.html'
     context_object_name = 'alunos'
+    ordenacao_keyset = ('nome', 'pk')
+    cache_nome = 'alunos'
+
+    def usa_keyset(self):
+        # A relevância da busca não é uma chave estável; os resultados usam páginas numeradas
+        return not self.request.GET.get('search', '').strip()
 
     def get_queryset(self):
-        queryset = super().get_queryset().filter(owner=self.request.user)
-        search_query = self.request.GET.get('search', '')
-        if search_query:
-            queryset = queryset.filter(
-                Q(nome__icontains=search_query) |
-                Q(telefone__icontains=search_query) |
-                Q(email__icontains=search_query)
-            )
-        return queryset
+        # Busca indexada (sem acentos, telefone sem máscara), ordenada por relevância
+        return buscar_alunos(self.request.user, self.request.GET.get('search', ''))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['search_query'] = self.request.GET.get('search', '')
+        context['paginacao_keyset'] = self.usa_keyset()
         return context
 
 @method_decorator(user_passes_test(is_professor, login_url='role-select'), name='dispatch')
@@ -63,7 +76,9 @@ class AlunoCreateView(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         form.instance.owner = self.request.user
         messages.success(self.request, 'Aluno cadastrado com sucesso!')
-        return super().form_valid(form)
+        resposta = super().form_valid(form)
+        cache_academia.invalidar(self.request.user.pk)
+        return resposta
 
 @method_decorator(user_passes_test(is_professor, login_url='role-select'), name='dispatch')
 class AlunoUpdateView(LoginRequiredMixin, UpdateView):
@@ -77,65 +92,156 @@ class AlunoUpdateView(LoginRequiredMixin, UpdateView):
 
     def form_valid(self, form):
         messages.success(self.request, 'Dados do aluno atualizados com sucesso!')
-        return super().form_valid(form)
+        resposta = super().form_valid(form)
+        cache_academia.invalidar(self.request.user.pk)
+        return resposta
+
+@professor_required
+def importar_alunos(request):
+    """Cadastra alunos a partir de uma planilha CSV, com relatório dos erros por linha (ver importacao.py)."""
+    resultado = None
+    if request.method == 'POST':
+        form = ImportacaoAlunosForm(request.POST, request.FILES)
+        if form.is_valid():
+            arquivo, simular = form.cleaned_data['arquivo'], form.cleaned_data['simular']
+            try:
+                linhas = importacao.contar_linhas(arquivo)
+                if linhas > importacao.LIMITE_LINHAS:
+                    # Planilha grande: segue na fila, e a página da tarefa mostra o andamento
+                    tarefa = tarefas.enfileirar(
+                        'importar_alunos', owner=request.user, parametros={'simular': simular}, anexo=arquivo.read(),
+                    )
+                    messages.info(request, f'A planilha tem {linhas} linhas e será importada em segundo plano.')
+                    return redirect('tarefa', pk=tarefa.pk)
+                resultado = importacao.importar_alunos(request.user, arquivo, simular=simular)
+            except importacao.ErroDeImportacao as erro:
+                form.add_error('arquivo', str(erro))
+            else:
+                if not simular and not resultado.total_erros:
+                    messages.success(request, f'{resultado.importados} aluno(s) importado(s) com sucesso!')
+                    return redirect('aluno-list')
+    else:
+        form = ImportacaoAlunosForm()
+    return render(request, 'alunos/importar_alunos.html', {'form': form, 'resultado': resultado})
+
+def _tarefa_do_professor(request, pk):
+    return get_object_or_404(Tarefa.objects.defer('anexo'), pk=pk, owner=request.user)
+
+@professor_required
+def tarefa_view(request, pk):
+    """Andamento e resultado de uma tarefa da fila; a página consulta `tarefa-progresso` até ela terminar."""
+    return render(request, 'alunos/tarefa.html', {'tarefa': _tarefa_do_professor(request, pk)})
+
+@professor_required
+def tarefa_progresso(request, pk):
+    tarefa = _tarefa_do_professor(request, pk)
+    return JsonResponse({
+        'status': tarefa.status,
+        'status_display': tarefa.get_status_display(),
+        'terminada': tarefa.terminada,
+        'percentual': tarefa.percentual,
+        'progresso_atual': tarefa.progresso_atual,
+        'progresso_total': tarefa.progresso_total,
+        'mensagem': tarefa.mensagem,
+    })
 
 @method_decorator(user_passes_test(is_professor, login_url='role-select'), name='dispatch')
-class MensalidadeListView(LoginRequiredMixin, ListView):
+class MensalidadeListView(LoginRequiredMixin, PaginacaoKeysetMixin, ListView):
     model = Mensalidade
     template_name = 'alunos/mensalidade_list.html'
+    template_linhas = 'alunos/_mensalidade_linhas.html'
     context_object_name = 'mensalidades'
+    ordenacao_keyset = ('nome', 'pk')
+    cache_nome = 'mensalidades'
 
     def get_queryset(self):
-        # Buscar todas as mensalidades ativas (não excluídas)
-        # Como não temos um campo de exclusão lógica, buscar todas e filtrar no context
-        return Mensalidade.objects.filter(aluno__owner=self.request.user).order_by('aluno', '-data_vencimento') # Ordena por aluno e data decrescente
+        # Mensalidade atual de cada aluno (vencida mais recente ou próxima a vencer),
+        # escolhida no banco; a paginação (por cursor) percorre os alunos
+        return mensalidades_atuais(self.request.user, timezone.localdate())
+
+    def montar_pagina(self, queryset, page_size):
+        # Carrega apenas as linhas da página, já com aluno e status de exibição
+        pagina = super().montar_pagina(queryset, page_size)
+        pagina.object_list = carregar_mensalidades(list(pagina.object_list), timezone.localdate())
+        return pagina
+
+    def chave_cache(self):
+        # O status exibido (atrasada, vence hoje...) depende da data
+        return f'{super().chave_cache()}:{timezone.localdate()}'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        hoje = timezone.localdate()
-        mensalidades_por_aluno = {}
-        ultima_por_aluno = {}
-        for m in context['mensalidades']:
-            ultima_por_aluno[m.aluno] = m
-            if m.data_vencimento <= hoje and m.aluno not in mensalidades_por_aluno:
-                status_exibicao = m.status
-                if status_exibicao == 'PENDENTE' and m.data_vencimento < hoje:
-                    status_exibicao = 'ATRASADO'
-                mensalidades_por_aluno[m.aluno] = {
-                    'mensalidade': m,
-                    'status_exibicao': status_exibicao
-                }
-
-        for aluno, m in ultima_por_aluno.items():
-            if aluno not in mensalidades_por_aluno:
-                mensalidades_por_aluno[aluno] = {
-                    'mensalidade': m,
-                    'status_exibicao': m.status
-                }
-
-        context['mensalidades'] = [item['mensalidade'] for item in mensalidades_por_aluno.values()]
-        context['mensalidades_com_status'] = mensalidades_por_aluno.values()
+        # Base das chaves de idempotência dos botões de pagamento (uma por exibição da página)
+        context['chave_pagamento'] = uuid.uuid4().hex
+        context['form_lote'] = MensalidadesEmLoteForm()
         return context
 
 @professor_required
 def registrar_pagamento(request, pk):
     if request.method == 'POST':
-        try:
-            mensalidade = get_object_or_404(Mensalidade, pk=pk, aluno__owner=request.user)
-            if mensalidade.status != 'PAGO':
-                with transaction.atomic():
-                    mensalidade.status = 'PAGO'
-                    mensalidade.data_pagamento = timezone.localdate()
-                    mensalidade.save()
-
-                messages.success(request, 'Pagamento registrado com sucesso!')
+        # O botão da lista envia só a chave: quita o saldo na data de hoje
+        form = PagamentoForm(request.POST)
+        if form.is_valid():
+            try:
+                lancamento = pagamentos.registrar_pagamento(
+                    request.user, pk,
+                    valor=form.cleaned_data['valor'],
+                    metodo=form.cleaned_data['metodo_pagamento'],
+                    data=form.cleaned_data['data_pagamento'],
+                    chave=form.cleaned_data['chave'],
+                )
+            except Mensalidade.DoesNotExist:
+                raise Http404('Mensalidade não encontrada.')
+            except pagamentos.ErroDePagamento as e:
+                messages.warning(request, str(e))
                 return redirect('mensalidade-list')
+            # Um reenvio recebe a mesma resposta do pedido original
+            if lancamento.quitada:
+                messages.success(request, 'Pagamento registrado com sucesso!')
             else:
-                messages.warning(request, 'Esta mensalidade já foi paga.')
-                return redirect('mensalidade-list')
-        except Exception as e:
-            messages.error(request, f'Erro ao registrar pagamento: {str(e)}')
+                messages.success(request, f'Pagamento parcial registrado. Saldo em aberto: R$ {lancamento.saldo}.')
+            return redirect('mensalidade-list')
+        mensalidade = get_object_or_404(Mensalidade.objects.select_related('aluno'), pk=pk, aluno__owner=request.user)
+    else:
+        mensalidade = get_object_or_404(Mensalidade.objects.select_related('aluno'), pk=pk, aluno__owner=request.user)
+        if mensalidade.pago:
+            messages.warning(request, 'Esta mensalidade já foi paga.')
             return redirect('mensalidade-list')
+        form = PagamentoForm(initial={
+            'valor': mensalidade.saldo, 'data_pagamento': timezone.localdate(), 'chave': uuid.uuid4().hex,
+        })
+    return render(request, 'alunos/registrar_pagamento.html', {'form': form, 'mensalidade': mensalidade})
+
+@professor_required
+def mensalidades_em_lote(request):
+    """Marca como pagas, exclui ou adia as mensalidades selecionadas na lista, de uma vez."""
+    if request.method != 'POST':
+        return redirect('mensalidade-list')
+    form = MensalidadesEmLoteForm(request.POST)
+    try:
+        ids = [int(pk) for pk in request.POST.getlist('mensalidades')]
+    except ValueError:
+        ids = []
+    if not ids:
+        messages.warning(request, 'Selecione ao menos uma mensalidade.')
+        return redirect('mensalidade-list')
+    if not form.is_valid():
+        messages.error(request, ' '.join(erro for erros in form.errors.values() for erro in erros))
+        return redirect('mensalidade-list')
+
+    # Só as do professor logado; as demais são ignoradas
+    selecionadas = lote.do_owner(request.user, ids)
+    acao = form.cleaned_data['acao']
+    if acao == 'quitar':
+        total = lote.quitar(selecionadas, form.cleaned_data['data_pagamento'], form.cleaned_data['metodo_pagamento'])
+        messages.success(request, f'{total} mensalidade(s) marcada(s) como paga(s).')
+    elif acao == 'excluir':
+        total = lote.excluir(selecionadas)
+        messages.success(request, f'{total} mensalidade(s) excluída(s).')
+    else:
+        dias = form.cleaned_data['dias']
+        total = lote.adiar(selecionadas, dias)
+        messages.success(request, f'Vencimento de {total} mensalidade(s) movido em {dias} dia(s).')
     return redirect('mensalidade-list')
 
 @professor_required
@@ -145,35 +251,27 @@ def gerar_mensalidades(request):
         if 'aluno' in request.POST:
             form = GerarMensalidadeForm(request.POST, user=request.user)
             if form.is_valid():
-                form.save()
+                with transaction.atomic():
+                    form.save()
+                    pagamentos.registrar_alteracao(None, pagamentos.pendencia(form.instance))
+                    cache_academia.invalidar(request.user.pk)
                 messages.success(request, 'Mensalidade criada com sucesso!')
                 return redirect('mensalidade-list')
             else:
                 return render(request, 'alunos/gerar_mensalidade.html', {'form': form})
 
-        # Geração em massa
-        alunos_ativos = Aluno.objects.filter(ativo=True, owner=request.user)
+        # Geração em massa; academias grandes seguem na fila, e a página da tarefa mostra o andamento
         hoje = timezone.localdate()
-        primeiro_dia_proximo_mes = (hoje.replace(day=1) + timedelta(days=32)).replace(day=1)
-
-        mensalidades_geradas_count = 0
-        for aluno in alunos_ativos:
-            mensalidade_pendente_existente = Mensalidade.objects.filter(
-                aluno=aluno,
-                status='PENDENTE'
-            ).exists()
-
-            if not mensalidade_pendente_existente:
-                Mensalidade.objects.create(
-                    aluno=aluno,
-                    data_vencimento=primeiro_dia_proximo_mes,
-                    valor=100.00 if aluno.bolsista else 150.00,
-                    status='PENDENTE'
-                )
-                mensalidades_geradas_count += 1
-
-        if mensalidades_geradas_count > 0:
-            messages.success(request, f'{mensalidades_geradas_count} mensalidade(s) gerada(s) com sucesso para alunos ativos sem pendências!')
+        if faturar_na_fila(request.user, hoje):
+            tarefa = tarefas.enfileirar('gerar_mensalidades', owner=request.user)
+            messages.info(request, 'As mensalidades serão geradas em segundo plano.')
+            return redirect('tarefa', pk=tarefa.pk)
+        resultado = gerar_mensalidades_em_massa(request.user, hoje)
+        if resultado.criadas > 0:
+            cache_academia.invalidar(request.user.pk)
+
+        if resultado.criadas > 0:
+            messages.success(request, f'{resultado.criadas} mensalidade(s) gerada(s) com sucesso para alunos ativos sem pendências! ({resultado.duracao_ms:.0f} ms)')
         else:
             messages.info(request, 'Nenhuma mensalidade nova gerada. Todos os alunos ativos já possuem mensalidade pendente.')
 
@@ -189,8 +287,14 @@ def excluir_mensalidade(request, pk):
     if request.method == 'POST':
         try:
             with transaction.atomic():
-                mensalidade = get_object_or_404(Mensalidade, id=pk, aluno__owner=request.user)
+                mensalidade = get_object_or_404(Mensalidade.objects.select_related('aluno'), id=pk, aluno__owner=request.user)
+                antes = receitas.contribuicao(mensalidade)
+                cache_academia.invalidar(request.user.pk)
+                # Os pagamentos (livro) vão junto com a mensalidade
+                pagamentos.descartar_relatorios([mensalidade])
+                pagamentos.registrar_alteracao(pagamentos.pendencia(mensalidade), None)
                 mensalidade.delete()
+                receitas.registrar_alteracao(antes, None)
             messages.success(request, 'Mensalidade excluída com sucesso!')
         except Mensalidade.DoesNotExist:
             messages.error(request, 'Mensalidade não encontrada.')
@@ -200,11 +304,18 @@ def excluir_mensalidade(request, pk):
 
 @professor_required
 def editar_mensalidade(request, pk):
-    mensalidade = get_object_or_404(Mensalidade, pk=pk, aluno__owner=request.user)
+    mensalidade = get_object_or_404(Mensalidade.objects.select_related('aluno'), pk=pk, aluno__owner=request.user)
     if request.method == 'POST':
+        # A validação do form já altera a instância: a contribuição anterior é lida antes
+        antes = receitas.contribuicao(mensalidade)
+        pendencia = pagamentos.pendencia(mensalidade)
         form = GerarMensalidadeForm(request.POST, instance=mensalidade, user=request.user)
         if form.is_valid():
-            form.save()
+            with transaction.atomic():
+                form.save()
+                receitas.registrar_alteracao(antes, receitas.contribuicao(form.instance))
+                pagamentos.registrar_alteracao(pendencia, pagamentos.pendencia(form.instance))
+                cache_academia.invalidar(request.user.pk)
             messages.success(request, 'Mensalidade alterada com sucesso!')
             return redirect('mensalidade-list')
     else:
@@ -323,11 +434,15 @@ def relatorio_mensal(request):
     """Relatório A4 imprimível de receitas do mês por mensalidades pagas."""
     # Determina mês/ano selecionados (padrão: mês atual em timezone local)
     hoje = timezone.localdate()
+    anos = list(range(hoje.year - 5, hoje.year + 1))
     try:
         mes = int(request.GET.get('mes', hoje.month))
         ano = int(request.GET.get('ano', hoje.year))
     except ValueError:
         mes, ano = hoje.month, hoje.year
+    # Só os anos do seletor: um mês encerrado é gravado na primeira exibição
+    if ano not in anos or not 1 <= mes <= 12:
+        mes, ano = hoje.month, hoje.year
 
     # Início e fim do mês
     inicio = hoje.replace(year=ano, month=mes, day=1)
@@ -335,52 +450,49 @@ def relatorio_mensal(request):
     ultimo_dia = calendar.monthrange(ano, mes)[1]
     fim = hoje.replace(year=ano, month=mes, day=ultimo_dia)
 
-    # Filtra mensalidades pagas do usuário no período
-    mensalidades_pagas = (
-        Mensalidade.objects
-        .filter(
-            aluno__owner=request.user,
-            status='PAGO',
-            data_pagamento__isnull=False,
-            data_pagamento__gte=inicio,
-            data_pagamento__lte=fim,
+    # Totais, série diária do gráfico e lista detalhada: meses encerrados vêm do relatório
+    # gravado (com ETag); o mês em aberto, do cache da academia
+    etag = None
+    if receitas.mes_encerrado(inicio):
+        relatorio = receitas.relatorio_encerrado(request.user, inicio)
+        dados = relatorio.dados
+        # A página também depende do tema, dos anos do seletor e da versão publicada
+        versao = f'{relatorio.etag}:{request.user.profile.dark_mode}:{hoje.year}:{os.environ.get("RENDER_GIT_COMMIT", "")}'
+        etag = '"%s"' % hashlib.sha256(versao.encode()).hexdigest()
+        # Com mensagens pendentes a página precisa ser renderizada para exibi-las
+        if not len(messages.get_messages(request)):
+            nao_modificado = get_conditional_response(request, etag=etag)
+            if nao_modificado is not None:
+                return _cache_do_relatorio(nao_modificado, etag)
+    else:
+        dados = cache_academia.obter(
+            request.user.pk, f'relatorio:{ano}-{mes:02d}', lambda: receitas.relatorio_do_mes(request.user, inicio, fim),
         )
-        .select_related('aluno')
-        .order_by('data_pagamento')
-    )
-
-    total_receita = sum((m.valor for m in mensalidades_pagas), Decimal('0'))
-    quantidade = mensalidades_pagas.count()
-
-    # Série por dia para o gráfico (construída no servidor para evitar problemas de locale/parse)
-    ultimo_dia = ultimo_dia = calendar.monthrange(ano, mes)[1]
-    chart_labels = list(range(1, ultimo_dia + 1))
-    chart_values = [0 for _ in chart_labels]
-    for m in mensalidades_pagas:
-        if m.data_pagamento:
-            chart_values[m.data_pagamento.day - 1] += float(m.valor)
 
     meses_pt = [
         '', 'Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho',
         'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro'
     ]
     meses = [{ 'num': i, 'nome': meses_pt[i] } for i in range(1, 12+1)]
-    anos = list(range(hoje.year - 5, hoje.year + 1))
 
     context = {
         'mes': mes,
         'ano': ano,
         'inicio': inicio,
         'fim': fim,
-        'mensalidades_pagas': mensalidades_pagas,
-        'total_receita': total_receita,
-        'quantidade': quantidade,
         'meses': meses,
         'anos': anos,
-        'chart_labels': chart_labels,
-        'chart_values': chart_values,
+        **receitas.contexto_do_relatorio(dados),
     }
-    return render(request, 'alunos/relatorio.html', context)
+    response = render(request, 'alunos/relatorio.html', context)
+    return _cache_do_relatorio(response, etag) if etag else response
+
+def _cache_do_relatorio(response, etag):
+    # Um mês encerrado ainda pode ser corrigido: o navegador guarda, mas revalida pelo ETag
+    # a cada exibição (304 sem corpo enquanto o relatório gravado não muda)
+    response.headers['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 @login_required
 def presencas_view(request):
@@ -393,30 +505,133 @@ def presencas_view(request):
             if aluno.owner != request.user:
                 messages.error(request, 'Aluno inválido.')
             else:
-                form.save()
+                with transaction.atomic():
+                    presenca = form.save()
+                    frequencia.atualizar_frequencias([aluno.pk], presenca.data)
+                    cache_academia.invalidar(request.user.pk)
                 messages.success(request, 'Presença registrada!')
                 return redirect('presencas')
     else:
         form = PresencaForm()
         form.fields['aluno'].queryset = Aluno.objects.filter(owner=request.user, ativo=True).order_by('nome')
 
-    # últimas 30 presenças do usuário
+    # Histórico paginado por cursor: a página N custa o mesmo que a primeira
     from .models import Presenca
-    presencas = Presenca.objects.filter(aluno__owner=request.user).select_related('aluno').order_by('-data', 'aluno__nome')[:30]
+    pagina = paginar_keyset(
+        Presenca.objects.filter(aluno__owner=request.user).select_related('aluno'),
+        ('-data', 'aluno__nome', 'pk'),
+        request.GET.get('cursor'),
+    )
+    if quer_fragmento(request):
+        return resposta_fragmento(request, 'alunos/_presenca_linhas.html', {'presencas': pagina.object_list}, pagina)
 
-    # Ranking do mês atual (mais frequentes)
+    # Ranking do mês atual e tendência dos últimos meses, lidos dos contadores mensais
     hoje = timezone.localdate()
-    inicio = hoje.replace(day=1)
-    fim_dia = calendar.monthrange(hoje.year, hoje.month)[1]
-    fim = hoje.replace(day=fim_dia)
-    ranking_qs = (
-        Presenca.objects
-        .filter(aluno__owner=request.user, presente=True, data__gte=inicio, data__lte=fim)
-        .values('aluno__nome')
-        .annotate(total=Count('id'))
-        .order_by('-total')[:10]
+    ranking, tendencia = cache_academia.obter(
+        request.user.pk, f'presencas:{hoje}',
+        lambda: (frequencia.ranking(request.user, hoje), frequencia.tendencia(request.user, hoje)),
     )
-    rank_labels = [r['aluno__nome'] for r in ranking_qs]
-    rank_values = [r['total'] for r in ranking_qs]
+    rank_labels = [nome for nome, _ in ranking]
+    rank_values = [total for _, total in ranking]
+    tendencia_labels = [f'{mes:%m/%Y}' for mes, _ in tendencia]
+    tendencia_values = [total for _, total in tendencia]
+
+    return render(request, 'alunos/presencas.html', {
+        'form': form, 'presencas': pagina.object_list, 'pagina': pagina,
+        'rank_labels': rank_labels, 'rank_values': rank_values,
+        'tendencia_labels': tendencia_labels, 'tendencia_values': tendencia_values,
+    })
+
+
+def _marcacoes_da_chamada(request):
+    """(data, {aluno_id: presente}) do POST: JSON do tablet da recepção ou formulário da chamada."""
+    if request.content_type == 'application/json':
+        dados = json.loads(request.body)
+        data = parse_date(dados['data']) if dados.get('data') else timezone.localdate()
+        marcacoes = {int(item['aluno']): bool(item.get('presente', True)) for item in dados.get('presencas', [])}
+    else:
+        data = parse_date(request.POST.get('data', ''))
+        presentes = {int(pk) for pk in request.POST.getlist('presentes')}
+        marcacoes = {int(pk): int(pk) in presentes for pk in request.POST.getlist('alunos')}
+    if data is None:
+        raise ValueError('Data inválida.')
+    return data, marcacoes
+
+@login_required
+def chamada_view(request):
+    """Chamada da turma: marca presença/ausência de todos os alunos ativos de um dia de uma vez.
+
+    Aceita também JSON ({"data": "AAAA-MM-DD", "presencas": [{"aluno": id, "presente": true}]}),
+    para o check-in em lotes pelo tablet da recepção.
+    """
+    if request.method == 'POST':
+        quer_json = request.content_type == 'application/json'
+        try:
+            data, marcacoes = _marcacoes_da_chamada(request)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            if quer_json:
+                return JsonResponse({'success': False, 'error': 'Chamada inválida.'}, status=400)
+            messages.error(request, 'Chamada inválida.')
+            return redirect('chamada')
+        with transaction.atomic():
+            gravadas, ignorados = registrar_chamada(request.user, data, marcacoes)
+            cache_academia.invalidar(request.user.pk)
+        if quer_json:
+            return JsonResponse({'success': True, 'data': data.isoformat(), 'gravadas': gravadas, 'ignorados': ignorados})
+        messages.success(request, f'Chamada de {data:%d/%m/%Y} salva: {gravadas} aluno(s).')
+        return redirect(f"{reverse('chamada')}?data={data.isoformat()}")
 
-    return render(request, 'alunos/presencas.html', { 'form': form, 'presencas': presencas, 'rank_labels': rank_labels, 'rank_values': rank_values })
\ No newline at end of file
+    try:
+        data = parse_date(request.GET.get('data', '')) or timezone.localdate()
+    except ValueError:
+        # Bem formada, mas inexistente (ex.: 2026-02-30)
+        data = timezone.localdate()
+    alunos = alunos_da_chamada(request.user, data)
+    return render(request, 'alunos/chamada.html', {'data': data, 'alunos': alunos})
+
+def _data_do_filtro(request, nome):
+    texto = request.GET.get(nome)
+    if not texto:
+        return None
+    data = parse_date(texto)
+    if data is None:
+        raise ValueError(nome)
+    return data
+
+@professor_required
+def exportar(request, tipo):
+    """Exporta alunos, mensalidades, pagamentos ou presenças do professor em CSV ou XLSX.
+
+    Filtros opcionais: ?inicio=AAAA-MM-DD&fim=AAAA-MM-DD (pela data principal de cada tipo)
+    e ?status= (ver exportacao.EXPORTACOES). O CSV sai comprimido se o cliente aceitar gzip.
+    """
+    definicao = exportacao.EXPORTACOES.get(tipo)
+    if definicao is None:
+        raise Http404
+    formato = request.GET.get('formato', 'csv')
+    status = request.GET.get('status', '')
+    try:
+        inicio = _data_do_filtro(request, 'inicio')
+        fim = _data_do_filtro(request, 'fim')
+    except ValueError:
+        return HttpResponseBadRequest('Data inválida.')
+    if formato not in ('csv', 'xlsx') or (status and status not in definicao.status):
+        return HttpResponseBadRequest('Formato ou status inválido.')
+
+    linhas = exportacao.linhas(definicao, request.user, inicio, fim, status)
+    nome = f'{tipo}-{timezone.localdate():%Y-%m-%d}.{formato}'
+    if formato == 'xlsx':
+        response = StreamingHttpResponse(
+            exportacao.xlsx_em_streaming(definicao.cabecalho, linhas),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
+    else:
+        conteudo = (pedaco.encode('utf-8') for pedaco in exportacao.csv_em_streaming(definicao.cabecalho, linhas))
+        response = StreamingHttpResponse(conteudo, content_type='text/csv; charset=utf-8')
+        # O XLSX já é um zip; só o CSV ganha com a compressão
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if re.search(r'\bgzip\b', request.headers.get('Accept-Encoding', '')):
+            response.streaming_content = compress_sequence(conteudo)
+            response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Content-Disposition'] = f'attachment; filename="{nome}"'
+    return response
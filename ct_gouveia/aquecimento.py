@@ -0,0 +1,71 @@
+"""Aquecimento do processo antes de receber tráfego, chamado pelos hooks do gunicorn.conf.py.
+
+No master (com `preload_app`), `aquecer_master` prepara o que sobrevive ao fork e é
+compartilhado pelos workers: as rotas resolvidas, os templates do projeto já compilados
+no cache do loader e o driver do banco importado (sem conectar). Em cada worker, depois
+do fork, `conferir_banco` só confere que o banco responde: com gthread as conexões são por
+thread, abertas na primeira requisição de cada uma e mantidas entre as seguintes por
+CONN_MAX_AGE.
+"""
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.template import engines
+from django.urls import get_resolver
+
+
+def aquecer_rotas():
+    """Monta as tabelas de resolução e reversão de URLs (e compila os regex). Devolve quantas rotas."""
+    return len(get_resolver().reverse_dict)
+
+
+def _pastas_de_templates_do_projeto():
+    base = os.path.realpath(settings.BASE_DIR)
+    for app in apps.get_app_configs():
+        caminho = os.path.realpath(app.path)
+        # Só os apps do projeto: o virtualenv pode estar dentro de BASE_DIR (ex.: .venv no Render)
+        if caminho.startswith(base + os.sep) and 'site-packages' not in caminho:
+            pasta = os.path.join(caminho, 'templates')
+            if os.path.isdir(pasta):
+                yield pasta
+
+
+def aquecer_templates():
+    """Compila os templates dos apps do projeto no cache do loader. Devolve quantos."""
+    motor = engines['django']
+    total = 0
+    for pasta in _pastas_de_templates_do_projeto():
+        for raiz, _, arquivos in os.walk(pasta):
+            for nome in arquivos:
+                if nome.endswith('.html'):
+                    motor.get_template(os.path.relpath(os.path.join(raiz, nome), pasta).replace(os.sep, '/'))
+                    total += 1
+    return total
+
+
+def conferir_banco(alias=DEFAULT_DB_ALIAS):
+    """Conecta e faz um SELECT 1; devolve o tempo em ms. Fecha a conexão ao final.
+
+    Não deixa nada aberto para as requisições (a conexão é da thread do hook); serve para o
+    log do worker acusar logo um banco fora do ar ou lento.
+    """
+    inicio = time.perf_counter()
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+    finally:
+        connections[alias].close()
+    return (time.perf_counter() - inicio) * 1000
+
+
+def aquecer_master():
+    """Rotas, templates e driver do banco, antes do fork. Devolve as contagens para o log."""
+    rotas = aquecer_rotas()
+    templates = aquecer_templates()
+    # Importa o backend (e o psycopg) sem abrir conexão: sockets não devem atravessar o fork
+    connections[DEFAULT_DB_ALIAS].vendor
+    return {'rotas': rotas, 'templates': templates}
@@ -0,0 +1,242 @@
+"""Métricas no formato texto do Prometheus, somadas entre os workers do gunicorn.
+
+Cada processo acumula seus contadores em memória e os grava de tempos em tempos num
+arquivo próprio em `METRICS_DIR` (gravação atômica com os.replace). O endpoint soma os
+arquivos de todos os processos, inclusive o dos workers já encerrados, para que os
+contadores nunca diminuam: como no modo multiprocesso do prometheus_client, o arquivo de
+um worker que saiu é somado a `encerrados.json` e apagado (na saída do worker ou, se ele
+morreu sem avisar, na próxima coleta), então a pasta não cresce com a reciclagem.
+"""
+import atexit
+import contextlib
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+try:
+    import fcntl
+except ImportError:  # Windows (desenvolvimento): os arquivos não são compactados
+    fcntl = None
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_CONSULTAS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+ARQUIVO_ENCERRADOS = 'encerrados.json'
+
+METRICAS = {
+    'bel_requisicoes_total': ('counter', 'Requisições atendidas, por rota, método e status.'),
+    'bel_requisicao_segundos': ('histogram', 'Tempo de resposta por rota, em segundos.'),
+    'bel_consultas_por_requisicao': ('histogram', 'Consultas SQL por requisição, por rota.'),
+    'bel_cache_total': ('counter', 'Leituras de cache, por cache e resultado (acerto ou falta).'),
+    'bel_cache_taxa_acerto': ('gauge', 'Fração das leituras de cache que acertaram, por cache.'),
+}
+
+
+def _rotulos(**rotulos):
+    return ','.join(f'{nome}="{valor}"' for nome, valor in rotulos.items())
+
+
+class Registro:
+    """Séries do processo atual, indexadas pelo texto da série (ex.: 'x_total{rota="a"}')."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _do_processo(self):
+        # Depois de um fork (gunicorn com preload) o filho começa do zero, com arquivo próprio
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.valores = defaultdict(float)
+            self.arquivo = f'{self.pid}-{uuid.uuid4().hex[:8]}.json'
+            self.gravado_em = time.monotonic()
+        return self.valores
+
+    def incrementar(self, serie, valor=1):
+        with self.lock:
+            self._do_processo()[serie] += valor
+            if time.monotonic() - self.gravado_em >= getattr(settings, 'METRICS_FLUSH_SECONDS', 5):
+                self._gravar()
+
+    def observar(self, nome, buckets, valor, rotulos):
+        with self.lock:
+            valores = self._do_processo()
+            for limite in buckets:
+                if valor <= limite:
+                    valores[f'{nome}_bucket{{{rotulos},le="{limite}"}}'] += 1
+            valores[f'{nome}_bucket{{{rotulos},le="+Inf"}}'] += 1
+            valores[f'{nome}_sum{{{rotulos}}}'] += valor
+            valores[f'{nome}_count{{{rotulos}}}'] += 1
+
+    def gravar(self):
+        with self.lock:
+            self._do_processo()
+            self._gravar()
+
+    def _gravar(self):
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        _gravar_json(os.path.join(settings.METRICS_DIR, self.arquivo), self.valores)
+        self.gravado_em = time.monotonic()
+
+    def encerrar(self):
+        """Na saída do processo: soma os contadores dele aos dos encerrados e apaga o arquivo."""
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            self._gravar()
+            with _pasta_travada() as travada:
+                if travada:
+                    _incorporar([os.path.join(settings.METRICS_DIR, self.arquivo)])
+            self.pid = None
+
+
+registro = Registro()
+atexit.register(registro.encerrar)
+
+
+def _gravar_json(destino, valores):
+    with open(destino + '.tmp', 'w', encoding='utf-8') as arquivo:
+        json.dump(valores, arquivo)
+    os.replace(destino + '.tmp', destino)
+
+
+def _ler_json(caminho):
+    try:
+        with open(caminho, encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except (OSError, ValueError):
+        return None
+
+
+@contextlib.contextmanager
+def _pasta_travada():
+    """Trava exclusiva da pasta de métricas entre processos; devolve False se não há como travar."""
+    if fcntl is None:
+        yield False
+        return
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    with open(os.path.join(settings.METRICS_DIR, '.trava'), 'a') as trava:
+        fcntl.flock(trava, fcntl.LOCK_EX)
+        try:
+            yield True
+        finally:
+            fcntl.flock(trava, fcntl.LOCK_UN)
+
+
+def _incorporar(caminhos):
+    """Soma os arquivos `caminhos` a `encerrados.json` e os apaga. Chamar com a pasta travada."""
+    if not caminhos:
+        return
+    destino = os.path.join(settings.METRICS_DIR, ARQUIVO_ENCERRADOS)
+    total = defaultdict(float, _ler_json(destino) or {})
+    for caminho in caminhos:
+        for serie, valor in (_ler_json(caminho) or {}).items():
+            total[serie] += valor
+    _gravar_json(destino, total)
+    for caminho in caminhos:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(caminho)
+
+
+def _processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def compactar():
+    """Incorpora os arquivos de processos que já não existem (ex.: worker morto pelo timeout)."""
+    with _pasta_travada() as travada:
+        if not travada:
+            return
+        mortos = []
+        for caminho in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+            pid = os.path.basename(caminho).split('-', 1)[0]
+            if pid.isdigit() and int(pid) != os.getpid() and not _processo_vivo(int(pid)):
+                mortos.append(caminho)
+        _incorporar(mortos)
+
+
+def observar_requisicao(request, response, medicao):
+    """Chamada pelo PerformanceMiddleware ao fim de cada requisição."""
+    rota = request.resolver_match.view_name if request.resolver_match else 'nao_resolvida'
+    registro.incrementar(f'bel_requisicoes_total{{{_rotulos(rota=rota, metodo=request.method, status=response.status_code)}}}')
+    rotulos = _rotulos(rota=rota)
+    registro.observar('bel_requisicao_segundos', BUCKETS_LATENCIA, medicao.total_ms / 1000, rotulos)
+    registro.observar('bel_consultas_por_requisicao', BUCKETS_CONSULTAS, medicao.consultas, rotulos)
+
+
+def registrar_cache(cache, acerto):
+    registro.incrementar(f'bel_cache_total{{{_rotulos(cache=cache, resultado="acerto" if acerto else "falta")}}}')
+
+
+def coletar():
+    """Soma das séries gravadas por todos os processos (o atual é gravado antes)."""
+    registro.gravar()
+    compactar()
+    total = defaultdict(float)
+    for caminho in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        for serie, valor in (_ler_json(caminho) or {}).items():
+            total[serie] += valor
+    return total
+
+
+def _familia(serie):
+    nome = serie.split('{', 1)[0]
+    for sufixo in ('_bucket', '_sum', '_count'):
+        if nome.endswith(sufixo) and nome[:-len(sufixo)] in METRICAS:
+            return nome[:-len(sufixo)]
+    return nome
+
+
+def _numero(valor):
+    return int(valor) if valor.is_integer() else valor
+
+
+def formatar(valores):
+    """Texto no formato de exposição do Prometheus (0.0.4)."""
+    valores = dict(valores)
+    acertos = defaultdict(lambda: [0.0, 0.0])
+    for serie, valor in valores.items():
+        if serie.startswith('bel_cache_total{'):
+            cache = serie.split('cache="', 1)[1].split('"', 1)[0]
+            acertos[cache][0 if 'resultado="acerto"' in serie else 1] += valor
+    for cache, (acerto, falta) in acertos.items():
+        valores[f'bel_cache_taxa_acerto{{{_rotulos(cache=cache)}}}'] = acerto / (acerto + falta)
+
+    por_familia = defaultdict(list)
+    for serie in sorted(valores):
+        por_familia[_familia(serie)].append(serie)
+    linhas = []
+    for familia, series in por_familia.items():
+        tipo, ajuda = METRICAS.get(familia, ('untyped', ''))
+        linhas += [f'# HELP {familia} {ajuda}', f'# TYPE {familia} {tipo}']
+        linhas += [f'{serie} {_numero(valores[serie])}' for serie in series]
+    return '\n'.join(linhas) + '\n'
+
+
+def _autorizado(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    cabecalho = request.headers.get('Authorization', '')
+    if token and hmac.compare_digest(cabecalho.encode(), f'Bearer {token}'.encode()):
+        return True
+    # Os professores são staff; as métricas somam todas as academias, então só superusuários
+    return request.user.is_authenticated and request.user.is_superuser
+
+
+def metricas_view(request):
+    """Endpoint para o Prometheus: superusuários logados ou `Authorization: Bearer <METRICS_TOKEN>`."""
+    if not _autorizado(request):
+        return HttpResponseForbidden('Acesso negado.')
+    return HttpResponse(formatar(coletar()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,133 @@
+"""Medição de desempenho por requisição: consultas SQL, renderização de templates e tempo total.
+
+Toda requisição conta consultas e tempo de SQL (um par de perf_counter por consulta) e
+guarda só as `CONSULTAS_NO_LOG` consultas mais lentas (num heap), para o log de lentas.
+A fração `PERF_SAMPLE_RATE` das requisições também mede templates e recebe o cabeçalho
+`Server-Timing`.
+"""
+import contextvars
+import functools
+import heapq
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metricas
+
+logger = logging.getLogger('ct_gouveia.desempenho')
+
+CONSULTAS_NO_LOG = 20
+
+_medicao_atual = contextvars.ContextVar('medicao_atual', default=None)
+
+
+class Medicao:
+    """Números de uma requisição. Também é o `execute_wrapper` das conexões durante ela."""
+
+    def __init__(self, amostrada):
+        self.amostrada = amostrada
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.sql_ms = 0.0
+        self.template_ms = 0.0
+        self.app_ms = 0.0
+        self.total_ms = 0.0
+        # Heap de (duração, ordem, sql) com as mais lentas; a menor fica no topo
+        self.sql = []
+        self._renderizando = False
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duracao = (time.perf_counter() - inicio) * 1000
+            self.consultas += 1
+            self.sql_ms += duracao
+            if len(self.sql) < CONSULTAS_NO_LOG:
+                heapq.heappush(self.sql, (duracao, self.consultas, sql))
+            elif duracao > self.sql[0][0]:
+                heapq.heapreplace(self.sql, (duracao, self.consultas, sql))
+
+    def server_timing(self):
+        return ', '.join([
+            f'db;dur={self.sql_ms:.1f};desc="{self.consultas} consultas"',
+            f'tpl;dur={self.template_ms:.1f}',
+            f'app;dur={self.app_ms:.1f}',
+            f'total;dur={self.total_ms:.1f}',
+        ])
+
+
+def medicao_atual():
+    """A medição da requisição em andamento nesta thread, ou None."""
+    return _medicao_atual.get()
+
+
+def _instrumentar_templates():
+    """Envolve `Template.render` do backend do Django para somar o tempo das requisições amostradas."""
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, 'medido', False):
+        return
+    original = Template.render
+
+    @functools.wraps(original)
+    def render(self, context=None, request=None):
+        medicao = _medicao_atual.get()
+        # Renderizações aninhadas (render_to_string dentro de outra) contam uma vez só
+        if medicao is None or not medicao.amostrada or medicao._renderizando:
+            return original(self, context, request)
+        medicao._renderizando = True
+        inicio = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            medicao.template_ms += (time.perf_counter() - inicio) * 1000
+            medicao._renderizando = False
+
+    render.medido = True
+    Template.render = render
+
+
+class PerformanceMiddleware:
+    """Deve ficar no topo de MIDDLEWARE para medir também os demais middlewares."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        _instrumentar_templates()
+
+    def __call__(self, request):
+        taxa = getattr(settings, 'PERF_SAMPLE_RATE', 1.0)
+        medicao = Medicao(amostrada=taxa >= 1 or random.random() < taxa)
+        request.desempenho = medicao
+        token = _medicao_atual.set(medicao)
+        try:
+            with ExitStack() as pilha:
+                for conexao in connections.all():
+                    pilha.enter_context(conexao.execute_wrapper(medicao))
+                inicio_app = time.perf_counter()
+                response = self.get_response(request)
+                medicao.app_ms = (time.perf_counter() - inicio_app) * 1000
+        finally:
+            _medicao_atual.reset(token)
+        medicao.total_ms = (time.perf_counter() - medicao.inicio) * 1000
+        metricas.observar_requisicao(request, response, medicao)
+
+        if medicao.amostrada and getattr(settings, 'PERF_SERVER_TIMING', True):
+            response['Server-Timing'] = medicao.server_timing()
+        if medicao.total_ms >= getattr(settings, 'PERF_SLOW_REQUEST_MS', 1000):
+            self.registrar_lenta(request, response, medicao)
+        return response
+
+    def registrar_lenta(self, request, response, medicao):
+        mais_lentas = sorted(medicao.sql, reverse=True)
+        linhas = [f'  {duracao:8.1f} ms  {sql}' for duracao, _, sql in mais_lentas]
+        logger.warning(
+            'Requisição lenta: %s %s -> %s em %.0f ms (SQL %.0f ms em %d consultas, templates %.0f ms)\n%s',
+            request.method, request.get_full_path(), response.status_code, medicao.total_ms,
+            medicao.sql_ms, medicao.consultas, medicao.template_ms, '\n'.join(linhas),
+        )
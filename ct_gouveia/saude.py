@@ -0,0 +1,91 @@
+"""Verificações de saúde para o balanceador do Render: `/healthz/` (vivo) e `/readyz/` (pronto).
+
+Respondidas pelo `SaudeMiddleware`, o primeiro de MIDDLEWARE: não passam por sessão,
+autenticação, CSRF, templates nem pelas métricas, e não validam o Host (a sonda usa o
+IP interno). A prontidão consulta o banco (SELECT 1) e confere se não há migrações
+pendentes, no máximo uma vez a cada `SAUDE_INTERVALO` segundos por processo; nas demais
+sondas devolve o último resultado, sem tocar o banco.
+"""
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.http import HttpResponse
+
+VIVO = frozenset({'/healthz', '/healthz/'})
+PRONTO = frozenset({'/readyz', '/readyz/'})
+
+
+def _resposta(dados, status=200):
+    resposta = HttpResponse(json.dumps(dados), content_type='application/json', status=status)
+    resposta['Cache-Control'] = 'no-store'
+    return resposta
+
+
+def migracoes_pendentes(conexao):
+    """Quantas migrações ainda não foram aplicadas no banco de `conexao`."""
+    from django.db.migrations.executor import MigrationExecutor
+
+    executor = MigrationExecutor(conexao)
+    return len(executor.migration_plan(executor.loader.graph.leaf_nodes()))
+
+
+class Prontidao:
+    """Último resultado da verificação do banco, renovado quando fica mais velho que o intervalo."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.resultado = None
+        self.verificado_em = None
+        self.migracoes_ok = False
+
+    def verificar(self):
+        conexao = connections[DEFAULT_DB_ALIAS]
+        inicio = time.perf_counter()
+        try:
+            with conexao.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            banco_ms = (time.perf_counter() - inicio) * 1000
+            # Migrações não voltam a ficar pendentes com o processo no ar: conferidas até passarem
+            if not self.migracoes_ok:
+                self.migracoes_ok = migracoes_pendentes(conexao) == 0
+        except DatabaseError as erro:
+            return {'status': 'indisponivel', 'erro': erro.__class__.__name__}
+        if not self.migracoes_ok:
+            return {'status': 'indisponivel', 'banco_ms': round(banco_ms, 1), 'erro': 'migracoes_pendentes'}
+        lento = banco_ms >= getattr(settings, 'SAUDE_BANCO_LENTO_MS', 100)
+        return {'status': 'degradado' if lento else 'ok', 'banco_ms': round(banco_ms, 1)}
+
+    def atual(self):
+        agora = time.monotonic()
+        intervalo = getattr(settings, 'SAUDE_INTERVALO', 5)
+        vencido = self.verificado_em is None or agora - self.verificado_em >= intervalo
+        # Só uma thread renova; as outras respondem com o resultado anterior enquanto isso
+        if vencido and self.lock.acquire(blocking=self.resultado is None):
+            try:
+                self.resultado = self.verificar()
+                self.verificado_em = time.monotonic()
+            finally:
+                self.lock.release()
+        return self.resultado, time.monotonic() - self.verificado_em
+
+
+class SaudeMiddleware:
+    """Deve ficar no topo de MIDDLEWARE, antes até do PerformanceMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prontidao = Prontidao()
+
+    def __call__(self, request):
+        if request.path in VIVO:
+            return _resposta({'status': 'ok'})
+        if request.path in PRONTO:
+            resultado, idade = self.prontidao.atual()
+            # Degradado continua recebendo tráfego; só o banco fora do ar ou sem migrar tira a instância
+            status = 503 if resultado['status'] == 'indisponivel' else 200
+            return _resposta({**resultado, 'verificado_ha_s': round(idade, 1)}, status)
+        return self.get_response(request)
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ct_gouveia.saude.SaudeMiddleware',
+    'ct_gouveia.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -97,6 +100,91 @@ else:
     DEBUG = True
     ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
 
+# Cache (alunos/cache_academia.py). Os workers do gunicorn precisam enxergar o mesmo cache
+# para que a invalidação valha para todos: Redis quando houver REDIS_URL, senão arquivos
+# em disco; a memória local só serve ao runserver, que é um processo só
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+elif 'RENDER' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(tempfile.gettempdir(), 'bel-cache'),
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# No Render o worker da fila de tarefas é outra instância: as invalidações feitas por ele só
+# chegam ao site pelo Redis. Sem REDIS_URL as páginas não são guardadas no cache das academias
+CACHE_ACADEMIA = bool(os.environ.get('REDIS_URL')) or 'RENDER' not in os.environ
+
+# Medição de desempenho (ct_gouveia/middleware.py): fração das requisições que recebe o
+# cabeçalho Server-Timing e o tempo de templates, e limite do log de requisições lentas
+PERF_SAMPLE_RATE = float(os.environ.get('PERF_SAMPLE_RATE', '0.1' if 'RENDER' in os.environ else '1'))
+PERF_SLOW_REQUEST_MS = float(os.environ.get('PERF_SLOW_REQUEST_MS', '1000'))
+
+# Métricas do Prometheus em /metrics/ (ct_gouveia/metricas.py): cada worker grava seus contadores
+# em METRICS_DIR a cada METRICS_FLUSH_SECONDS; METRICS_TOKEN libera o acesso sem login
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'bel-metricas'))
+METRICS_FLUSH_SECONDS = 5
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Sondas de saúde em /healthz/ e /readyz/ (ct_gouveia/saude.py): o banco é consultado no máximo
+# a cada SAUDE_INTERVALO segundos por processo; acima de SAUDE_BANCO_LENTO_MS a prontidão é "degradado"
+SAUDE_INTERVALO = float(os.environ.get('SAUDE_INTERVALO', '5'))
+SAUDE_BANCO_LENTO_MS = float(os.environ.get('SAUDE_BANCO_LENTO_MS', '100'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'ct_gouveia.desempenho': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+        'alunos.tarefas': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+# Tarefas periódicas do `manage.py executar_tarefas` (alunos/tarefas.py): (tipo, hora local
+# a partir da qual roda ou None para de hora em hora, dia do mês ou omitido para todo dia)
+TAREFAS_PERIODICAS = [
+    ('atualizar_atrasadas', None),
+    ('preparar_relatorios', 3),
+    ('limpar_tarefas', 4),
+]
+# Faturamento automático da próxima competência, no dia do mês indicado (ex.: 25)
+if os.environ.get('FATURAMENTO_AUTOMATICO_DIA'):
+    TAREFAS_PERIODICAS.append(('faturamento_mensal', 6, int(os.environ['FATURAMENTO_AUTOMATICO_DIA'])))
+
+# O primeiro carrega o perfil junto com o usuário da sessão; o ModelBackend continua
+# na lista para as sessões abertas antes dele
+AUTHENTICATION_BACKENDS = [
+    'alunos.backends.PerfilBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
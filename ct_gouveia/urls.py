@@ -18,6 +18,7 @@ from django.contrib import admin
 from django.urls import path, include
 from django.views.generic.base import RedirectView
 from alunos import views as alunos_views
+from ct_gouveia.metricas import metricas_view
 from django.conf import settings # Importa settings
 from django.conf.urls.static import static # Importa static
 
@@ -25,6 +26,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('alunos/', include('alunos.urls')),
     path('accounts/', include('django.contrib.auth.urls')),
+    path('metrics/', metricas_view, name='metricas'),
     path('', alunos_views.role_select, name='index'),
 ]
 
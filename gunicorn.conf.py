@@ -0,0 +1,84 @@
+"""Perfil do gunicorn em produção (Render): `gunicorn -c gunicorn.conf.py ct_gouveia.wsgi:application`.
+
+Com `preload_app` o master importa o Django uma única vez e aquece rotas, templates e o
+driver do banco (ct_gouveia/aquecimento.py) antes do fork; os workers herdam tudo isso
+por cópia na escrita e ficam prontos em milissegundos, em vez de cada um repetir a carga.
+Os workers são gthread: as requisições passam a maior parte do tempo esperando o banco,
+então poucas threads por processo rendem mais que processos extras na mesma memória.
+"""
+import gc
+import os
+import time
+
+INICIO = time.monotonic()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+
+preload_app = True
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Recicla os workers aos poucos (contra vazamento de memória), sem reiniciar todos juntos
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+timeout = 30
+graceful_timeout = 20
+keepalive = 5
+
+# O heartbeat dos workers em memória: num disco lento o master confunde espera de I/O com travamento
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = '-'
+errorlog = '-'
+
+
+def _ms_desde(inicio):
+    return (time.monotonic() - inicio) * 1000
+
+
+def when_ready(server):
+    """No master, com a aplicação já carregada e antes do primeiro fork."""
+    from django.db import connections
+
+    from ct_gouveia.aquecimento import aquecer_master
+
+    contagens = aquecer_master()
+    # Nenhuma conexão aberta pode ser herdada pelos workers
+    connections.close_all()
+    # O que já existe vai para a geração permanente: o coletor dos workers não toca nesses
+    # objetos, e as páginas de memória continuam compartilhadas com o master
+    gc.collect()
+    gc.freeze()
+    server.log.info(
+        'Aplicação carregada e aquecida em %.0f ms (%d rotas, %d templates)',
+        _ms_desde(INICIO), contagens['rotas'], contagens['templates'],
+    )
+
+
+def post_worker_init(worker):
+    from ct_gouveia.aquecimento import conferir_banco
+
+    try:
+        banco = f'{conferir_banco():.0f} ms'
+    except Exception as erro:  # o worker sobe mesmo assim; a /readyz/ acusa o banco fora do ar
+        worker.log.warning('Worker %s: o banco não respondeu (%s)', worker.pid, erro)
+        banco = 'indisponível'
+    worker.log.info('Worker %s pronto em %.0f ms desde o início (banco %s)', worker.pid, _ms_desde(INICIO), banco)
+    worker.primeira_requisicao = True
+
+
+def pre_request(worker, req):
+    if getattr(worker, 'primeira_requisicao', False):
+        worker.primeira_requisicao = False
+        worker.log.info('Worker %s: primeira requisição %.0f ms após o início', worker.pid, _ms_desde(INICIO))
+
+
+def worker_exit(server, worker):
+    """Soma as métricas do worker que sai (reciclado por max_requests ou no desligamento) às
+    dos workers encerrados e apaga o arquivo dele."""
+    from ct_gouveia.metricas import registro
+
+    registro.encerrar()